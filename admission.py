@@ -0,0 +1,246 @@
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+from logbook import Logger
+
+from log import logger_group
+from metrics import Metrics, NULL_METRICS
+from parsing import ParsedCommand
+from plugin import BasePlugin
+from ratelimit import TokenBucket
+from session_config import SessionConfig
+
+ADMISSION_LOG = Logger("olive.admission")
+logger_group.add_logger(ADMISSION_LOG)
+
+# Idle buckets are forgotten once there are more than this many of a kind
+MAX_IDLE_BUCKETS = 4096
+
+
+class Admission:
+    """Decides which triggered plugin calls are allowed to run.
+
+    A message that triggers plugins spends a token from its sender's bucket
+    and its room's bucket, and each plugin it triggers spends one from that
+    plugin's bucket; calls without a token are dropped rather than delayed, so
+    a flood of commands can't build up a backlog. The same command sent by
+    the same user to the same room within `duplicate_window` seconds runs
+    only once. Plugins marked
+    `expensive` are also limited to `max_expensive` calls in flight across all
+    rooms.
+    """
+
+    user_rate: float = None
+    user_burst: float = None
+    room_rate: float = None
+    room_burst: float = None
+    plugin_rate: float = None
+    plugin_burst: float = None
+    duplicate_window: float = None
+    max_expensive: int = None
+    metrics: Metrics = None
+    # Expensive plugin calls admitted and not yet finished
+    expensive_in_flight: int = 0
+
+    def __init__(
+        self,
+        user_rate: float = 0,
+        user_burst: float = 1,
+        room_rate: float = 0,
+        room_burst: float = 1,
+        plugin_rate: float = 0,
+        plugin_burst: float = 1,
+        duplicate_window: float = 0,
+        max_expensive: int = 0,
+        metrics: Metrics = None,
+    ):
+        """
+        Keyword Arguments:
+            user_rate {float} -- commands per second from one sender; 0 for
+                no limit (default: {0})
+            user_burst {float} -- commands one sender may issue at once
+                (default: {1})
+            room_rate {float} -- commands per second from one room; 0 for no
+                limit (default: {0})
+            room_burst {float} -- commands one room may issue at once
+                (default: {1})
+            plugin_rate {float} -- calls per second to one plugin; 0 for no
+                limit (default: {0})
+            plugin_burst {float} -- calls one plugin may get at once
+                (default: {1})
+            duplicate_window {float} -- seconds during which a repeated
+                command in a room is ignored; 0 to disable (default: {0})
+            max_expensive {int} -- the most expensive plugin calls running at
+                once; 0 for no limit (default: {0})
+            metrics {Metrics} -- counts rejected calls (default: {None})
+        """
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+        self.plugin_rate = plugin_rate
+        self.plugin_burst = plugin_burst
+        self.duplicate_window = duplicate_window
+        self.max_expensive = max_expensive
+        self.metrics = metrics or NULL_METRICS
+        self.__users: Dict[str, TokenBucket] = {}
+        self.__rooms: Dict[str, TokenBucket] = {}
+        self.__plugins: Dict[str, TokenBucket] = {}
+        # When each recent command was admitted, oldest first
+        self.__recent: "OrderedDict[Tuple[str, str, str, str], float]" = OrderedDict()
+        self.metrics.gauge(
+            "expensive_commands_in_flight",
+            "Expensive plugin calls running",
+            read=lambda: self.expensive_in_flight,
+        )
+
+    @classmethod
+    def from_config(
+        cls, config: SessionConfig, metrics: Metrics = None
+    ) -> "Admission":
+        """Returns an Admission with a SessionConfig's limits.
+        """
+        return cls(
+            user_rate=config.user_command_rate,
+            user_burst=config.user_command_burst,
+            room_rate=config.room_command_rate,
+            room_burst=config.room_command_burst,
+            plugin_rate=config.plugin_command_rate,
+            plugin_burst=config.plugin_command_burst,
+            duplicate_window=config.duplicate_command_window,
+            max_expensive=config.max_expensive_commands,
+            metrics=metrics,
+        )
+
+    def admit(
+        self,
+        room_id: str,
+        sender: str,
+        command: ParsedCommand,
+        calls: List[Tuple[str, BasePlugin]],
+    ) -> List[Tuple[str, BasePlugin]]:
+        """Returns the plugin calls a message may make, out of those it triggered.
+
+        Each admitted expensive call holds a slot until the task running it is
+        passed to `track` and finishes.
+
+        Arguments:
+            room_id {str} -- the room the message was sent to
+            sender {str} -- who sent the message
+            command {ParsedCommand} -- the parsed message
+            calls {List[Tuple[str, BasePlugin]]} -- the triggered plugins, by
+                name
+        """
+        now = monotonic()
+        self.__forget_commands(now)
+        text = " ".join(command)
+        calls = [
+            (name, plugin)
+            for name, plugin in calls
+            if not self.__is_duplicate((room_id, sender, name, text), now)
+        ]
+        if not calls:
+            return []
+
+        user = self.__bucket(self.__users, sender, self.user_rate, self.user_burst)
+        room = self.__bucket(self.__rooms, room_id, self.room_rate, self.room_burst)
+        if not self.__spend(user, room):
+            reason = "user" if user is not None and user.delay() > 0 else "room"
+            self.__reject(reason, calls, room_id, sender)
+            return []
+
+        admitted = []
+        for name, plugin in calls:
+            bucket = self.__bucket(
+                self.__plugins, name, self.plugin_rate, self.plugin_burst
+            )
+            expensive = plugin.expensive
+            if (
+                expensive
+                and self.max_expensive
+                and self.expensive_in_flight >= self.max_expensive
+            ):
+                self.__reject("expensive", [(name, plugin)], room_id, sender)
+                continue
+            if not self.__spend(bucket):
+                self.__reject("plugin", [(name, plugin)], room_id, sender)
+                continue
+
+            if expensive:
+                self.expensive_in_flight += 1
+            if self.duplicate_window:
+                self.__recent[(room_id, sender, name, text)] = now
+            admitted.append((name, plugin))
+        return admitted
+
+    def track(self, task: asyncio.Future) -> None:
+        """Frees an expensive call's slot once the task running it finishes.
+        """
+        task.add_done_callback(self.__release)
+
+    def __release(self, _: asyncio.Future) -> None:
+        self.expensive_in_flight = max(0, self.expensive_in_flight - 1)
+
+    def __is_duplicate(self, key: Tuple[str, str, str, str], now: float) -> bool:
+        admitted = self.__recent.get(key)
+        if admitted is None or now - admitted >= self.duplicate_window:
+            return False
+        self.metrics.counter(
+            "commands_rejected_total",
+            "Plugin calls refused by admission control, by reason",
+            reason="duplicate",
+        ).inc()
+        return True
+
+    def __forget_commands(self, now: float) -> None:
+        recent = self.__recent
+        while recent:
+            key, admitted = next(iter(recent.items()))
+            if now - admitted < self.duplicate_window:
+                break
+            del recent[key]
+
+    @staticmethod
+    def __bucket(
+        buckets: Dict[str, TokenBucket], key: str, rate: float, burst: float
+    ) -> Optional[TokenBucket]:
+        if not rate:
+            return None
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= MAX_IDLE_BUCKETS:
+                # A full bucket is the same as a new one, so it can go
+                idle = [k for k, b in buckets.items() if b.delay(b.capacity) == 0]
+                for name in idle:
+                    del buckets[name]
+            bucket = buckets[key] = TokenBucket(rate, max(1, burst))
+        return bucket
+
+    @staticmethod
+    def __spend(*buckets: Optional[TokenBucket]) -> bool:
+        # Only spend if every bucket has a token, so a refusal costs nothing
+        buckets = [bucket for bucket in buckets if bucket is not None]
+        if any(bucket.delay() > 0 for bucket in buckets):
+            return False
+        for bucket in buckets:
+            bucket.try_acquire()
+        return True
+
+    def __reject(
+        self,
+        reason: str,
+        calls: List[Tuple[str, BasePlugin]],
+        room_id: str,
+        sender: str,
+    ) -> None:
+        self.metrics.counter(
+            "commands_rejected_total",
+            "Plugin calls refused by admission control, by reason",
+            reason=reason,
+        ).inc(len(calls))
+        ADMISSION_LOG.debug(
+            f"Refused {', '.join(name for name, _ in calls)} for {sender} in "
+            + f"{room_id}: {reason} limit reached"
+        )
@@ -0,0 +1,471 @@
+"""Replays synthetic or recorded syncs through a Session to measure it.
+
+No homeserver is needed: a stand-in client feeds sync responses to the
+session's callbacks and acknowledges everything it sends. Each run reports
+message throughput, reply latency, time spent dispatching, peak memory and
+how long `load_plugins` takes, and is appended to a results file. Runs are
+compared with the last one recorded with the same parameters, so a regression
+in the dispatch path shows up as a change in its numbers.
+
+    python benchmark.py --messages 20000 --rooms 50 --commands 100
+    python benchmark.py --replay syncs.jsonl --check
+"""
+import os
+import sys
+import json
+import random
+import asyncio
+import argparse
+import resource
+import subprocess
+from datetime import datetime
+from itertools import count
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import yaml
+from logbook import NullHandler
+from nio import (
+    AsyncClient,
+    JoinResponse,
+    RoomMessageText,
+    RoomReadMarkersResponse,
+    RoomSendResponse,
+    SyncResponse,
+)
+
+from chat import Session
+from dispatch import PluginDispatcher
+from messaging import Messenger
+from plugin import BasePlugin, TextCommand
+from session_config import SessionConfig
+
+BOT_ID = "@olive:bench.invalid"
+SERVER = "bench.invalid"
+
+# Metrics where a larger value is better; for the rest, smaller is better
+HIGHER_IS_BETTER = {"messages_per_second"}
+
+
+class Echo(TextCommand):
+    trigger = ["echo"]
+    arity = (1, None)
+
+    async def process_event(self, room, event, messenger: Messenger, tokens):
+        await messenger.send_text(room.room_id, f"{event.event_id} {tokens[1]}")
+
+
+class Roll(TextCommand):
+    trigger = ["roll"]
+    arity = 1
+    arg_patterns = [r"\d+d\d+"]
+
+    async def process_event(self, room, event, messenger: Messenger, tokens):
+        dice, sides = map(int, tokens[1].split("d"))
+        total = sum(random.randint(1, sides) for _ in range(dice))
+        await messenger.send_text(room.room_id, f"{event.event_id} {total}")
+
+
+class Question(BasePlugin):
+    """Asked about every message, like plugins without a trigger are.
+    """
+
+    async def process_event(self, room, event, messenger: Messenger):
+        await messenger.send_text(room.room_id, f"{event.event_id} Good question!")
+
+    def is_triggered(self, tokens) -> bool:
+        return bool(tokens) and tokens[-1].endswith("?")
+
+
+# Message bodies for each kind of traffic in a mix
+TRAFFIC = {
+    "echo": lambda: f"echo {random.choice(['hello', 'hi there', 'olive'])}",
+    "roll": lambda: f"roll {random.randint(1, 6)}d{random.choice([6, 20])}",
+    "question": lambda: "is anybody there?",
+    "chatter": lambda: "just chatting about nothing in particular",
+}
+
+
+def filler_commands(number: int) -> Dict[str, BasePlugin]:
+    """Returns commands whose triggers never appear in the traffic.
+
+    They make the dispatcher's tables as large as a session with that many
+    plugins, without changing which messages are answered.
+    """
+
+    async def process_event(self, room, event, messenger, tokens):
+        pass
+
+    return {
+        f"Filler{index}": type(
+            f"Filler{index}",
+            (TextCommand,),
+            {
+                "trigger": [f"filler{index}"],
+                "arity": (0, 2),
+                "process_event": process_event,
+            },
+        )()
+        for index in range(number)
+    }
+
+
+def synthetic_syncs(
+    messages: int, rooms: int, batch: int, mix: Dict[str, float], seed: int
+) -> Iterator[dict]:
+    """Yields sync responses carrying `messages` messages in `rooms` rooms.
+    """
+    random.seed(seed)
+    kinds, weights = zip(*mix.items())
+    room_ids = [f"!room{index}:{SERVER}" for index in range(rooms)]
+    users = [f"@user{index}:{SERVER}" for index in range(max(2, rooms // 2))]
+    ids = count()
+
+    def event(event_type: str, sender: str, content: dict, **extra) -> dict:
+        number = next(ids)
+        return {
+            "type": event_type,
+            "event_id": f"$bench{number}",
+            "sender": sender,
+            "origin_server_ts": number,
+            "content": content,
+            **extra,
+        }
+
+    def response(timelines: Dict[str, List[dict]]) -> dict:
+        return {
+            "next_batch": f"s{next(ids)}",
+            "rooms": {
+                "join": {
+                    room_id: {"timeline": {"events": events, "limited": False}}
+                    for room_id, events in timelines.items()
+                },
+                "invite": {},
+                "leave": {},
+            },
+        }
+
+    # The first sync sets the rooms up, as a full state sync would
+    setup = {}
+    for room_id in room_ids:
+        setup[room_id] = [
+            event("m.room.create", users[0], {"creator": users[0]}, state_key=""),
+            event("m.room.member", BOT_ID, {"membership": "join"}, state_key=BOT_ID),
+        ] + [
+            event("m.room.member", user, {"membership": "join"}, state_key=user)
+            for user in users
+        ]
+    yield response(setup)
+
+    sent = 0
+    while sent < messages:
+        timelines: Dict[str, List[dict]] = {}
+        for _ in range(min(batch, messages - sent)):
+            kind = random.choices(kinds, weights)[0]
+            timelines.setdefault(random.choice(room_ids), []).append(
+                event(
+                    "m.room.message",
+                    random.choice(users),
+                    {"msgtype": "m.text", "body": TRAFFIC[kind]()},
+                )
+            )
+            sent += 1
+        yield response(timelines)
+
+
+def recorded_syncs(path: str) -> Iterator[dict]:
+    """Yields the sync responses in a file with one JSON response per line.
+    """
+    with open(path, "r") as syncs:
+        for line in syncs:
+            if line.strip():
+                yield json.loads(line)
+
+
+class FakeClient(AsyncClient):
+    """Stands in for a homeserver connection.
+
+    Syncs are answered from `syncs` and run the session's callbacks as
+    `sync_forever` would. Sends are acknowledged at once; replies naming the event they
+    answer are matched to it to measure reply latency.
+    """
+
+    def __init__(self, syncs: Iterator[dict]):
+        super().__init__(f"https://{SERVER}", BOT_ID)
+        self.restore_login(BOT_ID, "BENCHMARK", "token")
+        self.syncs = syncs
+        self.received: Dict[str, float] = {}
+        self.latencies: List[float] = []
+        self.messages = 0
+        self.sends = 0
+        self.dispatch_seconds = 0.0
+
+    async def sync(self, *args, **kwargs) -> Optional[SyncResponse]:
+        data = next(self.syncs, None)
+        if data is None:
+            return None
+
+        response = SyncResponse.from_dict(data)
+        now = perf_counter()
+        for room in response.rooms.join.values():
+            for event in room.timeline.events:
+                if isinstance(event, RoomMessageText):
+                    self.received[event.event_id] = now
+                    self.messages += 1
+
+        await self.receive_response(response)
+        self.dispatch_seconds += perf_counter() - now
+        await self.run_response_callbacks([response])
+        return response
+
+    async def room_send(
+        self, room_id: str, message_type: str, content: dict, **kwargs
+    ) -> RoomSendResponse:
+        self.sends += 1
+        event_id = content.get("body", "").split(" ", 1)[0]
+        received = self.received.pop(event_id, None)
+        if received is not None:
+            self.latencies.append(perf_counter() - received)
+        return RoomSendResponse(f"$reply{self.sends}", room_id)
+
+    async def room_read_markers(self, room_id: str, *args, **kwargs):
+        return RoomReadMarkersResponse(room_id)
+
+    async def join(self, room_id: str, *args, **kwargs):
+        return JoinResponse(room_id)
+
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def make_config(directory: str, lazy_plugins: bool) -> SessionConfig:
+    """Returns a SessionConfig read from a config.yml written to `directory`.
+    """
+    settings = {
+        "username": "olive",
+        "password": "unused",
+        "base_url": SERVER,
+        "next_batch_file": "next_batch",
+        "session_file": "session.json",
+        "lazy_plugins": lazy_plugins,
+        # Sending is instant here; don't let the rate limit hide dispatch costs
+        "send_rate": 1e9,
+        "send_burst": 1e9,
+        "send_queue_size": 1e6,
+        # Synthetic senders repeat themselves far faster than people do
+        "user_command_rate": 0,
+        "room_command_rate": 0,
+        "plugin_command_rate": 0,
+        "duplicate_command_window": 0,
+        # Recorded syncs are old; answer them all
+        "catch_up_policy": "all",
+        "loop_stall_threshold": 0,
+    }
+    with open(os.path.join(directory, "config.yml"), "w") as config_file:
+        yaml.safe_dump(settings, config_file)
+    return SessionConfig()
+
+
+async def run(options: argparse.Namespace) -> Dict[str, float]:
+    if options.replay:
+        syncs = recorded_syncs(options.replay)
+    else:
+        syncs = synthetic_syncs(
+            options.messages, options.rooms, options.batch, options.mix, options.seed
+        )
+
+    client = FakeClient(syncs)
+    session = Session(make_config(os.getcwd(), options.lazy_plugins), client=client)
+
+    # Startup, measured on the real plugins directory. Each load starts with
+    # no modules imported, as a new process would, rather than reusing them.
+    load_seconds = 0.0
+    for _ in range(options.load_repeats):
+        session.shared.modules.clear()
+        start = perf_counter()
+        session.load_plugins()
+        load_seconds += perf_counter() - start
+    load_seconds /= options.load_repeats
+
+    plugins = {"Echo": Echo(), "Roll": Roll(), "Question": Question()}
+    plugins.update(filler_commands(options.commands))
+    session.plugins, session.dispatcher = plugins, PluginDispatcher(plugins)
+
+    # Set the rooms up before timing anything
+    await client.sync()
+
+    start = perf_counter()
+    interval = options.batch / options.rate if options.rate else 0
+    for index in count(1):
+        if await client.sync() is None:
+            break
+        # A real sync gives the loop to running plugins while it waits
+        delay = start + index * interval - perf_counter() if interval else 0
+        await asyncio.sleep(max(0, delay))
+    await session.ingest.join()
+    await session.runner.drain()
+    await session.messenger.flush()
+    await session.messenger.queue.close()
+    elapsed = perf_counter() - start
+
+    await session.close()
+
+    latencies = client.latencies
+    return {
+        "messages": client.messages,
+        "replies": len(latencies),
+        "seconds": round(elapsed, 4),
+        "messages_per_second": round(client.messages / elapsed, 1),
+        "dispatch_us_per_message": round(
+            client.dispatch_seconds / max(1, client.messages) * 1e6, 2
+        ),
+        "reply_p50_ms": round((percentile(latencies, 50) or 0) * 1000, 3),
+        "reply_p99_ms": round((percentile(latencies, 99) or 0) * 1000, 3),
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+        "load_plugins_ms": round(load_seconds * 1000, 3),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        ).stdout.decode("utf8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_result(path: str, parameters: dict) -> Optional[dict]:
+    """Returns the last result recorded in `path` with the same parameters.
+    """
+    try:
+        with open(path, "r") as results:
+            matching = [
+                record
+                for record in map(json.loads, filter(str.strip, results))
+                if record.get("parameters") == parameters
+            ]
+    except FileNotFoundError:
+        return None
+    return matching[-1] if matching else None
+
+
+def compare(
+    results: Dict[str, float], previous: dict, tolerance: float
+) -> List[Tuple[str, float]]:
+    """Prints each result's change since `previous`; returns regressions.
+    """
+    regressions = []
+    print(f"Compared with {previous.get('commit') or 'unknown'} ({previous['date']}):")
+    for name, value in results.items():
+        before = previous["results"].get(name)
+        if not before or name in ("messages", "replies"):
+            continue
+
+        change = (value - before) / before * 100
+        worse = -change if name in HIGHER_IS_BETTER else change
+        flag = ""
+        if name != "peak_rss_mb" and worse > tolerance:
+            flag = "  <-- regression"
+            regressions.append((name, change))
+        print(f"  {name:>24}: {before:>12} -> {value:>12} ({change:+.1f}%){flag}")
+    return regressions
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in TRAFFIC:
+            raise argparse.ArgumentTypeError(
+                f"Unknown traffic {kind!r}; choose from {', '.join(TRAFFIC)}"
+            )
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=50, help="messages per sync")
+    parser.add_argument(
+        "--rate", type=float, default=0, help="messages per second; 0 for no limit"
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=parse_mix("echo=3,roll=1,question=1,chatter=5"),
+        help="relative weights of each kind of traffic, such as echo=1,chatter=4",
+    )
+    parser.add_argument(
+        "--commands", type=int, default=50, help="extra commands never triggered"
+    )
+    parser.add_argument("--lazy-plugins", action="store_true")
+    parser.add_argument("--load-repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--replay", help="a file of recorded sync responses, one JSON per line"
+    )
+    parser.add_argument("--results", default="benchmark_results.jsonl")
+    parser.add_argument(
+        "--tolerance", type=float, default=10, help="percent change allowed"
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="exit with 1 on any regression"
+    )
+    options = parser.parse_args()
+
+    # Logging every message would dominate the measurements
+    NullHandler().push_application()
+
+    parameters = {
+        name: value
+        for name, value in vars(options).items()
+        if name not in ("results", "tolerance", "check")
+    }
+    results_path = os.path.abspath(options.results)
+    if options.replay:
+        options.replay = os.path.abspath(options.replay)
+
+    with TemporaryDirectory() as directory:
+        # The session keeps its files in the working directory
+        working_directory = os.getcwd()
+        os.chdir(directory)
+        try:
+            results = asyncio.get_event_loop().run_until_complete(run(options))
+        finally:
+            os.chdir(working_directory)
+
+    for name, value in results.items():
+        print(f"{name:>26}: {value}")
+
+    previous = previous_result(results_path, parameters)
+    regressions = compare(results, previous, options.tolerance) if previous else []
+
+    with open(results_path, "a") as results_file:
+        record = {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "parameters": parameters,
+            "results": results,
+        }
+        results_file.write(json.dumps(record) + "\n")
+
+    if options.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
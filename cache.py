@@ -0,0 +1,143 @@
+import os
+import json
+import asyncio
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+from time import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from logbook import Logger
+
+from executor import run_blocking
+from log import logger_group
+
+CACHE_LOG = Logger("olive.cache")
+logger_group.add_logger(CACHE_LOG)
+
+_MISSING = object()
+
+
+class AsyncCache:
+    """A size-bounded cache whose entries expire after `ttl` seconds.
+
+    When full, the least recently used entry is evicted. Concurrent lookups
+    of the same missing key share a single fetch. A cache with a `path` is
+    loaded from that file when created and written back by `save`; its keys
+    and values must then be JSON serializable.
+    """
+
+    ttl: float = None
+    max_size: int = None
+    path: Optional[str] = None
+    entries: "OrderedDict[str, Tuple[float, Any]]" = None
+    hits: int = 0
+    misses: int = 0
+    # Lookups that waited on another caller's fetch of the same key
+    shared: int = 0
+
+    def __init__(self, ttl: float, max_size: int, path: Optional[str] = None):
+        """
+        Arguments:
+            ttl {float} -- seconds an entry stays valid
+            max_size {int} -- the most entries kept
+
+        Keyword Arguments:
+            path {str} -- a file to persist entries in (default: {None})
+        """
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self.path = path
+        self.entries = OrderedDict()
+        self.__inflight: Dict[str, asyncio.Future] = {}
+
+        if path is not None:
+            self.__load()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Returns the unexpired value for `key`, or `default`.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+
+        expires_at, value = entry
+        if expires_at <= time():
+            del self.entries[key]
+            return default
+
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.entries[key] = (time() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable]) -> Any:
+        """Returns the value for `key`, awaiting `fetch()` to fill it on a miss.
+
+        If another caller is already fetching `key`, waits for that fetch
+        instead of starting a second one. Exceptions from `fetch` reach every
+        waiting caller and nothing is cached.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        task = self.__inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self.__inflight[key] = asyncio.ensure_future(self.__fill(key, fetch))
+        else:
+            self.shared += 1
+
+        return await asyncio.shield(task)
+
+    async def save(self) -> None:
+        """Writes unexpired entries to the cache's file, off the event loop.
+        """
+        if self.path is None:
+            return
+
+        now = time()
+        entries = [
+            [key, expires_at, value]
+            for key, (expires_at, value) in self.entries.items()
+            if expires_at > now
+        ]
+        await run_blocking(self.__write, json.dumps(entries))
+
+    async def __fill(self, key: str, fetch: Callable[[], Awaitable]) -> Any:
+        try:
+            value = await fetch()
+            self.set(key, value)
+            return value
+        finally:
+            del self.__inflight[key]
+
+    def __load(self) -> None:
+        try:
+            with open(self.path, "r") as cache_file:
+                entries = json.load(cache_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as err:
+            CACHE_LOG.warning(f"Ignoring unreadable cache file {self.path}: {err}")
+            return
+
+        now = time()
+        for key, expires_at, value in entries[-self.max_size :]:
+            if expires_at > now:
+                self.entries[key] = (expires_at, value)
+
+    def __write(self, data: str) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with NamedTemporaryFile("w", dir=directory, delete=False) as temp_file:
+            temp_file.write(data)
+        os.replace(temp_file.name, self.path)
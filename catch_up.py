@@ -0,0 +1,178 @@
+import asyncio
+from collections import deque
+from time import time
+from typing import Callable, Deque, Dict, Tuple
+
+from logbook import Logger
+from nio import MatrixRoom, RoomMessageText
+
+from log import logger_group
+from metrics import Metrics, NULL_METRICS
+from ratelimit import TokenBucket
+
+CATCH_UP_LOG = Logger("olive.catch_up")
+logger_group.add_logger(CATCH_UP_LOG)
+
+POLICIES = ("all", "skip", "latest", "throttle")
+
+Backlogged = Tuple[MatrixRoom, RoomMessageText, Callable[[], None], Callable[[], None]]
+
+
+class CatchUp:
+    """Decides what to do with commands sent while the bot wasn't running.
+
+    A command is part of the backlog when it's more than `max_age` seconds
+    old by the time it arrives, as happens when a session resumes from an old
+    sync token. What happens to the backlog depends on the policy:
+
+    - "all" runs every command, as though it had just been sent
+    - "skip" ignores them
+    - "latest" runs only the most recent command in each room, at the end of
+      the sync batch, unless the batch also brings a new command to the room
+    - "throttle" runs them in order, at most `rate` per second, dropping the
+      oldest once more than `max_queued` are waiting
+
+    Commands that aren't part of the backlog always run straight away.
+    """
+
+    policy: str = None
+    max_age: float = None
+    rate: float = None
+    max_queued: int = None
+    metrics: Metrics = None
+    # The latest backlogged command in each room, for the "latest" policy
+    latest: Dict[str, Backlogged] = None
+    # Backlogged commands waiting their turn, for the "throttle" policy
+    queued: Deque[Backlogged] = None
+
+    def __init__(
+        self,
+        policy: str = "all",
+        max_age: float = 120,
+        rate: float = 1,
+        max_queued: int = 100,
+        metrics: Metrics = None,
+    ):
+        """
+        Keyword Arguments:
+            policy {str} -- all, skip, latest or throttle (default: {"all"})
+            max_age {float} -- seconds after which a command is backlog
+                (default: {120})
+            rate {float} -- backlogged commands run per second when
+                throttled (default: {1})
+            max_queued {int} -- the most backlogged commands waiting when
+                throttled (default: {100})
+            metrics {Metrics} -- counts backlogged commands (default: {None})
+
+        Raises:
+            ValueError -- if the policy isn't one of the above
+        """
+        if policy not in POLICIES:
+            raise ValueError(
+                f"Unknown catch up policy {policy!r}; use one of {', '.join(POLICIES)}"
+            )
+        self.policy = policy
+        self.max_age = max_age
+        self.rate = rate
+        self.max_queued = max_queued
+        self.metrics = metrics or NULL_METRICS
+        self.latest = {}
+        self.queued = deque()
+        self.__bucket = TokenBucket(max(rate, 1e-3), 1)
+        self.__draining: asyncio.Task = None
+        self.__skipped = 0
+
+    def defer(
+        self,
+        room: MatrixRoom,
+        event: RoomMessageText,
+        run: Callable[[], None],
+        drop: Callable[[], None] = None,
+    ) -> bool:
+        """Takes charge of a command if it's part of the backlog.
+
+        Returns False if the caller should run the command now; otherwise,
+        `run` is called later, or `drop` if the policy decides against it.
+        Neither is called for commands still waiting when closed.
+
+        Arguments:
+            room {MatrixRoom} -- the room the command was sent to
+            event {RoomMessageText} -- the command
+            run {Callable} -- runs the plugins the command triggered
+
+        Keyword Arguments:
+            drop {Callable} -- called if the command is skipped, superseded
+                or dropped (default: {None})
+        """
+        drop = drop or (lambda: None)
+        if self.policy == "all":
+            return False
+        if time() - event.server_timestamp / 1000 < self.max_age:
+            # A new command supersedes the room's backlog
+            superseded = self.latest.pop(room.room_id, None)
+            if superseded is not None:
+                self.__count("superseded")
+                superseded[3]()
+            return False
+
+        if self.policy == "skip":
+            self.__skipped += 1
+            self.__count("skipped")
+            drop()
+        elif self.policy == "latest":
+            superseded = self.latest.get(room.room_id)
+            if superseded is not None:
+                self.__count("superseded")
+                superseded[3]()
+            self.latest[room.room_id] = (room, event, run, drop)
+        else:
+            if len(self.queued) == self.max_queued:
+                _, _, _, drop_oldest = self.queued.popleft()
+                self.__count("dropped")
+                drop_oldest()
+            self.queued.append((room, event, run, drop))
+            if self.__draining is None or self.__draining.done():
+                self.__draining = asyncio.ensure_future(self.__drain())
+        return True
+
+    def end_of_batch(self) -> None:
+        """Runs the latest backlogged command of each room seen in the batch.
+        """
+        if self.__skipped:
+            CATCH_UP_LOG.info(f"Skipped {self.__skipped} old command(s)")
+            self.__skipped = 0
+        if not self.latest:
+            return
+
+        latest, self.latest = list(self.latest.values()), {}
+        CATCH_UP_LOG.info(f"Running the latest old command in {len(latest)} room(s)")
+        for _, _, run, _ in latest:
+            self.__count("run")
+            run()
+
+    async def close(self) -> None:
+        """Stops running throttled commands, dropping any still waiting.
+        """
+        if self.__draining is not None:
+            self.__draining.cancel()
+            await asyncio.gather(self.__draining, return_exceptions=True)
+        self.queued.clear()
+        self.latest.clear()
+
+    async def __drain(self) -> None:
+        CATCH_UP_LOG.info("Working through old commands")
+        while self.queued:
+            await self.__bucket.acquire()
+            if not self.queued:
+                break
+            _, _, run, _ = self.queued.popleft()
+            self.__count("run")
+            run()
+        CATCH_UP_LOG.info("Caught up on old commands")
+
+    def __count(self, outcome: str) -> None:
+        self.metrics.counter(
+            "backlog_commands_total",
+            "Commands older than the catch up age, by what became of them",
+            outcome=outcome,
+        ).inc()
@@ -1,11 +1,10 @@
 import sys
 import os
-import importlib
-import inspect
+import json
 import asyncio
-import traceback
 from datetime import datetime
-from typing import Dict, List
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 
 from nio import (
     AsyncClient,
@@ -14,22 +13,39 @@ from nio import (
     LoginError,
     MatrixRoom,
     MatrixInvitedRoom,
-    ReceiptEvent,
     RoomMessageText,
-    RoomSendError,
-    SendRetryError,
+    SyncError,
     SyncResponse,
-    logger_group as nio_logger_group,
-    log as nio_log,
+    UploadFilterResponse,
 )
-from logbook import Logger, StreamHandler, INFO
+from logbook import Logger, lookup_level
 
 from plugin import BasePlugin, PluginConfig
+from cache import AsyncCache
+from http_client import HttpClient
+from dispatch import PluginDispatcher
+from parsing import ParsedCommand
+from plugin_loader import PluginLoader, PluginWatcher
+from runner import PluginRunner
+from admission import Admission
+from catch_up import CatchUp
+from ingest import IngestQueue
+from executor import LoopStallDetector
+from checkpoint import Checkpointer
+from state_store import RoomStateStore
+from seen_events import SeenEvents
+from sync_filter import build_sync_filter
+from read_markers import ReadMarkerAggregator
+from invites import InviteJoiner
 from messaging import Messenger
+from send_queue import SendQueue
 from session_config import SessionConfig
-from log import logger_group
+from shared import SharedResources
+from metrics import Metrics, MetricsExporter, NULL_METRICS
+from log import LogLimiter, logger_group, plugin_logger, setup_logging
 
 CORE_LOG = Logger("olive.core")
+logger_group.add_logger(CORE_LOG)
 OUTPUT_NIO_LOGS = False
 
 
@@ -37,137 +53,446 @@ class Session:
     client: AsyncClient = None
     config: SessionConfig = None
     plugins: Dict[str, BasePlugin] = None
+    caches: Dict[str, AsyncCache] = None
+    http: HttpClient = None
+    shared: SharedResources = None
+    loader: PluginLoader = None
+    watcher: PluginWatcher = None
+    dispatcher: PluginDispatcher = None
+    runner: PluginRunner = None
+    stall_detector: LoopStallDetector = None
+    checkpointer: Checkpointer = None
+    state_store: RoomStateStore = None
+    read_markers: ReadMarkerAggregator = None
+    invites: InviteJoiner = None
+    metrics: Metrics = None
+    exporter: MetricsExporter = None
     messenger: Messenger = None
-    loggers: List[Logger] = []
-
-    def __init__(self, config: SessionConfig):
+    admission: Admission = None
+    catch_up: CatchUp = None
+    ingest: IngestQueue = None
+    seen_events: SeenEvents = None
+
+    def __init__(
+        self,
+        config: SessionConfig,
+        client: AsyncClient = None,
+        shared: SharedResources = None,
+    ):
+        """
+        Arguments:
+            config {SessionConfig} -- the session's settings
+
+        Keyword Arguments:
+            client {AsyncClient} -- the client to use instead of connecting to
+                the configured homeserver, such as a stand-in for benchmarks
+                (default: {None})
+            shared {SharedResources} -- plugin modules, caches and pools
+                shared with other sessions in the process; the session
+                creates, and closes, its own by default (default: {None})
+        """
         self.config = config
-        self.client = AsyncClient(config.homeserver, config.matrix_id)
-        try:
-            with open(config.next_batch_file, "r") as next_batch_token:
-                self.client.next_batch = next_batch_token.read()
-        except FileNotFoundError:
-            # No existing next_batch file; no worries.
-            self.client.next_batch = 0
+        self.__owns_shared = shared is None
+        self.shared = shared or SharedResources.from_config(config)
+        self.__syncing: Optional[asyncio.Task] = None
+        self.__closed = False
+        self.metrics = Metrics() if config.metrics else NULL_METRICS
+        self.exporter = MetricsExporter(
+            self.metrics,
+            port=config.metrics_port,
+            log_interval=config.metrics_log_interval,
+        )
+        self.caches = self.shared.caches
+        self.http = self.shared.http
+        self.client = client or AsyncClient(config.homeserver, config.matrix_id)
+        self.state_store = RoomStateStore(config.state_store_file)
+        self.checkpointer = Checkpointer(
+            config.next_batch_file,
+            config.next_batch_interval,
+            snapshot=lambda token: self.state_store.prepare(self.client, token),
+        )
+        # With no existing next_batch file, we start fresh; no worries.
+        self.client.next_batch = self.checkpointer.load() or 0
+        self.seen_events = SeenEvents(config.seen_events_file, config.seen_events_size)
+        self.read_markers = ReadMarkerAggregator(
+            self.client, config.read_marker_debounce
+        )
+        self.invites = InviteJoiner(self.client, config.join_concurrency, self.__greet)
 
         # Update next_batch every sync
         self.client.add_response_callback(self.__sync_cb, SyncResponse)
+        # Log in again if a resumed session has expired
+        self.client.add_response_callback(self.__sync_error_cb, SyncError)
         # Handle text messages
         self.client.add_event_callback(self.__message_cb, RoomMessageText)
         # Handle invites
         self.client.add_event_callback(self.__autojoin_room_cb, InviteEvent)
 
-        self.client.add_ephemeral_callback(self.sample, ReceiptEvent)
-
         self.load_plugins()
-        self.messenger = Messenger(self.client)
+        self.runner = PluginRunner(
+            config.plugin_concurrency, config.plugin_timeout, metrics=self.metrics
+        )
+        self.admission = Admission.from_config(config, metrics=self.metrics)
+        # The sync token is only saved once the sync's messages are handled
+        self.ingest = IngestQueue(
+            config.ingest_workers,
+            config.ingest_queue_size,
+            metrics=self.metrics,
+            handled=self.checkpointer.update,
+        )
+        self.catch_up = CatchUp(
+            config.catch_up_policy,
+            max_age=config.catch_up_age,
+            rate=config.catch_up_rate,
+            metrics=self.metrics,
+        )
+        self.stall_detector = LoopStallDetector(
+            config.loop_stall_threshold,
+            os.path.join(os.path.dirname(__file__), "plugins"),
+        )
+        self.messenger = Messenger(
+            self.client,
+            SendQueue(
+                self.client,
+                rate=config.send_rate,
+                burst=config.send_burst,
+                max_size=config.send_queue_size,
+                overflow=config.send_overflow,
+                max_retries=config.send_retries,
+            ),
+            coalesce_window=config.coalesce_window,
+            metrics=self.metrics,
+        )
+        self.__instrument()
 
-    async def sample(self, room: MatrixRoom, event: ReceiptEvent) -> None:
-        CORE_LOG.info(room.read_receipts)
+    def __instrument(self) -> None:
+        """Creates the metrics recorded by the session's own callbacks.
+        """
+        metrics = self.metrics
+        self.__sync_time = metrics.histogram(
+            "sync_seconds",
+            "Sync round-trip time, including waiting for new events",
+            buckets=(0.1, 0.5, 1, 5, 10, 20, 30, 35, 60),
+        )
+        self.__sync_events = metrics.histogram(
+            "sync_events",
+            "Timeline events in each sync",
+            buckets=(0, 1, 5, 10, 50, 100, 500, 1000),
+        )
+        self.__messages = metrics.counter("messages_total", "Text messages received")
+        metrics.counter(
+            "duplicate_events_total",
+            "Messages dropped for having been handled already",
+            read=lambda: self.seen_events.duplicates,
+        )
+        self.__dispatch_time = metrics.histogram(
+            "dispatch_seconds", "Time to parse and route a message to plugins"
+        )
 
-    async def start(self) -> None:
+        queue = self.messenger.queue
+        metrics.gauge(
+            "send_queue_depth", "Events waiting to be sent", read=lambda: queue.depth
+        )
+        metrics.gauge(
+            "send_queue_latency_seconds",
+            "Recent time from queueing an event until it was sent",
+            read=lambda: queue.latency(50),
+            quantile="0.5",
+        )
+        metrics.gauge(
+            "send_queue_latency_seconds",
+            read=lambda: queue.latency(99),
+            quantile="0.99",
+        )
+        for outcome in ("sent", "failed", "dropped"):
+            metrics.counter(
+                "send_queue_events_total",
+                "Events leaving the send queue, by outcome",
+                read=lambda outcome=outcome: getattr(queue, outcome),
+                outcome=outcome,
+            )
+
+    async def start(self, prune_devices: bool = False) -> None:
         """Start the session.
 
-        Logs in as the user provided in the config and begins listening for
-        events to respond to. For security, it will logout any other
-        sessions.
+        Resumes the login saved in the session file, or logs in as the user
+        provided in the config, and begins listening for events to respond
+        to.
+
+        Keyword Arguments:
+            prune_devices {bool} -- for security, log out every other session
+                of the bot's account before syncing (default: {False})
         """
 
-        login_status = await self.client.login(
-            password=self.config.password, device_name="remote-bot"
+        if not self.__restore_login() and not await self.__login():
+            await self.close()
+            return
+
+        if prune_devices:
+            await self.prune_devices()
+
+        if self.config.loop_stall_threshold > 0:
+            self.stall_detector.start()
+        if self.metrics.enabled:
+            await self.exporter.start()
+        if self.config.hot_reload:
+            self.watcher = PluginWatcher(
+                self.loader, self.config.hot_reload_interval, self.reload_plugins
+            )
+            self.watcher.start()
+
+        sync_filter = await self.__sync_filter()
+
+        # Resume from the saved room state if it's current with next_batch;
+        # otherwise, force a full state sync to load Room info.
+        if not (
+            self.client.next_batch
+            and self.state_store.load(self.client, self.client.next_batch)
+        ):
+            response = await self.client.sync(full_state=True, sync_filter=sync_filter)
+            if isinstance(response, SyncError):
+                if not await self.__handle_sync_error(response):
+                    await self.close()
+                    return
+                await self.client.sync(full_state=True, sync_filter=sync_filter)
+            self.state_store.rebuild(self.client.rooms)
+
+        self.__syncing = asyncio.ensure_future(
+            self.client.sync_forever(timeout=30000, sync_filter=sync_filter)
         )
-        if isinstance(login_status, LoginError):
-            print(f"Failed to login: {login_status}", file=sys.stderr)
-            await self.stop()
-        else:
-            # Remove previously registered devices; ignore this device
-            maybe_devices = await self.client.devices()
-            if isinstance(maybe_devices, DevicesResponse):
-                await self.client.delete_devices(
-                    list(
-                        map(
-                            lambda x: x.id,
-                            filter(
-                                lambda x: x.id != self.client.device_id,
-                                maybe_devices.devices,
-                            ),
-                        )
-                    ),
-                    auth={
-                        "type": "m.login.password",
-                        "user": self.config.matrix_id,
-                        "password": self.config.password,
-                    },
-                )
-
-            CORE_LOG.info(login_status)
-
-        # Force a full state sync to load Room info
-        await self.client.sync(full_state=True)
-        await self.client.sync_forever(timeout=30000)
+        try:
+            await self.__syncing
+        except asyncio.CancelledError:
+            if not self.__closed:
+                raise
 
     async def stop(self) -> None:
         """Politely closes the session and ends the process.
-        
-        If logged in, logs out.
         """
-        print("Shutting down...")
-        if self.client.logged_in:
+        await self.close()
+        sys.exit(0)
+
+    async def close(self) -> None:
+        """Politely closes the session, leaving the process running.
+
+        Stops syncing, waits for running plugins to finish and saves the
+        latest sync token. If logged in without a session file to resume
+        from, logs out. Resources the session created rather than shared,
+        such as its caches, are saved and closed too.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+
+        CORE_LOG.info(f"Shutting down {self.config.matrix_id}...")
+        if self.__syncing is not None and self.__syncing is not asyncio.current_task():
+            self.__syncing.cancel()
+        if self.watcher:
+            self.watcher.stop()
+        await self.catch_up.close()
+        # The saved sync token is past the queued events; finish them first.
+        await self.ingest.join()
+        await self.ingest.close()
+        await self.runner.drain()
+        await self.invites.close()
+        await self.messenger.flush()
+        await self.messenger.queue.close()
+        await self.read_markers.close()
+        await self.seen_events.flush()
+        await self.checkpointer.close()
+        self.state_store.close()
+        self.stall_detector.stop()
+        await self.exporter.stop()
+        if self.__owns_shared:
+            await self.shared.close()
+        if self.client.logged_in and not self.config.session_file:
             await self.client.logout()
         await self.client.close()
-        sys.exit(0)
+
+    async def prune_devices(self) -> None:
+        """Logs out every other device of the bot's account.
+
+        This is a maintenance operation; run it occasionally, such as with
+        `--prune-devices`, rather than on every start.
+        """
+        # Remove previously registered devices; ignore this device
+        maybe_devices = await self.client.devices()
+        if isinstance(maybe_devices, DevicesResponse):
+            await self.client.delete_devices(
+                list(
+                    map(
+                        lambda x: x.id,
+                        filter(
+                            lambda x: x.id != self.client.device_id,
+                            maybe_devices.devices,
+                        ),
+                    )
+                ),
+                auth={
+                    "type": "m.login.password",
+                    "user": self.config.matrix_id,
+                    "password": self.config.password,
+                },
+            )
 
     def load_plugins(self) -> None:
         """Dynamically loads all plugins from the plugins directory.
 
         New plugins can be added by creating new classes in the `plugins` module.
+        With `lazy_plugins` set, plugins whose triggers can be read from their
+        source are only imported once one of those triggers fires.
         """
-        self.plugins = {}
-        importlib.import_module("plugins")
-        modules = []
-        plugin_files = os.listdir(os.path.join(os.path.dirname(__file__), "plugins"))
-        if len(plugin_files) == 0:
-            print("NOTE: No plugin files found.")
-
-        for plugin in plugin_files:
-            if plugin.startswith("__") or not plugin.endswith(".py"):
-                # Skip files like __init__.py and .gitignore
+        self.loader = PluginLoader(
+            os.path.join(os.path.dirname(__file__), "plugins"),
+            self.__plugin_config,
+            modules=self.shared.modules,
+        )
+        self.plugins = self.loader.load_all(lazy=self.config.lazy_plugins)
+        self.dispatcher = PluginDispatcher(self.plugins)
+        self.loader.report()
+        CORE_LOG.info("Loaded plugins")
+
+    async def reload_plugins(self, module_names: Set[str]) -> None:
+        """Reloads the given plugin modules while the session keeps syncing.
+
+        The new plugins and dispatch tables are swapped in together, so new
+        messages go to the new code at once; messages still waiting in the
+        ingest or catch up queues are dispatched again when their turn comes.
+        Then waits, for up to the plugin timeout, for the replaced plugins to
+        finish the events they were already handling. Plugins from a module
+        that fails to import keep running their old code.
+        """
+        plugins = dict(self.plugins)
+        retired = set()
+        for module_name in module_names:
+            replacements = self.loader.load_module(
+                module_name, lazy=self.config.lazy_plugins
+            )
+            if replacements is None:
+                CORE_LOG.error(f"Keeping the running version of {module_name}")
                 continue
 
-            module_name = "plugins." + plugin.rsplit(".")[0]
-            modules.append(importlib.import_module(module_name, package="plugins"))
+            for name, plugin in self.plugins.items():
+                if self.loader.module_of(plugin) == module_name:
+                    del plugins[name]
+                    retired.add(name)
+            plugins.update(replacements)
+            CORE_LOG.info(
+                f"Reloaded {module_name}: {', '.join(replacements) or 'no plugins'}"
+            )
 
-        for module in modules:
-            if module.__name__ in sys.modules:
-                importlib.reload(module)
+        # Swap both together so no event sees one without the other.
+        self.plugins, self.dispatcher = plugins, PluginDispatcher(plugins)
 
-            clsmembers = inspect.getmembers(
-                module,
-                lambda member: inspect.isclass(member)
-                and member.__module__ == module.__name__,
+        # Only calls made before the swap; none can reach the old plugins now
+        pending = self.runner.in_flight(retired)
+        if pending:
+            _, pending = await asyncio.wait(
+                pending, timeout=self.config.plugin_timeout or None
+            )
+        if pending:
+            CORE_LOG.warning(
+                f"{len(pending)} call(s) to replaced plugins are still running"
             )
 
-            for name, cls in clsmembers:
-                if not issubclass(cls, BasePlugin):
-                    # We only want plugins that derive from BasePlugin
-                    CORE_LOG.warn(
-                        f"Skipping {name} as it doesn't derive from the BasePlugin"
-                    )
-                    continue
-                CORE_LOG.info(f"Loading plugin {name} ...")
+    def __plugin_config(self, name: str) -> PluginConfig:
+        # Each plugin logs through its own logger
+        logger = plugin_logger(name)
+        logger.info(f"{name}'s logger is working hard!")
+
+        # Generate standard config
+        return PluginConfig(
+            logger,
+            cache_dir=self.config.cache_dir,
+            caches=self.caches,
+            http=self.http,
+        )
 
-                # Create logger for each plugin
-                plugin_logger = Logger(f"olive.plugin.{name}")
-                plugin_logger.info(f"{name}'s logger is working hard!")
-                logger_group.add_logger(plugin_logger)
+    def __restore_login(self) -> bool:
+        """Resumes the login saved in the session file; returns whether it did.
+        """
+        if not self.config.session_file:
+            return False
+        try:
+            with open(self.config.session_file, "r") as session_file:
+                saved = json.load(session_file)
+            homeserver, user_id = saved["homeserver"], saved["user_id"]
+            device_id, access_token = saved["device_id"], saved["access_token"]
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            CORE_LOG.warning(f"Ignoring unusable session file: {err!r}")
+            return False
 
-                # Generate standard config
-                config = PluginConfig(plugin_logger)
+        if homeserver != self.config.homeserver or user_id != self.config.matrix_id:
+            return False
 
-                # Instantiate the plugin!
-                self.plugins[name] = cls(config)
+        self.client.restore_login(user_id, device_id, access_token)
+        CORE_LOG.info(f"Resumed session on device {self.client.device_id}")
+        return True
 
-        CORE_LOG.info("Loaded plugins")
+    async def __login(self) -> bool:
+        """Logs in with the configured password, saving the new login to the
+        session file; returns whether it succeeded.
+        """
+        login_status = await self.client.login(
+            password=self.config.password, device_name="remote-bot"
+        )
+        if isinstance(login_status, LoginError):
+            CORE_LOG.error(f"Failed to login: {login_status}")
+            return False
+
+        CORE_LOG.info(login_status)
+        if self.config.session_file:
+            saved = {
+                "homeserver": self.config.homeserver,
+                "user_id": self.client.user_id,
+                "device_id": self.client.device_id,
+                "access_token": self.client.access_token,
+            }
+            # The access token is a password; keep it readable by us alone.
+            descriptor = os.open(
+                self.config.session_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with open(descriptor, "w") as session_file:
+                json.dump(saved, session_file)
+        return True
+
+    async def __sync_filter(self) -> Optional[Union[str, Dict[str, Any]]]:
+        """Returns the filter to sync with: the ID of an uploaded filter built
+        from the registered callbacks and plugins, or the filter itself if it
+        couldn't be uploaded. Returns None when filtering is turned off.
+        """
+        if not self.config.sync_filter:
+            return None
+
+        sync_filter = build_sync_filter(
+            self.client,
+            self.plugins.values(),
+            lazy_load_members=self.config.lazy_load_members,
+        )
+        response = await self.client.upload_filter(**sync_filter)
+        if isinstance(response, UploadFilterResponse):
+            return response.filter_id
+        CORE_LOG.warning(
+            f"Couldn't upload the sync filter, sending it with each sync: {response}"
+        )
+        return sync_filter
+
+    async def __sync_error_cb(self, response: SyncError) -> None:
+        if not await self.__handle_sync_error(response):
+            # Closing cancels the sync loop this callback runs in.
+            asyncio.ensure_future(self.close())
+
+    async def __handle_sync_error(self, response: SyncError) -> bool:
+        """Logs in again if the session's token was revoked; returns False if
+        the session can't continue.
+        """
+        if response.status_code == "M_UNKNOWN_TOKEN":
+            # The saved login was revoked; the next sync uses the new token.
+            CORE_LOG.warning("Saved session is no longer valid; logging in again")
+            return await self.__login()
+        return True
 
     async def __send(
         self, room: MatrixRoom, body: str = None, content: dict = None
@@ -176,81 +501,155 @@ class Session:
         assert body or content
         if not content:
             content = {"msgtype": "m.text", "body": body}
-        try:
-            send_status = await self.client.room_send(
-                room.room_id, message_type="m.room.message", content=content
-            )
-        except SendRetryError as err:
-            print(f"Failed to send message '{body}' to room '{room}'. Error:\n{err}")
-            return False
-
-        if isinstance(send_status, RoomSendError):
-            print(send_status)
-            return False
-
-        return True
+        return await self.messenger.send(room.room_id, content) is not None
 
     async def __autojoin_room_cb(
         self, room: MatrixInvitedRoom, event: InviteEvent
     ) -> None:
-        if room.room_id not in self.client.rooms:
-            await self.client.join(room.room_id)
-            await self.__send(room, f"Hello, {room.display_name}!")
+        self.invites.invite(room)
 
-            # TODO: Replace forced client sync. I'd like to avoid handling the
-            # Invite event three times, but dont' want to force syncs. Probably
-            # not common enought to matter?
-            await self.client.sync(300)
+    async def __greet(self, room: MatrixInvitedRoom) -> None:
+        await self.__send(room, f"Hello, {room.display_name}!")
 
     async def __message_cb(self, room: MatrixRoom, event: RoomMessageText):
         """Executes any time a MatrixRoom the bot is in receives a RoomMessageText.
 
-        On each message, it tests each plugin to see if it is triggered by the
-        event; if so, the method will run that plugins `process_event` method.
+        On each message, the body is parsed once and the dispatcher finds the
+        plugins triggered by it. Running them is queued for the ingest workers,
+        so the sync loop can move on; commands left over from while the bot
+        was down are first handed to the catch up policy.
         """
 
-        await self.client.room_read_markers(
-            room.room_id, event.event_id, event.event_id
-        )
+        self.read_markers.mark(room.room_id, event)
 
         if event.sender == self.client.user_id:
             # Message is from us; we can ignore.
             return
 
-        for name, plugin in self.plugins.items():
-            try:
-                await plugin.process_event(room, event, self.messenger)
-            except Exception as err:
-                print(
-                    f"Plugin {name} encountered an error while "
-                    + f"processing the event {event} in room {room.display_name}."
-                    + f"\n{err}",
-                    file=sys.stderr,
-                )
-                _, _, tb = sys.exc_info()
-                traceback.print_tb(tb)
+        if not self.seen_events.add(event.event_id):
+            # Already handled, before a restart or in an overlapping sync
+            return
+
+        self.__messages.inc()
+        with self.__dispatch_time.time():
+            command = ParsedCommand(event.body)
+            triggered = list(self.dispatcher.match(command))
+            if not triggered:
+                self.seen_events.handled(event.event_id)
+                return
+            finished = self.ingest.claim()
+            enqueue = partial(
+                self.__enqueue,
+                room,
+                event,
+                command,
+                triggered,
+                self.dispatcher,
+                finished,
+            )
+            drop = partial(self.__drop, event, finished)
+            if not self.catch_up.defer(room, event, enqueue, drop):
+                enqueue()
+
+    def __enqueue(
+        self,
+        room: MatrixRoom,
+        event: RoomMessageText,
+        command: ParsedCommand,
+        triggered: List[Tuple[str, BasePlugin]],
+        dispatcher: PluginDispatcher,
+        finished: Callable[[], None],
+    ) -> None:
+        self.ingest.put(
+            room,
+            event,
+            partial(self.__run_plugins, room, event, command, triggered, dispatcher),
+            finished,
+        )
+
+    def __drop(self, event: RoomMessageText, finished: Callable[[], None]) -> None:
+        # Dropped by the catch up policy; that counts as handled
+        self.seen_events.handled(event.event_id)
+        finished()
+
+    async def __run_plugins(
+        self,
+        room: MatrixRoom,
+        event: RoomMessageText,
+        command: ParsedCommand,
+        triggered: List[Tuple[str, BasePlugin]],
+        dispatcher: PluginDispatcher = None,
+    ) -> None:
+        """Runs the triggered plugins that admission control lets through.
+
+        The plugins' `process_event` methods run concurrently, and this waits
+        for them all to finish, so the room's next message waits its turn.
+        Plugins whose `process_event` takes `tokens` are passed the parsed
+        body. If plugins were reloaded since `dispatcher` matched the message,
+        it's matched again, so it's never handled by a replaced plugin. The
+        message is saved as seen once its plugins are done, or turned away.
+        """
+        if dispatcher is not None and dispatcher is not self.dispatcher:
+            triggered = list(self.dispatcher.match(command))
+        admitted = self.admission.admit(room.room_id, event.sender, command, triggered)
+        tasks = []
+        for name, plugin in admitted:
+            if plugin.takes_tokens():
+                call = plugin.process_event(room, event, self.messenger, tokens=command)
+            else:
+                call = plugin.process_event(room, event, self.messenger)
+            task = self.runner.submit(name, room, event, call, timeout=plugin.timeout)
+            if plugin.expensive:
+                self.admission.track(task)
+            tasks.append(task)
+        if tasks:
+            await asyncio.wait(tasks)
+        self.seen_events.handled(event.event_id)
 
     async def __sync_cb(self, response: SyncResponse) -> None:
-        with open(self.config.next_batch_file, "w") as next_batch_token:
-            next_batch_token.write(response.next_batch)
+        # Save what's been handled before the sync token that skips past it
+        await self.seen_events.flush()
+        self.state_store.mark_dirty(response.rooms.join, response.rooms.leave)
+        self.ingest.end_of_batch(response.next_batch)
+        self.read_markers.end_of_batch()
+        self.invites.end_of_batch(response.rooms.join)
+        self.catch_up.end_of_batch()
+
+        if self.metrics.enabled:
+            if response.start_time and response.end_time:
+                self.__sync_time.observe(response.end_time - response.start_time)
+            self.__sync_events.observe(
+                sum(len(room.timeline.events) for room in response.rooms.join.values())
+            )
 
+        # Don't fetch more while the workers are this far behind
+        await self.ingest.wait_for_space()
 
-if __name__ == "__main__":
-    # Handle log output
-    StreamHandler(sys.stdout).push_application()
-    logger_group.add_logger(CORE_LOG)
 
-    if True:
-        logger_group.level = INFO
+def configure_logging(config: SessionConfig) -> None:
+    """Sets up log output as the config's log settings describe.
+    """
+    setup_logging(
+        level=lookup_level(config.log_level),
+        json_output=config.log_format == "json",
+        background=config.log_background,
+        queue_size=config.log_queue_size,
+        limiter=LogLimiter(config.log_rate_limits, config.log_sampling),
+    )
 
-    # if (OUTPUT_NIO_LOGS):
-    # nio_logger_group.level = nio_log.logbook.INFO
 
+if __name__ == "__main__":
     conf = SessionConfig()
+
+    # Handle log output
+    configure_logging(conf)
+
     session = Session(conf)
 
     try:
         CORE_LOG.info("Starting up")
-        asyncio.get_event_loop().run_until_complete(session.start())
+        asyncio.get_event_loop().run_until_complete(
+            session.start(prune_devices="--prune-devices" in sys.argv[1:])
+        )
     except KeyboardInterrupt:
         asyncio.get_event_loop().run_until_complete(session.stop())
@@ -0,0 +1,129 @@
+import os
+import asyncio
+from tempfile import NamedTemporaryFile
+from typing import Callable, Optional
+
+from logbook import Logger
+
+from executor import run_blocking
+from log import logger_group
+
+CHECKPOINT_LOG = Logger("olive.checkpoint")
+logger_group.add_logger(CHECKPOINT_LOG)
+
+
+class Checkpointer:
+    """Persists the latest sync token without blocking the event loop.
+
+    Tokens passed to `update` are coalesced: at most one write happens per
+    `interval` seconds, and only the newest token is written. Writes run on
+    the blocking pool and replace the file atomically, so a crash mid-write
+    never leaves a truncated token behind.
+
+    State that has to stay consistent with the token, like the room state
+    store, can be saved alongside it through `snapshot`.
+    """
+
+    file_path: str = None
+    interval: float = None
+    latest: Optional[str] = None
+    written: Optional[str] = None
+    snapshot: Optional[Callable[[str], Callable[[], None]]] = None
+
+    def __init__(
+        self,
+        file_path: str,
+        interval: float,
+        snapshot: Callable[[str], Callable[[], None]] = None,
+    ):
+        """
+        Arguments:
+            file_path {str} -- where the token is stored
+            interval {float} -- the fewest seconds between two writes
+
+        Keyword Arguments:
+            snapshot {Callable} -- called on the event loop with each token
+                about to be written; returns a function to run on the blocking
+                pool just before the token is written (default: {None})
+        """
+        self.file_path = file_path
+        self.interval = interval
+        self.snapshot = snapshot
+        self.__pending: Optional[asyncio.Task] = None
+        self.__writing: Optional[asyncio.Task] = None
+        self.__lock = asyncio.Lock()
+
+    def load(self) -> Optional[str]:
+        """Returns the stored token, or None if there isn't one yet.
+        """
+        try:
+            with open(self.file_path, "r") as token_file:
+                self.written = self.latest = token_file.read()
+        except FileNotFoundError:
+            return None
+        return self.written
+
+    def update(self, token: str) -> None:
+        """Records a new token, scheduling a write if one isn't pending.
+        """
+        self.latest = token
+        if self.__pending is None or self.__pending.done():
+            self.__pending = asyncio.ensure_future(self.__flush_later())
+
+    async def flush(self) -> None:
+        """Writes the latest token now, if it hasn't been written yet.
+        """
+        async with self.__lock:
+            token = self.latest
+            if token is None or token == self.written:
+                return
+            save_state = self.snapshot(token) if self.snapshot else None
+            await run_blocking(self.__write, token, save_state)
+            self.written = token
+
+    async def close(self) -> None:
+        """Cancels any scheduled write, lets one already under way finish, and
+        then flushes the latest token.
+        """
+        if self.__pending is not None:
+            self.__pending.cancel()
+        if self.__writing is not None:
+            # Its errors were logged, and the flush below retries its token
+            await asyncio.gather(self.__writing, return_exceptions=True)
+        await self.flush()
+
+    async def __flush_later(self) -> None:
+        # Tokens updated while a write runs are written by the next round
+        while self.latest != self.written:
+            await asyncio.sleep(self.interval)
+            # Shielded, so cancelling this can't leave the write running in
+            # its thread while close starts another
+            self.__writing = asyncio.ensure_future(self.flush())
+            try:
+                await asyncio.shield(self.__writing)
+            except OSError as err:
+                # The token stays pending; the next update or close retries it.
+                CHECKPOINT_LOG.error(f"Failed to save {self.file_path}: {err}")
+                return
+
+    def __write(self, token: str, save_state: Optional[Callable[[], None]]) -> None:
+        if save_state is not None:
+            try:
+                save_state()
+            except Exception as err:
+                # The store keeps its previous token, so it isn't trusted on
+                # the next start, and it rewrites every room on its next save.
+                CHECKPOINT_LOG.error(f"Failed to save state for {token}: {err}")
+
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        with NamedTemporaryFile(
+            "w", dir=directory, prefix=".next_batch.", delete=False
+        ) as temp_file:
+            try:
+                temp_file.write(token)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            except OSError:
+                os.unlink(temp_file.name)
+                raise
+        os.replace(temp_file.name, self.file_path)
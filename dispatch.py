@@ -0,0 +1,157 @@
+import re
+from itertools import chain
+from typing import Dict, List, Optional, Pattern, Tuple
+
+from logbook import Logger
+
+from plugin import BasePlugin, Command
+from parsing import ParsedCommand
+from log import logger_group
+
+DISPATCH_LOG = Logger("olive.dispatch")
+logger_group.add_logger(DISPATCH_LOG)
+
+
+class CommandMatcher:
+    """Finds which of the commands sharing a trigger word a message invokes.
+
+    The commands' patterns are compiled into optional lookaheads of one
+    combined expression, anchored at the start of the body; matching it once
+    records which of the commands' lookaheads succeeded. The dispatcher keeps
+    one matcher per trigger word, so a message is only matched against the
+    commands its first word could invoke.
+    """
+
+    commands: List[Tuple[str, Command]] = None
+    regex: Optional[Pattern] = None
+
+    def __init__(self, commands: List[Tuple[str, Command]]):
+        """
+        Arguments:
+            commands {List[Tuple[str, Command]]} -- the (name, plugin) pairs
+                to match
+        """
+        self.commands = commands
+        self.regex = None
+        if commands:
+            self.regex = re.compile(
+                "".join(
+                    f"(?:(?={plugin.pattern()}$)(?P<c{index}>))?"
+                    for index, (_, plugin) in enumerate(commands)
+                )
+            )
+
+    def match(self, body: str) -> List[Tuple[str, Command]]:
+        """Returns the (name, plugin) pairs of the commands the body invokes.
+        """
+        if self.regex is None:
+            return []
+
+        found = self.regex.match(body)
+        return [
+            pair
+            for index, pair in enumerate(self.commands)
+            if found.group(f"c{index}") is not None
+        ]
+
+
+class PluginDispatcher:
+    """Routes each message to only the plugins that it triggers.
+
+    Built once from the loaded plugins, the dispatcher indexes every plugin by
+    the words in its `trigger` list. A message is parsed a single time and
+    its command word is looked up in the index, so the cost of routing does not
+    grow with the number of plugins loaded. Plugins without a `trigger` list
+    are kept aside and asked through their `is_triggered` predicate instead.
+    Loaded commands are indexed by their triggers too, and the commands under
+    a message's command word are then matched by their declared arguments
+    with that word's `CommandMatcher`.
+    """
+
+    index: Dict[str, List[Tuple[str, BasePlugin]]] = None
+    fallback: List[Tuple[str, BasePlugin]] = None
+    # A matcher for the commands under each trigger word that has any
+    commands: Dict[str, CommandMatcher] = None
+
+    def __init__(self, plugins: Dict[str, BasePlugin]):
+        self.index = {}
+        self.fallback = []
+        commands: Dict[str, List[Tuple[str, Command]]] = {}
+
+        for name, plugin in plugins.items():
+            is_command = isinstance(plugin, Command)
+            if is_command and not self.__is_valid_command(name, plugin):
+                continue
+
+            triggers = plugin.trigger
+            if isinstance(triggers, str):
+                triggers = [triggers]
+
+            if not triggers:
+                self.fallback.append((name, plugin))
+                continue
+
+            for word in triggers:
+                word = word.lower()
+                bucket = self.index.setdefault(word, [])
+                if (name, plugin) not in bucket:
+                    bucket.append((name, plugin))
+                    if is_command:
+                        commands.setdefault(word, []).append((name, plugin))
+
+        self.commands = {
+            word: CommandMatcher(matching) for word, matching in commands.items()
+        }
+
+        command_count = len(
+            {name for matching in commands.values() for name, _ in matching}
+        )
+        DISPATCH_LOG.info(
+            f"Compiled {command_count} command(s); indexed {len(self.index)} "
+            + f"trigger(s); {len(self.fallback)} plugin(s) use is_triggered only"
+        )
+
+    def match(self, command: ParsedCommand) -> List[Tuple[str, BasePlugin]]:
+        """Returns the (name, plugin) pairs that the message triggers.
+
+        Arguments:
+            command {ParsedCommand} -- the parsed body of the message to route
+        """
+        word = command.command
+        candidates = self.index.get(word, [])
+        matcher = self.commands.get(word)
+        if matcher is not None:
+            # Invoked commands come first, as they're the most specific
+            candidates = matcher.match(command.body) + [
+                pair for pair in candidates if not isinstance(pair[1], Command)
+            ]
+
+        return [
+            (name, plugin)
+            for name, plugin in chain(candidates, self.fallback)
+            if self.__is_triggered(name, plugin, command)
+        ]
+
+    @staticmethod
+    def __is_valid_command(name: str, plugin: Command) -> bool:
+        if not plugin.trigger:
+            DISPATCH_LOG.warning(f"Command {name} has no trigger; skipping")
+            return False
+        try:
+            re.compile(plugin.pattern())
+        except (re.error, TypeError, ValueError) as err:
+            DISPATCH_LOG.error(
+                f"Command {name} has an invalid pattern; skipping. {err}"
+            )
+            return False
+        return True
+
+    @staticmethod
+    def __is_triggered(name: str, plugin: BasePlugin, tokens: ParsedCommand) -> bool:
+        try:
+            return bool(plugin.is_triggered(tokens))
+        except Exception as err:
+            DISPATCH_LOG.error(
+                f"Plugin {name} raised while checking its trigger; skipping. {err}"
+            )
+            return False
@@ -0,0 +1,167 @@
+import sys
+import asyncio
+import threading
+import traceback
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial, wraps
+from os import path
+from time import monotonic
+from typing import Any, Callable, Optional
+
+from logbook import Logger
+
+from log import logger_group
+
+EXECUTOR_LOG = Logger("olive.executor")
+logger_group.add_logger(EXECUTOR_LOG)
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def configure(threads: int, processes: int = 0) -> None:
+    """Sizes the pools used for blocking and CPU-bound plugin work.
+
+    Arguments:
+        threads {int} -- the number of threads for blocking I/O
+
+    Keyword Arguments:
+        processes {int} -- the number of worker processes for CPU-bound work;
+            0 runs CPU-bound work on the thread pool instead (default: {0})
+    """
+    global _thread_pool, _process_pool
+    shutdown()
+    _thread_pool = ThreadPoolExecutor(
+        max_workers=max(1, threads), thread_name_prefix="olive-blocking"
+    )
+    if processes > 0:
+        _process_pool = ProcessPoolExecutor(max_workers=processes)
+
+
+def shutdown() -> None:
+    """Stops the pools, waiting for any work already running on them.
+    """
+    global _thread_pool, _process_pool
+    for pool in (_thread_pool, _process_pool):
+        if pool is not None:
+            pool.shutdown(wait=True)
+    _thread_pool = None
+    _process_pool = None
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """Runs a blocking function on the thread pool and returns its result.
+
+    Use this for blocking I/O, such as subprocesses, sockets or files, so the
+    event loop can keep serving other rooms in the meantime.
+    """
+    return await _run_on(_thread_pool, func, *args, **kwargs)
+
+
+async def run_cpu_bound(func: Callable, *args, **kwargs) -> Any:
+    """Runs a CPU-heavy function on the process pool and returns its result.
+
+    The function and its arguments must be picklable. Falls back to the
+    thread pool if no process pool was configured.
+    """
+    return await _run_on(_process_pool or _thread_pool, func, *args, **kwargs)
+
+
+def blocking(func: Callable) -> Callable:
+    """Decorates a blocking function so that calling it returns an awaitable
+    that runs it on the thread pool.
+    """
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_blocking(func, *args, **kwargs)
+
+    return wrapper
+
+
+async def _run_on(pool: Optional[Executor], func: Callable, *args, **kwargs) -> Any:
+    # `pool` is None until `configure` is called; asyncio's default executor
+    # stands in so plugins still work outside of a Session.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, partial(func, *args, **kwargs))
+
+
+class LoopStallDetector:
+    """Watches for code holding the event loop longer than a threshold.
+
+    A heartbeat task on the loop wakes every tenth of the threshold and
+    records when it's next due, and a watchdog thread checks as often that it
+    isn't overdue. Once it's more than the threshold late, the loop has been
+    held at least that long; the watchdog inspects what the loop's thread is
+    running and logs the innermost plugin frame on its stack. A stall is
+    reported by the time it has lasted 1.2 times the threshold.
+    """
+
+    threshold: float = None
+    plugins_dir: str = None
+    # When the heartbeat should next run, by the monotonic clock
+    next_beat: float = None
+
+    def __init__(self, threshold: float, plugins_dir: str):
+        """
+        Arguments:
+            threshold {float} -- seconds the loop may be held before logging
+            plugins_dir {str} -- the directory plugins are loaded from
+        """
+        self.threshold = threshold
+        self.plugins_dir = path.abspath(plugins_dir)
+        self.__beat_task: Optional[asyncio.Task] = None
+        self.__stopped = threading.Event()
+        self.__loop_thread: Optional[int] = None
+
+    def start(self) -> None:
+        """Starts watching the running event loop.
+        """
+        self.__loop_thread = threading.get_ident()
+        self.next_beat = monotonic() + self.__interval
+        self.__stopped.clear()
+        self.__beat_task = asyncio.ensure_future(self.__beat())
+        threading.Thread(
+            target=self.__watch, name="olive-stall-detector", daemon=True
+        ).start()
+
+    def stop(self) -> None:
+        self.__stopped.set()
+        if self.__beat_task is not None:
+            self.__beat_task.cancel()
+
+    @property
+    def __interval(self) -> float:
+        return self.threshold / 10
+
+    async def __beat(self) -> None:
+        while True:
+            self.next_beat = monotonic() + self.__interval
+            await asyncio.sleep(self.__interval)
+
+    def __watch(self) -> None:
+        reported = False
+        while not self.__stopped.wait(self.__interval):
+            stalled = monotonic() - self.next_beat
+            if stalled > self.threshold and not reported:
+                reported = True
+                EXECUTOR_LOG.warning(
+                    f"Event loop blocked for {stalled:.2f}s by {self.__culprit()}"
+                )
+            elif stalled <= self.threshold and reported:
+                reported = False
+                EXECUTOR_LOG.info("Event loop recovered")
+
+    def __culprit(self) -> str:
+        frame = sys._current_frames().get(self.__loop_thread)
+        if frame is None:
+            return "an unknown caller"
+
+        stack = traceback.extract_stack(frame)
+        for entry in reversed(stack):
+            if path.abspath(entry.filename).startswith(self.plugins_dir):
+                plugin = path.splitext(path.basename(entry.filename))[0]
+                return f"plugin {plugin} ({entry.name}, line {entry.lineno})"
+
+        entry = stack[-1]
+        return f"{entry.name} in {entry.filename}, line {entry.lineno}"
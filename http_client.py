@@ -0,0 +1,87 @@
+from typing import Any, Optional
+
+from aiohttp import ClientResponse, ClientSession, ClientTimeout, TCPConnector
+
+
+class HttpClient:
+    """A connection-pooled HTTP client shared by every plugin in a session.
+
+    Connections are kept alive between requests and reused, so plugins that
+    call the same service don't set up TCP and TLS for every command.
+    Compressed responses are decompressed transparently.
+    """
+
+    limit: int = None
+    limit_per_host: int = None
+    keepalive: float = None
+    timeout: float = None
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 8,
+        keepalive: float = 30,
+        timeout: float = 10,
+    ):
+        """
+        Keyword Arguments:
+            limit {int} -- the most open connections in total (default: {100})
+            limit_per_host {int} -- the most open connections to one host
+                (default: {8})
+            keepalive {float} -- seconds an idle connection is kept open
+                (default: {30})
+            timeout {float} -- seconds a request may take in total (default: {10})
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.__session: Optional[ClientSession] = None
+
+    @property
+    def session(self) -> ClientSession:
+        """The underlying aiohttp session, created on first use.
+        """
+        # aiohttp sessions must be created inside the running event loop.
+        if self.__session is None or self.__session.closed:
+            self.__session = ClientSession(
+                connector=TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=self.keepalive,
+                ),
+                timeout=ClientTimeout(total=self.timeout),
+                auto_decompress=True,
+            )
+        return self.__session
+
+    def request(self, method: str, url: str, **kwargs) -> ClientResponse:
+        """Starts a request; use it as `async with http.request(...) as response`.
+
+        Keyword arguments are passed on to `aiohttp.ClientSession.request`.
+        """
+        return self.session.request(method, url, **kwargs)
+
+    async def get_bytes(self, url: str, **kwargs) -> bytes:
+        """Returns the body of a successful GET request for `url`.
+
+        Raises `aiohttp.ClientResponseError` for error statuses.
+        """
+        async with self.request("GET", url, **kwargs) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def get_json(self, url: str, **kwargs) -> Any:
+        """Returns the parsed JSON body of a successful GET request for `url`.
+
+        Raises `aiohttp.ClientResponseError` for error statuses and
+        `json.JSONDecodeError` if the body isn't JSON.
+        """
+        async with self.request("GET", url, **kwargs) as response:
+            response.raise_for_status()
+            # Some APIs send JSON without an application/json content type.
+            return await response.json(content_type=None)
+
+    async def close(self) -> None:
+        if self.__session is not None and not self.__session.closed:
+            await self.__session.close()
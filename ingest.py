@@ -0,0 +1,237 @@
+import asyncio
+from collections import deque
+from time import monotonic
+from functools import partial
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+from logbook import Logger
+from nio import Event, MatrixRoom
+
+from log import logger_group
+from metrics import Metrics, NULL_METRICS
+
+INGEST_LOG = Logger("olive.ingest")
+logger_group.add_logger(INGEST_LOG)
+
+Queued = Tuple[
+    float, MatrixRoom, Event, Callable[[], Awaitable[None]], Callable[[], None]
+]
+
+
+class SyncBatch:
+    """The events of one sync that are still being handled."""
+
+    # The sync's token, once all of its events have arrived
+    token: Optional[str] = None
+    unfinished: int = 0
+
+
+class IngestQueue:
+    """Hands work from the sync loop to workers, so syncing and processing
+    overlap.
+
+    Sync callbacks only `put` the work an event calls for; up to `workers`
+    tasks carry it out meanwhile, taking turns between rooms. Each room's
+    events are processed one at a time, in the order they arrived, while
+    different rooms proceed in parallel. Once `max_size` events are waiting,
+    `wait_for_space` holds the sync loop until the workers catch up; the
+    events of the sync in hand are always accepted, so the queue can briefly
+    go over.
+
+    Every event taken on is also counted against the sync it came in, until
+    it's been handled or deliberately dropped; `handled` is only told a
+    sync's token once that's true of the sync and all those before it, so a
+    token saved from there never skips past an event still in hand.
+    """
+
+    workers: int = None
+    max_size: int = None
+    handled: Callable[[str], None] = None
+    # Events waiting to be processed, across all rooms
+    depth: int = 0
+
+    def __init__(
+        self,
+        workers: int = 8,
+        max_size: int = 1000,
+        metrics: Metrics = None,
+        handled: Callable[[str], None] = None,
+    ):
+        """
+        Keyword Arguments:
+            workers {int} -- the most events processed at once (default: {8})
+            max_size {int} -- events waiting before syncing pauses
+                (default: {1000})
+            metrics {Metrics} -- records the queue's depth and lag
+                (default: {None})
+            handled {Callable} -- called with the token of each sync whose
+                events, and those of every earlier sync, have all been
+                handled (default: {None})
+        """
+        self.workers = max(1, workers)
+        self.max_size = max(1, max_size)
+        self.handled = handled or (lambda token: None)
+        # The current sync's batch last, behind those still being handled
+        self.__batches: Deque[SyncBatch] = deque([SyncBatch()])
+        self.__rooms: Dict[str, Deque[Queued]] = {}
+        # Rooms with waiting events that no worker is processing, in turn
+        self.__ready: Deque[str] = deque()
+        self.__active: Set[str] = set()
+        self.__tasks: Set[asyncio.Task] = set()
+        # Workers still taking work; a task finishing is only discarded from
+        # __tasks a loop iteration later, so it can't be counted from there
+        self.__running = 0
+        self.__space = asyncio.Event()
+        self.__space.set()
+        self.__idle = asyncio.Event()
+        self.__idle.set()
+
+        metrics = metrics or NULL_METRICS
+        metrics.gauge(
+            "ingest_queue_depth", "Events waiting for a worker", read=lambda: self.depth
+        )
+        self.__lag = metrics.histogram(
+            "ingest_lag_seconds",
+            "Time events wait between arriving in a sync and being processed",
+            buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+        )
+        self.__paused = metrics.counter(
+            "sync_paused_seconds_total", "Time syncing waited for the ingest queue"
+        )
+
+    def claim(self) -> Callable[[], None]:
+        """Counts an event against the current sync until it's dealt with.
+
+        Returns a function to call, once, when the event has been handled or
+        dropped. Claim events that are held elsewhere before being `put`.
+        """
+        batch = self.__batches[-1]
+        batch.unfinished += 1
+        return partial(self.__finish, batch)
+
+    def put(
+        self,
+        room: MatrixRoom,
+        event: Event,
+        work: Callable[[], Awaitable[None]],
+        finished: Callable[[], None] = None,
+    ) -> None:
+        """Queues an event's work, to run after that of the room's earlier events.
+
+        Arguments:
+            room {MatrixRoom} -- the room the event came from
+            event {Event} -- the event, for reporting
+            work {Callable} -- processes the event when awaited
+
+        Keyword Arguments:
+            finished {Callable} -- from `claim`, if the event was claimed
+                earlier; otherwise it's claimed now (default: {None})
+        """
+        if finished is None:
+            finished = self.claim()
+        room_id = room.room_id
+        queue = self.__rooms.get(room_id)
+        if queue is None:
+            queue = self.__rooms[room_id] = deque()
+        if not queue and room_id not in self.__active:
+            self.__ready.append(room_id)
+        queue.append((monotonic(), room, event, work, finished))
+
+        self.depth += 1
+        if self.depth >= self.max_size:
+            self.__space.clear()
+        self.__idle.clear()
+        if self.__ready and self.__running < self.workers:
+            self.__running += 1
+            task = asyncio.ensure_future(self.__work())
+            self.__tasks.add(task)
+            task.add_done_callback(self.__tasks.discard)
+
+    def end_of_batch(self, token: str) -> None:
+        """Notes that all of a sync's events have arrived.
+
+        Arguments:
+            token {str} -- the sync's next_batch token
+        """
+        self.__batches[-1].token = token
+        self.__batches.append(SyncBatch())
+        self.__release()
+
+    async def wait_for_space(self) -> None:
+        """Waits until fewer than `max_size` events are queued.
+        """
+        if self.__space.is_set():
+            return
+        INGEST_LOG.debug(f"Pausing sync: {self.depth} events queued")
+        start = monotonic()
+        await self.__space.wait()
+        self.__paused.inc(monotonic() - start)
+
+    async def join(self) -> None:
+        """Waits until every queued event has been processed.
+        """
+        await self.__idle.wait()
+
+    async def close(self) -> None:
+        """Stops the workers, dropping events they haven't started on.
+
+        Dropped events are never counted as handled, so the syncs they came in
+        aren't passed to `handled`.
+        """
+        for task in list(self.__tasks):
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.__rooms.clear()
+        self.__ready.clear()
+        self.__active.clear()
+        self.depth = 0
+        self.__space.set()
+        self.__idle.set()
+
+    async def __work(self) -> None:
+        try:
+            await self.__take_turns()
+        finally:
+            self.__running -= 1
+        if not self.__active and not self.depth:
+            self.__idle.set()
+
+    async def __take_turns(self) -> None:
+        while self.__ready:
+            room_id = self.__ready.popleft()
+            queue = self.__rooms[room_id]
+            queued, room, event, work, finished = queue.popleft()
+            self.depth -= 1
+            if self.depth < self.max_size:
+                self.__space.set()
+            self.__lag.observe(monotonic() - queued)
+
+            self.__active.add(room_id)
+            try:
+                await work()
+            except Exception:
+                INGEST_LOG.exception(
+                    f"Failed to process {event.event_id} in {room.display_name}"
+                )
+            finally:
+                self.__active.discard(room_id)
+            # Not reached if cancelled, so the event is left unfinished
+            finished()
+
+            # Go to the back of the line, so busy rooms don't starve the rest
+            if queue:
+                self.__ready.append(room_id)
+            else:
+                del self.__rooms[room_id]
+
+    def __finish(self, batch: SyncBatch) -> None:
+        batch.unfinished -= 1
+        self.__release()
+
+    def __release(self) -> None:
+        batches = self.__batches
+        token = None
+        while len(batches) > 1 and not batches[0].unfinished:
+            token = batches.popleft().token
+        if token is not None:
+            self.handled(token)
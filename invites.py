@@ -0,0 +1,95 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Iterable, Set
+
+from logbook import Logger
+from nio import AsyncClient, JoinError, MatrixInvitedRoom
+
+from log import logger_group
+
+INVITES_LOG = Logger("olive.invites")
+logger_group.add_logger(INVITES_LOG)
+
+
+class InviteJoiner:
+    """Joins the rooms the bot is invited to, once each.
+
+    Every invite event seen during a sync batch only queues its room; at the
+    end of the batch the queued rooms are joined together, at most
+    `concurrency` at a time. A room is handled once until a sync shows it
+    joined, however many invite events arrive for it, so it's greeted once.
+    The joined room's state arrives with the normal sync loop.
+    """
+
+    client: AsyncClient = None
+    concurrency: int = None
+    # Rooms to join at the end of the current batch
+    queued: Dict[str, MatrixInvitedRoom] = None
+    # Rooms being joined, or joined but not yet seen in a sync
+    handled: Set[str] = None
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        concurrency: int,
+        on_joined: Callable[[MatrixInvitedRoom], Awaitable[None]],
+    ):
+        """
+        Arguments:
+            client {AsyncClient} -- the client to join rooms with
+            concurrency {int} -- the most joins in flight at once
+            on_joined {Callable} -- awaited with each room once it's joined
+        """
+        self.client = client
+        self.concurrency = concurrency
+        self.queued = {}
+        self.handled = set()
+        self.__on_joined = on_joined
+        self.__slots = asyncio.Semaphore(max(1, concurrency))
+        self.__tasks: Set[asyncio.Task] = set()
+
+    def invite(self, room: MatrixInvitedRoom) -> None:
+        """Queues a room the bot was invited to, unless it's already handled.
+        """
+        room_id = room.room_id
+        if room_id in self.client.rooms or room_id in self.handled:
+            return
+        self.queued[room_id] = room
+
+    def end_of_batch(self, joined: Iterable[str] = ()) -> None:
+        """Starts joining the rooms queued during a sync batch.
+
+        Keyword Arguments:
+            joined {Iterable[str]} -- rooms the batch shows the bot joined to
+                (default: {()})
+        """
+        self.handled.difference_update(joined)
+        if not self.queued:
+            return
+
+        rooms, self.queued = list(self.queued.values()), {}
+        self.handled.update(room.room_id for room in rooms)
+        INVITES_LOG.info(f"Joining {len(rooms)} room(s)")
+        for room in rooms:
+            task = asyncio.ensure_future(self.__join(room))
+            self.__tasks.add(task)
+            task.add_done_callback(self.__tasks.discard)
+
+    async def close(self) -> None:
+        """Waits for joins in flight to finish.
+        """
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+
+    async def __join(self, room: MatrixInvitedRoom) -> None:
+        async with self.__slots:
+            response = await self.client.join(room.room_id)
+
+        if isinstance(response, JoinError):
+            INVITES_LOG.warning(f"Failed to join {room.room_id}: {response}")
+            # Let a later invite try again
+            self.handled.discard(room.room_id)
+            return
+
+        try:
+            await self.__on_joined(room)
+        except Exception as err:
+            INVITES_LOG.error(f"Failed to greet {room.room_id}: {err}")
@@ -1,6 +1,184 @@
+import sys
+import json
+import atexit
+import random
+import threading
+from queue import Full
+from datetime import timezone
+from typing import Dict, Optional
+
 import logbook
 
-from logbook import LoggerGroup, CRITICAL
+from logbook import (
+    CRITICAL,
+    ERROR,
+    Handler,
+    Logger,
+    LoggerGroup,
+    LogRecord,
+    StreamHandler,
+)
+from logbook.queues import ThreadedWrapperHandler
+
+from ratelimit import TokenBucket
 
 logger_group = LoggerGroup()
 logger_group.level = CRITICAL
+
+# One logger per plugin, shared by the plugin and the core reporting on it
+_plugin_loggers: Dict[str, Logger] = {}
+
+
+def plugin_logger(name: str) -> Logger:
+    """Returns the logger for the plugin called `name`, creating it once.
+    """
+    logger = _plugin_loggers.get(name)
+    if logger is None:
+        logger = _plugin_loggers[name] = Logger(f"olive.plugin.{name}")
+        logger_group.add_logger(logger)
+    return logger
+
+
+def json_formatter(record: LogRecord, handler: Handler) -> str:
+    """Formats a record as a single line of JSON.
+    """
+    entry = {
+        "time": record.time.replace(tzinfo=timezone.utc).isoformat(),
+        "level": record.level_name,
+        "channel": record.channel,
+        "message": record.message,
+    }
+    if record.formatted_exception:
+        entry["exception"] = record.formatted_exception
+    return json.dumps(entry)
+
+
+class BackgroundHandler(ThreadedWrapperHandler):
+    """Hands records to another handler on a background thread.
+    """
+
+    def emit(self, record: LogRecord) -> None:
+        # Records lose their traceback once handled; keep it for the writer.
+        if record.exc_info:
+            record.pull_information()
+        super().emit(record)
+
+
+class LogLimiter:
+    """Decides which records are worth writing, as a handler filter.
+
+    Records from a channel can be sampled, keeping a fraction of them at
+    random, and rate limited, keeping at most a number per second with
+    bursts of up to twice that. Errors are always kept. Channels match their
+    configured name exactly or by prefix, so "olive.plugin" covers every
+    plugin's logger.
+    """
+
+    rates: Dict[str, float] = None
+    samples: Dict[str, float] = None
+    # Records dropped so far, by channel
+    dropped: Dict[str, int] = None
+
+    def __init__(
+        self, rates: Dict[str, float] = None, samples: Dict[str, float] = None
+    ):
+        """
+        Keyword Arguments:
+            rates {Dict[str, float]} -- records kept per second, by channel
+                (default: {None})
+            samples {Dict[str, float]} -- the fraction of records kept, 0 to
+                1, by channel (default: {None})
+        """
+        self.rates = rates or {}
+        self.samples = samples or {}
+        self.dropped = {}
+        self.__buckets: Dict[str, TokenBucket] = {}
+        # Records can come from executor threads as well as the event loop
+        self.__lock = threading.Lock()
+
+    def __call__(self, record: LogRecord, handler: Handler) -> bool:
+        if record.level >= ERROR:
+            return True
+
+        channel = record.channel
+        sample = self.__setting(self.samples, channel)
+        if sample is not None and random.random() >= sample:
+            return self.__drop(channel)
+
+        rate_channel = self.__setting_name(self.rates, channel)
+        if rate_channel is not None:
+            with self.__lock:
+                bucket = self.__buckets.get(rate_channel)
+                if bucket is None:
+                    rate = self.rates[rate_channel]
+                    bucket = self.__buckets[rate_channel] = TokenBucket(
+                        rate, max(1, 2 * rate)
+                    )
+                if not bucket.try_acquire():
+                    return self.__drop(channel)
+        return True
+
+    def __drop(self, channel: str) -> bool:
+        self.dropped[channel] = self.dropped.get(channel, 0) + 1
+        return False
+
+    def __setting(self, settings: Dict[str, float], channel: str) -> Optional[float]:
+        name = self.__setting_name(settings, channel)
+        return None if name is None else settings[name]
+
+    @staticmethod
+    def __setting_name(settings: Dict[str, float], channel: str) -> Optional[str]:
+        # The most specific configured name wins
+        while channel:
+            if channel in settings:
+                return channel
+            channel = channel.rpartition(".")[0]
+        return None
+
+
+def setup_logging(
+    level: int = logbook.INFO,
+    json_output: bool = False,
+    background: bool = True,
+    queue_size: int = 10000,
+    limiter: LogLimiter = None,
+) -> Handler:
+    """Sends log records to stdout and returns the handler doing it.
+
+    With `background` set, records are queued and formatted and written on
+    a separate thread, so a slow stdout never holds the event loop; if the
+    queue fills up, new records are dropped. Queued records are written out
+    when the program exits.
+
+    Keyword Arguments:
+        level {int} -- the lowest level logged (default: {logbook.INFO})
+        json_output {bool} -- write one JSON object per record instead of
+            text (default: {False})
+        background {bool} -- write records on a background thread (default:
+            {True})
+        queue_size {int} -- the most records waiting to be written (default:
+            {10000})
+        limiter {LogLimiter} -- samples and rate limits records (default:
+            {None})
+    """
+    logger_group.level = level
+
+    handler: Handler = StreamHandler(sys.stdout, level=level, bubble=False)
+    if json_output:
+        handler.formatter = json_formatter
+    if background:
+        handler = BackgroundHandler(handler, maxsize=queue_size)
+        atexit.register(_close_quietly, handler)
+    if limiter is not None:
+        handler.filter = limiter
+
+    handler.push_application()
+    return handler
+
+
+def _close_quietly(handler: Handler) -> None:
+    try:
+        handler.close()
+    except Full:
+        # The writer is too far behind to be told to stop; give up on it.
+        pass
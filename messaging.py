@@ -1,43 +1,212 @@
-import sys
+import asyncio
+from html import escape
+from typing import Dict, List, Optional
 
-from nio import AsyncClient, RoomSendError, SendRetryError
+from nio import AsyncClient
+
+from send_queue import SendQueue
+from metrics import Metrics, NULL_METRICS
+
+
+class PendingText:
+    """Text parts waiting to be merged into a single message to a room."""
+
+    bodies: List[str] = None
+    formatted_bodies: List[Optional[str]] = None
+    result: asyncio.Future = None
+
+    def __init__(self):
+        self.bodies = []
+        self.formatted_bodies = []
+        self.result = asyncio.get_running_loop().create_future()
+
+    def content(self) -> dict:
+        content = {"msgtype": "m.text", "body": "\n".join(self.bodies)}
+        if any(self.formatted_bodies):
+            # Parts sent without HTML still need to appear in the HTML version.
+            content.update(
+                {
+                    "format": "org.matrix.custom.html",
+                    "formatted_body": "<br>".join(
+                        formatted or escape(body).replace("\n", "<br>")
+                        for body, formatted in zip(self.bodies, self.formatted_bodies)
+                    ),
+                }
+            )
+        return content
 
 
 class Messenger:
     client: AsyncClient = None
+    queue: SendQueue = None
+    coalesce_window: float = 0
+    pending: Dict[str, PendingText] = None
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        queue: SendQueue = None,
+        coalesce_window: float = 0,
+        metrics: Metrics = None,
+    ) -> None:
+        """
+        Arguments:
+            client {AsyncClient} -- the client to send with
 
-    def __init__(self, client: AsyncClient) -> None:
+        Keyword Arguments:
+            queue {SendQueue} -- the queue to send through (default: {None})
+            coalesce_window {float} -- seconds during which text sent to the
+                same room is merged into one message; 0 disables merging
+                (default: {0})
+            metrics {Metrics} -- records how long sending text takes
+                (default: {None})
+        """
         self.client = client
+        self.queue = queue or SendQueue(client)
+        self.coalesce_window = coalesce_window
+        self.pending = {}
+
+        metrics = metrics or NULL_METRICS
+        self.__send_time = metrics.histogram(
+            "send_text_seconds", "Time from sending text until it's delivered"
+        )
+        self.__send_failures = metrics.counter(
+            "send_text_failures_total", "Text messages that couldn't be sent"
+        )
+
+    async def send(
+        self, room_id: str, content: dict, message_type: str = "m.room.message"
+    ) -> Optional[str]:
+        """Sends an event to a room through the send queue.
+
+        Waits until the event has been sent, or given up on, and returns its
+        event ID; None if it couldn't be sent. Unexpected errors from sending
+        are raised. The event is still sent if the caller is cancelled while
+        waiting.
+
+        Arguments:
+            room_id {str} -- the id of the room to send the event in
+            content {dict} -- the content of the event
+
+        Keyword Arguments:
+            message_type {str} -- the type of the event (default: {"m.room.message"})
+        """
+        result = await self.queue.put(room_id, content, message_type)
+        return await asyncio.shield(result)
 
     async def send_text(
-        self, room_id: str, body: str, formatted_body: str = None
-    ) -> None:
+        self,
+        room_id: str,
+        body: str,
+        formatted_body: str = None,
+        coalesce: bool = True,
+    ) -> Optional[str]:
         """Sends a text message to a room.
 
+        With a coalesce window set, text sent to the same room within the
+        window is merged into one message, and every caller gets its event ID.
+        Text that will be edited later, such as a placeholder, must be sent
+        with `coalesce` off, or the edit would replace the other text too.
+
         Arguments:
             room_id {str} -- the id of the room to send the message in
             body {str} -- the unformatted text to send in the room
 
         Keyword Arguments:
             formatted_body {str} -- Any custom HTML to send alongside the message (default: {None})
+            coalesce {bool} -- whether the text may be merged with other
+                text sent to the room (default: {True})
+        """
+
+        assert isinstance(body, str)
+        with self.__send_time.time():
+            if coalesce and self.coalesce_window > 0:
+                event_id = await self.__coalesce(room_id, body, formatted_body)
+            else:
+                content = {"msgtype": "m.text", "body": body}
+                if formatted_body:
+                    content.update(
+                        {
+                            "format": "org.matrix.custom.html",
+                            "formatted_body": formatted_body,
+                        }
+                    )
+                event_id = await self.send(room_id, content)
+
+        if event_id is None:
+            self.__send_failures.inc()
+        return event_id
+
+    async def edit_text(
+        self, room_id: str, event_id: str, body: str, formatted_body: str = None
+    ) -> Optional[str]:
+        """Replaces the text of a message we sent earlier, such as a placeholder.
+
+        The message should have been sent with `coalesce` off; see `send_text`.
+
+        Arguments:
+            room_id {str} -- the id of the room the message is in
+            event_id {str} -- the id of the message to replace
+            body {str} -- the new unformatted text
+
+        Keyword Arguments:
+            formatted_body {str} -- the new custom HTML (default: {None})
         """
 
         assert isinstance(body, str)
-        content = {"msgtype": "m.text", "body": body}
+        new_content = {"msgtype": "m.text", "body": body}
         if formatted_body:
-            content.update(
+            new_content.update(
                 {"format": "org.matrix.custom.html", "formatted_body": formatted_body}
             )
 
-        try:
-            send_status = await self.client.room_send(
-                room_id, message_type="m.room.message", content=content
+        # Clients without edit support show the fallback, marked with a "*".
+        content = {
+            "msgtype": "m.text",
+            "body": f"* {body}",
+            "m.new_content": new_content,
+            "m.relates_to": {"rel_type": "m.replace", "event_id": event_id},
+        }
+        if formatted_body:
+            content.update(
+                {
+                    "format": "org.matrix.custom.html",
+                    "formatted_body": f"* {formatted_body}",
+                }
             )
-        except SendRetryError as err:
-            print(
-                f"Failed to send message '{body}' to room '{room_id}'. Error:\n{err}",
-                file=sys.stderr,
+
+        return await self.send(room_id, content)
+
+    async def flush(self) -> None:
+        """Sends any text still waiting out its coalesce window.
+        """
+        await asyncio.gather(
+            *(self.__send_pending(room_id) for room_id in list(self.pending))
+        )
+
+    async def __coalesce(
+        self, room_id: str, body: str, formatted_body: Optional[str]
+    ) -> Optional[str]:
+        pending = self.pending.get(room_id)
+        if pending is None:
+            pending = self.pending[room_id] = PendingText()
+            asyncio.get_running_loop().call_later(
+                self.coalesce_window,
+                lambda: asyncio.ensure_future(self.__send_pending(room_id)),
             )
 
-        if isinstance(send_status, RoomSendError):
-            print(send_status, file=sys.stderr)
+        pending.bodies.append(body)
+        pending.formatted_bodies.append(formatted_body)
+        return await asyncio.shield(pending.result)
+
+    async def __send_pending(self, room_id: str) -> None:
+        pending = self.pending.pop(room_id, None)
+        if pending is None:
+            return
+        try:
+            event_id = await self.send(room_id, pending.content())
+        except Exception as err:
+            # Raised to everyone whose text was merged into this message
+            pending.result.set_exception(err)
+        else:
+            pending.result.set_result(event_id)
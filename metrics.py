@@ -0,0 +1,346 @@
+import asyncio
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import monotonic, perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+from logbook import Logger
+
+from log import logger_group
+
+METRICS_LOG = Logger("olive.metrics")
+logger_group.add_logger(METRICS_LOG)
+
+# Upper bounds, in seconds, suited to everything from a dispatch to a sync
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    """A value that only goes up, such as a count of errors.
+    """
+
+    kind = "counter"
+    value: float = 0
+
+    def __init__(self, read: Optional[Callable[[], float]] = None):
+        """
+        Keyword Arguments:
+            read {Callable} -- returns the current value, for values kept
+                elsewhere (default: {None})
+        """
+        self.value = 0
+        self.__read = read
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def get(self) -> float:
+        return self.__read() if self.__read else self.value
+
+
+class Gauge(Counter):
+    """A value that goes up and down, such as a queue's depth.
+    """
+
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram:
+    """Counts observations, such as latencies, into fixed buckets.
+    """
+
+    kind = "histogram"
+    buckets: Sequence[float] = None
+    counts: List[int] = None
+    count: int = 0
+    sum: float = 0
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Keyword Arguments:
+            buckets {Sequence[float]} -- the buckets' upper bounds, ascending
+                (default: {DEFAULT_BUCKETS})
+        """
+        self.buckets = tuple(buckets)
+        # One more for observations above the largest bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observes the seconds spent in the `with` block.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Returns the upper bound of the bucket holding the percentile.
+
+        None if nothing has been observed; infinity if it's above every bound.
+        """
+        if not self.count:
+            return None
+
+        rank = percentile / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class NullMetric:
+    """Stands in for every kind of metric when metrics are disabled.
+    """
+
+    kind = "null"
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        yield
+
+
+NULL_METRIC = NullMetric()
+
+
+class Metrics:
+    """The registry of a session's metrics.
+
+    Metrics are created on first use and identified by their name and
+    labels, so asking for the same one twice returns the same object. Look
+    metrics up once, outside of hot paths, where possible.
+    """
+
+    enabled = True
+    families: Dict[str, Tuple[str, str, Dict[Labels, object]]] = None
+
+    def __init__(self, prefix: str = "olive_"):
+        """
+        Keyword Arguments:
+            prefix {str} -- prepended to every metric's name (default: {"olive_"})
+        """
+        self.prefix = prefix
+        self.families = {}
+
+    def counter(
+        self,
+        name: str,
+        description: str = "",
+        read: Callable[[], float] = None,
+        **labels,
+    ) -> Counter:
+        return self.__get(name, description, labels, lambda: Counter(read))
+
+    def gauge(
+        self,
+        name: str,
+        description: str = "",
+        read: Callable[[], float] = None,
+        **labels,
+    ) -> Gauge:
+        return self.__get(name, description, labels, lambda: Gauge(read))
+
+    def histogram(
+        self,
+        name: str,
+        description: str = "",
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        **labels,
+    ) -> Histogram:
+        return self.__get(name, description, labels, lambda: Histogram(buckets))
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for name, (kind, description, members) in self.families.items():
+            if description:
+                lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in members.items():
+                if kind != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {metric.get()}")
+                    continue
+
+                seen = 0
+                for bound, count in zip(metric.buckets, metric.counts):
+                    seen += count
+                    bucket = labels + (("le", str(bound)),)
+                    lines.append(f"{name}_bucket{_labels(bucket)} {seen}")
+                bucket = labels + (("le", "+Inf"),)
+                lines.append(f"{name}_bucket{_labels(bucket)} {metric.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {metric.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> str:
+        """Returns a one-line summary of every metric, for logging.
+        """
+        parts = []
+        for name, (kind, _, members) in self.families.items():
+            short_name = name[len(self.prefix) :]
+            for labels, metric in members.items():
+                label = short_name + _labels(labels)
+                if kind != "histogram":
+                    parts.append(f"{label}={metric.get():g}")
+                elif metric.count:
+                    parts.append(
+                        f"{label}=n:{metric.count} p50<={metric.percentile(50):g} "
+                        + f"p99<={metric.percentile(99):g}"
+                    )
+        return ", ".join(parts)
+
+    def __get(self, name: str, description: str, labels: dict, create: Callable):
+        name = self.prefix + name
+        key = tuple(sorted((key, str(value)) for key, value in labels.items()))
+        family = self.families.get(name)
+        if family is None:
+            metric = create()
+            self.families[name] = (metric.kind, description, {key: metric})
+            return metric
+
+        members = family[2]
+        metric = members.get(key)
+        if metric is None:
+            metric = members[key] = create()
+        return metric
+
+
+class NullMetrics(Metrics):
+    """A registry that records nothing, used when metrics are disabled.
+    """
+
+    enabled = False
+
+    def counter(self, name: str, *args, **kwargs) -> NullMetric:
+        return NULL_METRIC
+
+    def gauge(self, name: str, *args, **kwargs) -> NullMetric:
+        return NULL_METRIC
+
+    def histogram(self, name: str, *args, **kwargs) -> NullMetric:
+        return NULL_METRIC
+
+
+NULL_METRICS = NullMetrics()
+
+
+class MetricsExporter:
+    """Samples event loop lag and makes a session's metrics visible.
+
+    Metrics are served in the Prometheus text format at /metrics on `port`,
+    when one is set, and logged as a one-line snapshot every `log_interval`
+    seconds, when that's set.
+    """
+
+    metrics: Metrics = None
+    port: int = None
+    host: str = None
+    log_interval: float = None
+    lag_interval: float = None
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        port: int = 0,
+        host: str = "127.0.0.1",
+        log_interval: float = 0,
+        lag_interval: float = 0.5,
+    ):
+        """
+        Arguments:
+            metrics {Metrics} -- the metrics to export
+
+        Keyword Arguments:
+            port {int} -- the port to serve metrics on; 0 disables the
+                endpoint (default: {0})
+            host {str} -- the address to serve metrics on (default: {"127.0.0.1"})
+            log_interval {float} -- seconds between logged snapshots; 0
+                disables logging them (default: {0})
+            lag_interval {float} -- seconds between event loop lag samples
+                (default: {0.5})
+        """
+        self.metrics = metrics
+        self.port = port
+        self.host = host
+        self.log_interval = log_interval
+        self.lag_interval = lag_interval
+        self.__tasks: List[asyncio.Task] = []
+        self.__runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        self.__tasks.append(asyncio.ensure_future(self.__sample_lag()))
+        if self.log_interval > 0:
+            self.__tasks.append(asyncio.ensure_future(self.__log_snapshots()))
+
+        if self.port:
+            app = web.Application()
+            app.router.add_get("/metrics", self.__serve)
+            self.__runner = web.AppRunner(app, access_log=None)
+            await self.__runner.setup()
+            await web.TCPSite(self.__runner, self.host, self.port).start()
+            METRICS_LOG.info(
+                f"Serving metrics on http://{self.host}:{self.port}/metrics"
+            )
+
+    async def stop(self) -> None:
+        for task in self.__tasks:
+            task.cancel()
+        self.__tasks = []
+        if self.__runner is not None:
+            await self.__runner.cleanup()
+            self.__runner = None
+
+    async def __serve(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=self.metrics.render(), content_type="text/plain", charset="utf-8"
+        )
+
+    async def __sample_lag(self) -> None:
+        lag = self.metrics.histogram(
+            "loop_lag_seconds", "How late the event loop ran a scheduled callback"
+        )
+        while True:
+            expected = monotonic() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            lag.observe(max(0, monotonic() - expected))
+
+    async def __log_snapshots(self) -> None:
+        while True:
+            await asyncio.sleep(self.log_interval)
+            METRICS_LOG.info(self.metrics.snapshot())
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
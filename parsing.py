@@ -0,0 +1,72 @@
+import re
+from typing import List, Optional, Sequence, Tuple, overload
+
+# A Matrix user ID, like @olive:example.org or @olive:example.org:8448
+MENTION = re.compile(r"@[a-z0-9._=\-/]+:[a-zA-Z0-9.\-]+(?::\d+)?")
+
+
+class ParsedCommand(Sequence[str]):
+    """A message body split into tokens, computed once per message.
+
+    The dispatcher parses each message a single time and every plugin shares
+    the result. It behaves as a read-only sequence of the body's tokens,
+    split on any run of whitespace; the split, and each derived view, is
+    only computed the first time it's used.
+    """
+
+    body: str = None
+
+    def __init__(self, body: Optional[str]):
+        """
+        Arguments:
+            body {str} -- the message body to parse
+        """
+        self.body = body or ""
+        self.__tokens: Optional[Tuple[str, ...]] = None
+        self.__command: Optional[str] = None
+        self.__mentions: Optional[List[Tuple[int, int]]] = None
+
+    @property
+    def tokens(self) -> Tuple[str, ...]:
+        if self.__tokens is None:
+            self.__tokens = tuple(self.body.split())
+        return self.__tokens
+
+    @property
+    def command(self) -> str:
+        """The first token, lowercased; empty for a blank message.
+        """
+        if self.__command is None:
+            self.__command = self.tokens[0].lower() if self.tokens else ""
+        return self.__command
+
+    @property
+    def args(self) -> Tuple[str, ...]:
+        """The tokens following the command.
+        """
+        return self.tokens[1:]
+
+    @property
+    def mentions(self) -> List[Tuple[int, int]]:
+        """The (start, end) offsets of each user ID mentioned in the body.
+        """
+        if self.__mentions is None:
+            self.__mentions = [match.span() for match in MENTION.finditer(self.body)]
+        return self.__mentions
+
+    @overload
+    def __getitem__(self, index: int) -> str:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> Tuple[str, ...]:
+        ...
+
+    def __getitem__(self, index):
+        return self.tokens[index]
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __repr__(self) -> str:
+        return f"ParsedCommand({self.body!r})"
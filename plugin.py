@@ -1,5 +1,8 @@
 from abc import abstractmethod, ABC
-from typing import Any, Dict, List, Optional, Union
+from functools import lru_cache
+import inspect
+import re
+from typing import Any, Dict, List, Optional, Pattern, Sequence, Tuple, Union
 from logbook import Logger
 import importlib
 from os import path
@@ -7,13 +10,29 @@ from os import path
 from nio import Event, MatrixRoom, RoomMessageText
 
 from messaging import Messenger
+from cache import AsyncCache
+from http_client import HttpClient
+from parsing import ParsedCommand
 
 
 class PluginConfig:
     logger: Logger = None
+    cache_dir: str = None
+    caches: Dict[str, AsyncCache] = None
+    # Shared HTTP client; reuse it rather than opening new connections
+    http: HttpClient = None
 
-    def __init__(self, logger: Logger):
+    def __init__(
+        self,
+        logger: Logger,
+        cache_dir: str = None,
+        caches: Dict[str, AsyncCache] = None,
+        http: HttpClient = None,
+    ):
         self.logger = logger
+        self.cache_dir = cache_dir
+        self.caches = {} if caches is None else caches
+        self.http = http or HttpClient()
 
     def __copy__(self) -> 'PluginConfig':
         """Returns a deep copy of self.
@@ -28,7 +47,7 @@ class PluginConfig:
         included as children, if there were any.
         """
         if not path.exists(config_file_path) or not path.isfile(config_file_path):
-            print(1)
+            self.logger.debug(f"No config file at {config_file_path}")
             return self
 
         file_name = path.split(config_file_path)[-1]
@@ -36,18 +55,54 @@ class PluginConfig:
         module_name = "plugins." + file_name.rsplit(".")[0]
         module = importlib.import_module(module_name, package=".")
 
-        print(file_name, new_config, module_name, module)
+        self.logger.debug(f"Reading config from {module_name}")
 
         for key in module.__dict__:
-            print(key)
             new_config.__dict__[key] = module.__dict__[key]
 
         return new_config
 
+    def cache(
+        self, name: str, ttl: float, max_size: int = 1024, persist: bool = False
+    ) -> AsyncCache:
+        """Returns the cache called `name`, creating it on first use.
+
+        Caches are shared by every plugin in the session, so plugins calling
+        the same service can share one. A persisted cache survives restarts;
+        its keys and values must be JSON serializable.
+
+        Args:
+            name (str): the name of the cache
+            ttl (float): seconds an entry stays valid
+            max_size (int): the most entries kept
+            persist (bool): whether to save the cache to the cache directory
+        """
+        if name not in self.caches:
+            cache_path = None
+            if persist and self.cache_dir:
+                cache_path = path.join(self.cache_dir, f"{name}.json")
+            self.caches[name] = AsyncCache(ttl, max_size, cache_path)
+        return self.caches[name]
+
 
 class BasePlugin(ABC):
     trigger: Any = None
     plugin: PluginConfig = None
+    # Seconds `process_event` may run before it's cancelled; None uses the
+    # session's `plugin_timeout`.
+    timeout: Optional[float] = None
+    # Whether a call is costly, such as one starting a process or calling a
+    # paid API; the session limits how many of those run at once.
+    expensive: bool = False
+    # Room state the plugin reads, by event type, beyond the names, members
+    # and power levels the session always syncs
+    state_types: Sequence[str] = ()
+    # Whether the plugin needs every member of a room, rather than only those
+    # who've sent messages lately; turns off lazy loading of members
+    needs_all_members: bool = False
+
+    def __init__(self, config: PluginConfig = None):
+        self.config = config
 
     @classmethod
     def name(cls) -> str:
@@ -57,9 +112,27 @@ class BasePlugin(ABC):
 
     @classmethod
     def tokens(self, event) -> List[str]:
-        """Returns the body text of the event, split on spaces into an array.
+        """Returns the body text of the event, split on whitespace into an array.
+
+        The session parses each message once and passes the result around as
+        a `ParsedCommand`; prefer that over calling this again.
         """
-        return list(filter(lambda x: x != " " and x != "", event.body.split(" ")))
+        return list(ParsedCommand(event.body))
+
+    def takes_tokens(self) -> bool:
+        """Returns True if `process_event` accepts the message's `tokens`.
+        """
+        return _takes_tokens(type(self))
+
+    def is_triggered(self, tokens: List[str]) -> bool:
+        """Returns True if the plugin should process a message with these tokens.
+
+        Plugins with a `trigger` list are only asked about messages that start
+        with one of their trigger words; plugins without one are asked about
+        every message. By default, every message that reaches the plugin
+        triggers it.
+        """
+        return True
 
     @abstractmethod
     def process_event(
@@ -74,3 +147,127 @@ class BasePlugin(ABC):
                 events
         """
         pass
+
+
+class Command(BasePlugin):
+    """A plugin invoked by a command word, such as "ping example.org".
+
+    Commands describe the messages they handle declaratively: the words in
+    `trigger`, how many arguments may follow (`arity`) and what each
+    argument must look like (`arg_patterns`). When plugins are loaded, the
+    dispatcher compiles every command's description into a single matcher,
+    so one pass over a message finds every command it invokes. Override
+    `is_triggered` only for checks the description can't express.
+    """
+
+    # Arguments accepted after the command word: an exact count, a
+    # (minimum, maximum) range with None for no maximum, or None for any.
+    arity: Union[int, Tuple[int, Optional[int]], None] = None
+    # Regular expression each argument must match in full: one for every
+    # argument, or a sequence applying to the arguments by position.
+    # Patterns match a single token, so they shouldn't match whitespace.
+    arg_patterns: Union[str, Sequence[str], None] = None
+
+    @classmethod
+    def pattern(cls) -> str:
+        """Returns a regular expression matching the command's messages.
+
+        The expression matches a whole message body, allowing for whitespace
+        around and between tokens. Triggers match regardless of case.
+        """
+        return _command_pattern(cls)
+
+    @classmethod
+    def matches(cls, tokens: Sequence[str]) -> bool:
+        """Returns True if the tokens fit the command's description.
+        """
+        return _compiled_pattern(cls).fullmatch(" ".join(tokens)) is not None
+
+    @abstractmethod
+    def process_event(
+        self,
+        room: MatrixRoom,
+        event: Event,
+        messenger: Messenger,
+        tokens: Sequence[str],
+    ) -> None:
+        """Processes a message invoking the command.
+
+        Args:
+            room (MatrixRoom): the room where the event occurred
+            event (Event): the event itself
+            messenger (Messenger): the client's Messenger instance, for emitting
+                events
+            tokens (Sequence[str]): the message body, split into words
+        """
+        pass
+
+
+class TextCommand(Command):
+    """A command given in a plain text message.
+    """
+
+    @abstractmethod
+    def process_event(
+        self,
+        room: MatrixRoom,
+        event: RoomMessageText,
+        messenger: Messenger,
+        tokens: Sequence[str],
+    ) -> None:
+        pass
+
+
+@lru_cache(maxsize=None)
+def _command_pattern(cls: type) -> str:
+    triggers = [cls.trigger] if isinstance(cls.trigger, str) else cls.trigger or []
+    words = "|".join(re.escape(word) for word in triggers)
+
+    arity = cls.arity
+    if arity is None:
+        minimum, maximum = 0, None
+    elif isinstance(arity, int):
+        minimum, maximum = arity, arity
+    else:
+        minimum, maximum = arity
+
+    patterns = cls.arg_patterns
+    if patterns is None or isinstance(patterns, str):
+        positional: Sequence[str] = []
+        rest = _arg_pattern(patterns)
+    else:
+        positional = patterns
+        rest = _arg_pattern(None)
+
+    def arg(index: int) -> str:
+        if index < len(positional):
+            return _arg_pattern(positional[index])
+        return rest
+
+    def optional(index: int) -> str:
+        if maximum is not None and index >= maximum:
+            return ""
+        if index >= len(positional):
+            repeat = "*" if maximum is None else f"{{0,{maximum - index}}}"
+            return rf"(?:\s+{rest}){repeat}"
+        return rf"(?:\s+{arg(index)}{optional(index + 1)})?"
+
+    required = "".join(rf"\s+{arg(index)}" for index in range(minimum))
+    return rf"\s*(?i:{words}){required}{optional(minimum)}\s*"
+
+
+def _arg_pattern(pattern: Optional[str]) -> str:
+    if pattern is None:
+        return r"\S+"
+    # The argument must match the pattern up to the next whitespace.
+    return rf"(?=(?:{pattern})(?:\s|$))\S+"
+
+
+@lru_cache(maxsize=None)
+def _compiled_pattern(cls: type) -> Pattern:
+    return re.compile(_command_pattern(cls))
+
+
+@lru_cache(maxsize=None)
+def _takes_tokens(cls: type) -> bool:
+    return "tokens" in inspect.signature(cls.process_event).parameters
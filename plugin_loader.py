@@ -0,0 +1,488 @@
+import os
+import ast
+import sys
+import asyncio
+import inspect
+import importlib
+from time import perf_counter
+from types import ModuleType
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from logbook import Logger
+
+import plugin as plugin_module
+from plugin import BasePlugin, Command, PluginConfig
+from executor import run_blocking
+from log import logger_group
+
+LOADER_LOG = Logger("olive.loader")
+logger_group.add_logger(LOADER_LOG)
+
+
+class PluginSpec:
+    """What's known about a plugin class before its module is imported."""
+
+    module_name: str = None
+    class_name: str = None
+    trigger: List[str] = None
+    state_types: List[str] = None
+    needs_all_members: bool = None
+
+    def __init__(
+        self,
+        module_name: str,
+        class_name: str,
+        trigger: List[str],
+        state_types: List[str] = None,
+        needs_all_members: bool = False,
+    ):
+        self.module_name = module_name
+        self.class_name = class_name
+        self.trigger = trigger
+        self.state_types = state_types or []
+        self.needs_all_members = needs_all_members
+
+
+class LazyPlugin(BasePlugin):
+    """Stands in for a plugin until one of its triggers first fires.
+
+    The dispatcher indexes the stand-in by the triggers found when scanning
+    the plugin's source. The plugin's module is only imported, and the plugin
+    instantiated, the first time a message starts with one of them.
+    """
+
+    spec: PluginSpec = None
+
+    def __init__(self, spec: PluginSpec, loader: "PluginLoader"):
+        self.spec = spec
+        self.trigger = spec.trigger
+        self.state_types = spec.state_types
+        self.needs_all_members = spec.needs_all_members
+        self.__loader = loader
+        self.__plugin: Optional[BasePlugin] = None
+        self.__failed = False
+
+    def load(self) -> Optional[BasePlugin]:
+        """Returns the real plugin, loading it on first use; None if it failed.
+        """
+        if self.__plugin is None and not self.__failed:
+            self.__plugin = self.__loader.load_spec(self.spec)
+            self.__failed = self.__plugin is None
+        return self.__plugin
+
+    @property
+    def timeout(self) -> Optional[float]:
+        plugin = self.load()
+        return plugin.timeout if plugin else None
+
+    @property
+    def expensive(self) -> bool:
+        plugin = self.load()
+        return plugin is not None and plugin.expensive
+
+    def is_triggered(self, tokens: List[str]) -> bool:
+        plugin = self.load()
+        if plugin is None:
+            return False
+        # Loaded commands are matched by the dispatcher; check this one here.
+        if isinstance(plugin, Command) and not plugin.matches(tokens):
+            return False
+        return plugin.is_triggered(tokens)
+
+    def takes_tokens(self) -> bool:
+        plugin = self.load()
+        return plugin is not None and plugin.takes_tokens()
+
+    def process_event(self, *args, **kwargs):
+        return self.load().process_event(*args, **kwargs)
+
+
+class PluginLoader:
+    """Finds, imports and instantiates the plugins in a plugins package.
+
+    Every import and instantiation is timed, so `report` can show which
+    plugins slow down start up.
+    """
+
+    plugins_dir: str = None
+    package: str = None
+    make_config: Callable[[str], PluginConfig] = None
+    # Seconds spent importing each module and instantiating each plugin
+    import_times: Dict[str, float] = None
+    init_times: Dict[str, float] = None
+    # Imported modules by name, with their source's modification time and size
+    modules: Dict[str, Tuple[Optional[Tuple[int, int]], ModuleType]] = None
+
+    def __init__(
+        self,
+        plugins_dir: str,
+        make_config: Callable[[str], PluginConfig],
+        package: str = "plugins",
+        modules: Dict[str, Tuple[Optional[Tuple[int, int]], ModuleType]] = None,
+    ):
+        """
+        Arguments:
+            plugins_dir {str} -- the directory of the plugins package
+            make_config {Callable} -- returns the PluginConfig for the plugin
+                with the given name
+
+        Keyword Arguments:
+            package {str} -- the name of the plugins package (default: {"plugins"})
+            modules {Dict} -- imported modules to reuse while their source is
+                unchanged; loaders sharing one import each module once
+                (default: {None})
+        """
+        self.plugins_dir = plugins_dir
+        self.package = package
+        self.make_config = make_config
+        self.import_times = {}
+        self.init_times = {}
+        self.modules = {} if modules is None else modules
+        self.__modules: Dict[str, ModuleType] = {}
+
+    def module_names(self) -> List[str]:
+        """Returns the names of the modules in the plugins package.
+        """
+        plugin_files = os.listdir(self.plugins_dir)
+        return [
+            f"{self.package}.{plugin_file.rsplit('.')[0]}"
+            for plugin_file in sorted(plugin_files)
+            # Skip files like __init__.py and .gitignore
+            if not plugin_file.startswith("__") and plugin_file.endswith(".py")
+        ]
+
+    def load_all(self, lazy: bool = False) -> Dict[str, BasePlugin]:
+        """Returns every plugin in the package, by class name.
+
+        Keyword Arguments:
+            lazy {bool} -- whether to stand in for plugins with `LazyPlugin`
+                where their triggers can be read from source (default: {False})
+        """
+        importlib.import_module(self.package)
+        self.import_times = {}
+        self.init_times = {}
+        plugins: Dict[str, BasePlugin] = {}
+
+        module_names = self.module_names()
+        if len(module_names) == 0:
+            LOADER_LOG.warning("No plugin files found.")
+
+        for module_name in module_names:
+            plugins.update(self.load_module(module_name, lazy) or {})
+
+        return plugins
+
+    def load_module(
+        self, module_name: str, lazy: bool = False
+    ) -> Optional[Dict[str, BasePlugin]]:
+        """Returns the plugins in one module, by class name, (re)loading it.
+
+        Returns an empty dict if the module's file no longer exists, and None
+        if the module failed to import.
+
+        Keyword Arguments:
+            lazy {bool} -- see `load_all` (default: {False})
+        """
+        # Forget any earlier import so deferred plugins load the current code.
+        self.__modules.pop(module_name, None)
+        if not os.path.isfile(self.file_path(module_name)):
+            return {}
+
+        specs = self.scan(module_name) if lazy else None
+        if specs:
+            plugins = {}
+            for spec in specs:
+                LOADER_LOG.info(f"Deferring plugin {spec.class_name} ...")
+                plugins[spec.class_name] = LazyPlugin(spec, self)
+            return plugins
+
+        module = self.import_module(module_name)
+        if module is None:
+            return None
+        return self.instantiate_module(module)
+
+    def file_path(self, module_name: str) -> str:
+        """Returns the path of a plugin module's source file.
+        """
+        return os.path.join(self.plugins_dir, module_name.rsplit(".")[-1] + ".py")
+
+    @staticmethod
+    def module_of(plugin: BasePlugin) -> str:
+        """Returns the name of the module a plugin was, or will be, loaded from.
+        """
+        if isinstance(plugin, LazyPlugin):
+            return plugin.spec.module_name
+        return type(plugin).__module__
+
+    def import_module(self, module_name: str) -> Optional[ModuleType]:
+        """Imports a plugin module, or re-imports it if it was already imported.
+
+        Re-importing creates a new module, so classes removed from the source
+        don't linger as they would with `importlib.reload`. A module already
+        imported from unchanged source, by this loader or one sharing its
+        `modules`, is reused instead. Returns None if the module raised while
+        being imported, leaving any previous import in place.
+        """
+        start = perf_counter()
+        version = self.__version(module_name)
+        imported = self.modules.get(module_name)
+        if imported is not None and imported[0] == version:
+            self.import_times[module_name] = perf_counter() - start
+            self.__modules[module_name] = imported[1]
+            return imported[1]
+
+        previous = sys.modules.pop(module_name, None)
+        try:
+            importlib.invalidate_caches()
+            module = importlib.import_module(module_name)
+        except Exception as err:
+            LOADER_LOG.error(f"Failed to import {module_name}: {err}")
+            if previous is not None:
+                sys.modules[module_name] = previous
+            return None
+        finally:
+            self.import_times[module_name] = perf_counter() - start
+
+        self.modules[module_name] = (version, module)
+        self.__modules[module_name] = module
+        return module
+
+    def __version(self, module_name: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.file_path(module_name))
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def instantiate_module(self, module: ModuleType) -> Dict[str, BasePlugin]:
+        """Returns an instance of every plugin class defined in the module.
+        """
+        clsmembers = inspect.getmembers(
+            module,
+            lambda member: inspect.isclass(member)
+            and member.__module__ == module.__name__,
+        )
+
+        plugins = {}
+        for name, cls in clsmembers:
+            if not issubclass(cls, BasePlugin):
+                # We only want plugins that derive from BasePlugin
+                LOADER_LOG.warning(
+                    f"Skipping {name} as it doesn't derive from the BasePlugin"
+                )
+                continue
+
+            plugin = self.instantiate(name, cls)
+            if plugin is not None:
+                plugins[name] = plugin
+        return plugins
+
+    def instantiate(self, name: str, cls: type) -> Optional[BasePlugin]:
+        """Returns a new instance of a plugin, or None if its constructor raised.
+        """
+        LOADER_LOG.info(f"Loading plugin {name} ...")
+        start = perf_counter()
+        try:
+            return cls(self.make_config(name))
+        except Exception as err:
+            LOADER_LOG.error(f"Failed to instantiate {name}: {err}")
+            return None
+        finally:
+            self.init_times[name] = perf_counter() - start
+
+    def load_spec(self, spec: PluginSpec) -> Optional[BasePlugin]:
+        """Imports and instantiates the plugin described by a spec.
+        """
+        module = self.__modules.get(spec.module_name) or self.import_module(
+            spec.module_name
+        )
+        cls = getattr(module, spec.class_name, None)
+        if not inspect.isclass(cls) or not issubclass(cls, BasePlugin):
+            LOADER_LOG.error(
+                f"{spec.module_name} has no plugin named {spec.class_name}"
+            )
+            return None
+
+        plugin = self.instantiate(spec.class_name, cls)
+        LOADER_LOG.info(f"Loaded deferred plugin {spec.class_name}: {self.__timing(spec)}")
+        return plugin
+
+    def scan(self, module_name: str) -> Optional[List[PluginSpec]]:
+        """Reads a plugin module's source, without importing it, for plugins
+        that can be loaded lazily.
+
+        A class counts as a plugin if it derives, by name, from a plugin class
+        in `plugin.py` or from another plugin in the same module. Returns None
+        if any plugin's `trigger` isn't a literal list of words, as those
+        plugins have to see every message and gain nothing from waiting, or
+        if its `state_types` or `needs_all_members` aren't literals.
+        """
+        file_path = self.file_path(module_name)
+        try:
+            with open(file_path, "r") as source:
+                tree = ast.parse(source.read(), file_path)
+        except (OSError, SyntaxError) as err:
+            LOADER_LOG.warning(f"Couldn't scan {file_path}: {err}")
+            return None
+
+        plugin_names = {
+            name
+            for name, member in vars(plugin_module).items()
+            if inspect.isclass(member) and issubclass(member, BasePlugin)
+        }
+        specs = []
+        for node in tree.body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+            bases = {self.__base_name(base) for base in node.bases}
+            if not bases & plugin_names:
+                continue
+            plugin_names.add(node.name)
+
+            trigger = self.__literal_trigger(node)
+            if not trigger:
+                return None
+            try:
+                state_types = self.__literal(node, "state_types", [])
+                needs_all_members = self.__literal(node, "needs_all_members", False)
+            except ValueError:
+                return None
+            specs.append(
+                PluginSpec(
+                    module_name,
+                    node.name,
+                    trigger,
+                    state_types=list(state_types),
+                    needs_all_members=needs_all_members,
+                )
+            )
+
+        return specs or None
+
+    def __timing(self, spec: PluginSpec) -> str:
+        return (
+            f"import {self.import_times.get(spec.module_name, 0) * 1000:.1f}ms, "
+            + f"init {self.init_times.get(spec.class_name, 0) * 1000:.1f}ms"
+        )
+
+    def report(self) -> None:
+        """Logs how long each module took to import and each plugin to start,
+        slowest first.
+        """
+        timings = [
+            (seconds, f"import {module_name}")
+            for module_name, seconds in self.import_times.items()
+        ] + [(seconds, f"init {name}") for name, seconds in self.init_times.items()]
+
+        total = sum(seconds for seconds, _ in timings)
+        LOADER_LOG.info(f"Plugin start up took {total * 1000:.1f}ms")
+        for seconds, step in sorted(timings, reverse=True):
+            LOADER_LOG.info(f"  {seconds * 1000:8.1f}ms  {step}")
+
+    @staticmethod
+    def __base_name(base: ast.expr) -> Optional[str]:
+        if isinstance(base, ast.Name):
+            return base.id
+        if isinstance(base, ast.Attribute):
+            return base.attr
+        return None
+
+    @classmethod
+    def __literal_trigger(cls, node: ast.ClassDef) -> Optional[List[str]]:
+        try:
+            trigger = cls.__literal(node, "trigger", None)
+        except ValueError:
+            return None
+        if isinstance(trigger, str):
+            trigger = [trigger]
+        if isinstance(trigger, (list, tuple)) and all(
+            isinstance(word, str) for word in trigger
+        ):
+            return list(trigger)
+        return None
+
+    @staticmethod
+    def __literal(node: ast.ClassDef, name: str, default: Any) -> Any:
+        """Returns the literal assigned to `name` in a class body, or `default`
+        if there's no assignment; raises ValueError if it isn't a literal.
+        """
+        for statement in node.body:
+            if isinstance(statement, ast.Assign):
+                targets, value = statement.targets, statement.value
+            elif isinstance(statement, ast.AnnAssign) and statement.value:
+                targets, value = [statement.target], statement.value
+            else:
+                continue
+
+            if any(isinstance(t, ast.Name) and t.id == name for t in targets):
+                return ast.literal_eval(value)
+        return default
+
+
+class PluginWatcher:
+    """Polls a loader's plugin files and reports the modules that changed.
+
+    Added, removed and modified files are all reported, by module name, to
+    `on_change`, which is awaited before the next poll.
+    """
+
+    loader: PluginLoader = None
+    interval: float = None
+    on_change: Callable[[Set[str]], Awaitable] = None
+
+    def __init__(
+        self,
+        loader: PluginLoader,
+        interval: float,
+        on_change: Callable[[Set[str]], Awaitable],
+    ):
+        """
+        Arguments:
+            loader {PluginLoader} -- the loader whose plugin files to watch
+            interval {float} -- seconds between polls
+            on_change {Callable} -- awaited with the names of changed modules
+        """
+        self.loader = loader
+        self.interval = interval
+        self.on_change = on_change
+        self.__task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.__task = asyncio.ensure_future(self.__watch())
+
+    def stop(self) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+
+    def snapshot(self) -> Dict[str, float]:
+        """Returns the modification time of each plugin module's file.
+        """
+        times = {}
+        for module_name in self.loader.module_names():
+            try:
+                file_path = self.loader.file_path(module_name)
+                times[module_name] = os.stat(file_path).st_mtime
+            except FileNotFoundError:
+                # Deleted since it was listed; the next poll reports it.
+                continue
+        return times
+
+    async def __watch(self) -> None:
+        previous = await run_blocking(self.snapshot)
+        while True:
+            await asyncio.sleep(self.interval)
+            current = await run_blocking(self.snapshot)
+            changed = {
+                module_name
+                for module_name in previous.keys() | current.keys()
+                if previous.get(module_name) != current.get(module_name)
+            }
+            previous = current
+            if not changed:
+                continue
+
+            LOADER_LOG.info(f"Plugin files changed: {', '.join(sorted(changed))}")
+            try:
+                await self.on_change(changed)
+            except Exception as err:
+                LOADER_LOG.error(f"Failed to reload plugins: {err}")
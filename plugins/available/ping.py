@@ -1,4 +1,3 @@
-import sys
 from typing import List
 from plugin import TextCommand
 from nio import MatrixRoom, RoomMessageText
@@ -6,13 +5,17 @@ import subprocess
 
 from urllib.parse import urlparse
 from messaging import Messenger
+from executor import run_blocking
 
 
 class Ping(TextCommand):
     trigger = ["ping"]
+    arity = 1
+    # Each call runs `ping` in a subprocess
+    expensive = True
 
-    @staticmethod
     async def process_event(
+        self,
         room: MatrixRoom,
         event: RoomMessageText,
         messenger: Messenger,
@@ -25,18 +28,24 @@ class Ping(TextCommand):
             event {RoomMessageText} -- the message that triggered this call
             messenger {Messenger} -- for sending messages out
         """
-        await messenger.send_text(room.room_id, "Running ping test...")
+        # Sent on its own, as it's replaced by the results
+        placeholder = await messenger.send_text(
+            room.room_id, "Running ping test...", coalesce=False
+        )
 
         # `tokens` should be "ping <host>"
         host = tokens[1]
-        ping = subprocess.Popen(
-            ["ping", "-c", "4", host], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        ping = await run_blocking(
+            subprocess.run,
+            ["ping", "-c", "4", host],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
         )
-        out, err = ping.communicate()
+        out, err = ping.stdout, ping.stderr
 
         if err:
             body = "There was an error running the ping test. See the logs for details."
-            print(err, file=sys.stderr)
+            self.config.logger.error(err.decode("utf8"))
         else:
             # out is in bytes. We split on line breaks. The last line is empty.
             # ping produces a line like min/avg/max/stddev = num/num/num/num ms;
@@ -48,22 +57,21 @@ class Ping(TextCommand):
                 body = f"Ping time to {host}:\n\tmin: {min_time}\n\tavg: {avg}\n\tmax: {max_time}\n\tstddev: {stddev}"
             except Exception as err:
                 body = f"Couldn't ping {host}"
-                print(f"Failed to ping {host}", file=sys.stderr)
-                print(out.decode("utf8"))
+                self.config.logger.error(
+                    f"Failed to ping {host}: {err}\n{out.decode('utf8')}"
+                )
 
-        await messenger.send_text(room.room_id, body=body)
+        if placeholder:
+            # Show the results in place of the placeholder message
+            await messenger.edit_text(room.room_id, placeholder, body=body)
+        else:
+            await messenger.send_text(room.room_id, body=body)
         return
 
     def is_triggered(self, tokens: List[str]) -> bool:
-        """Returns True if a list of strings is a valid ping command.
+        """Returns True if the host to ping might be a URL.
         """
-
-        result = (
-            tokens[0].lower() == self.trigger[0]
-            and len(tokens) == 2
-            and self.__maybe_url(tokens[1])
-        )
-        return result
+        return self.__maybe_url(tokens[1])
 
     def __maybe_url(self, given: str, no_recurse=False) -> bool:
         """Detect if the given input string might be a URL we can ping.
@@ -85,13 +93,13 @@ class Ping(TextCommand):
             # TODO: We should also be avoiding pinging any IP addresses that
             # aren't explictly external, otherwise we'll be providing local IP
             # data to attackers.
-            print("Ping | REFUSED: No .local domains.")
+            self.config.logger.info("REFUSED: No .local domains.")
             return False
 
         # It should try to look like a domain name or IPv4 or IPv6 address
         if "." not in given and ":" not in given:
-            print(
-                "Ping | REFUSED: Provided text doesn't look like a domain name or IP address."
+            self.config.logger.info(
+                "REFUSED: Provided text doesn't look like a domain name or IP address."
             )
             return False
 
@@ -1,11 +1,10 @@
+import asyncio
 from typing import List
 from plugin import BasePlugin, PluginConfig
 from nio import MatrixRoom, RoomMessageText
 
 from messaging import Messenger
 
-from time import sleep
-
 
 class PingPong(BasePlugin):
     trigger = ["ping"]
@@ -15,13 +14,16 @@ class PingPong(BasePlugin):
         self.config = PluginConfig
 
     async def process_event(
-        self, room: MatrixRoom, event: RoomMessageText, messenger: Messenger,
+        self,
+        room: MatrixRoom,
+        event: RoomMessageText,
+        messenger: Messenger,
+        tokens: List[str],
     ) -> None:
-        tokens = self.tokens(event)
         if not (tokens[0] == self.trigger[0] and len(tokens) == 1):
             return
 
-        sleep(2.5)
+        await asyncio.sleep(2.5)
         await messenger.send_text(
             room.room_id,
             body=f"{room.user_name(event.sender)}: Pong!",
@@ -11,6 +11,8 @@ class Tag(TextCommand):
     """
 
     trigger = ["tag"]
+    # Anyone in the room can be it, not only those who've spoken lately
+    needs_all_members = True
 
     @staticmethod
     async def process_event(
@@ -27,9 +29,3 @@ class Tag(TextCommand):
             body=f"{room.user_name(random_user.user_id)}: You're it!",
             formatted_body=f'<a href="https://matrix.to/#/{random_user.user_id}">{room.user_name(random_user.user_id)}</a> You\'re it!',
         )
-
-    def is_triggered(self, tokens: List[str]) -> bool:
-        """Returns True if the second token matches the trigger word.
-        """
-
-        return tokens[0] == self.trigger[0]
@@ -5,12 +5,12 @@ from typing import List
 from plugin import BasePlugin, PluginConfig
 from nio import MatrixRoom, RoomMessageText
 import subprocess
-from urllib import request
 import urllib.parse
 import json
 import re
 
 from messaging import Messenger
+from cache import AsyncCache
 
 """
 define.py requires some configuration setup:
@@ -31,6 +31,9 @@ api_endpoint = "https://www.dictionaryapi.com/api/v3/references/collegiate"
 """
 
 CONFIG_FILE_NAME = "__config_define.py"
+# Definitions rarely change; keep them for a day
+CACHE_TTL = 24 * 60 * 60
+CACHE_SIZE = 1024
 
 
 class Define(BasePlugin):
@@ -39,7 +42,10 @@ class Define(BasePlugin):
 
     trigger = ["define"]
     config: PluginConfig = None
+    cache: AsyncCache = None
     enabled = False
+    # Each call may hit the (metered) dictionary API
+    expensive = True
 
     def __init__(self, config: PluginConfig):
         self.config = config
@@ -58,13 +64,18 @@ class Define(BasePlugin):
         self.enabled = True
         # Create a new updated PluginConfig based on our config file
         self.config = config.config_from_file(path_to_config)
+        self.cache = self.config.cache("define", CACHE_TTL, CACHE_SIZE, persist=True)
 
         self.config.logger.info(
             self.config.api_endpoint, self.config.api_key, self.config.api_format, self.config.max_def_count
         )
 
     async def process_event(
-        self, room: MatrixRoom, event: RoomMessageText, messenger: Messenger,
+        self,
+        room: MatrixRoom,
+        event: RoomMessageText,
+        messenger: Messenger,
+        tokens: List[str],
     ) -> None:
         """Define a provided word.
         
@@ -74,17 +85,15 @@ class Define(BasePlugin):
             room {MatrixRoom} -- the room from which the message came
             event {RoomMessageText} -- the message that triggered this call
             messenger {Messenger} -- for sending messages out
+            tokens {List[str]} -- the message body, split into words
         """
-        tokens = self.tokens(event)
-
         # UNSAFE! Do NOT directly submit to an API
         term = " ".join(tokens[1:])
-        # We use urllib to at least _try_ to clean up the term
-        query = urllib.parse.quote(term, safe="")
-        url = request.urlopen(f"{self.config.api_endpoint}/{self.config.api_format}/{query}?key={self.config.api_key}")
         data: dict = None
         try:
-            data = json.loads(url.read().decode())
+            data = await self.cache.get_or_fetch(
+                term.lower(), lambda: self.__lookup(term)
+            )
         except json.JSONDecodeError as err:
             self.config.logger.warn(f"Failed to read from the Merriam-Webster API. Error: {err}")
             return
@@ -127,14 +136,26 @@ class Define(BasePlugin):
             )
             return
 
-        body = f"{term} {functional_label}"
-        formatted_body = f"<b>{term}</b> <i>{functional_label}</i>"
+        body = [f"{term} {functional_label}"]
+        formatted_body = [f"<b>{term}</b> <i>{functional_label}</i>"]
 
         for index, definition in enumerate(definition_collection[:self.config.max_def_count]):
-            body += f" {index + 1}. {definition}"
-            formatted_body += f"<br>&ensp;{index + 1}. {definition}"
+            body.append(f"{index + 1}. {definition}")
+            formatted_body.append(f"&ensp;{index + 1}. {definition}")
 
         await messenger.send_text(
-            room.room_id, body=body, formatted_body=formatted_body
+            room.room_id, body=" ".join(body), formatted_body="<br>".join(formatted_body)
         )
-        return
\ No newline at end of file
+        return
+
+    async def __lookup(self, term: str) -> list:
+        """Returns the parsed Merriam-Webster API response for `term`.
+        """
+        # We use urllib to at least _try_ to clean up the term
+        query = urllib.parse.quote(term, safe="")
+        return await self.config.http.get_json(f"{self.config.api_endpoint}/{self.config.api_format}/{query}?key={self.config.api_key}")
+
+    def is_triggered(self, tokens: List[str]) -> bool:
+        """Returns True if the plugin is configured and a term was provided.
+        """
+        return self.enabled and len(tokens) > 1
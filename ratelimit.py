@@ -0,0 +1,58 @@
+import asyncio
+from time import monotonic
+
+
+class TokenBucket:
+    """A token bucket refilling at `rate` tokens per second, up to `capacity`.
+
+    Besides spending tokens, the bucket can be paused for a while, for
+    instance when a server asks us to retry after some delay.
+    """
+
+    rate: float = None
+    capacity: float = None
+    tokens: float = None
+    updated: float = None
+    paused_until: float = 0
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Arguments:
+            rate {float} -- tokens added per second
+            capacity {float} -- the most tokens the bucket holds
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+
+    def delay(self, cost: float = 1) -> float:
+        """Returns the seconds until `cost` tokens can be spent.
+        """
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        wait = max(0, self.paused_until - now)
+        if self.tokens < cost:
+            wait = max(wait, (cost - self.tokens) / self.rate)
+        return wait
+
+    def try_acquire(self, cost: float = 1) -> bool:
+        """Spends `cost` tokens if they're available now; returns whether it did.
+        """
+        if self.delay(cost) > 0:
+            return False
+        self.tokens -= cost
+        return True
+
+    async def acquire(self, cost: float = 1) -> None:
+        """Waits until `cost` tokens are available, then spends them.
+        """
+        while not self.try_acquire(cost):
+            await asyncio.sleep(self.delay(cost))
+
+    def pause(self, seconds: float) -> None:
+        """Hands out no tokens for the next `seconds` seconds.
+        """
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
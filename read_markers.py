@@ -0,0 +1,90 @@
+import asyncio
+from typing import Dict, Optional, Tuple
+
+from logbook import Logger
+from nio import AsyncClient, Event, RoomReadMarkersError
+
+from log import logger_group
+
+READ_MARKERS_LOG = Logger("olive.read_markers")
+logger_group.add_logger(READ_MARKERS_LOG)
+
+
+class ReadMarkerAggregator:
+    """Batches read-marker updates into one request per room.
+
+    Marking an event only records it as the newest seen in its room. Pending
+    markers are sent in the background once per `debounce` seconds or, with
+    a debounce of 0, once per sync batch, so a burst of messages in a room
+    costs a single request and never delays the plugins handling them.
+    """
+
+    client: AsyncClient = None
+    debounce: float = None
+    newest: Dict[str, Tuple[int, str]] = None
+
+    def __init__(self, client: AsyncClient, debounce: float):
+        """
+        Arguments:
+            client {AsyncClient} -- the client to send markers with
+            debounce {float} -- seconds to wait for more events before
+                sending; 0 sends at the end of each sync batch
+        """
+        self.client = client
+        self.debounce = debounce
+        self.newest = {}
+        self.__pending: Optional[asyncio.Task] = None
+
+    def mark(self, room_id: str, event: Event) -> None:
+        """Records an event as read, if it's the newest seen in its room.
+        """
+        current = self.newest.get(room_id)
+        if current is None or event.server_timestamp >= current[0]:
+            self.newest[room_id] = (event.server_timestamp, event.event_id)
+
+        if self.debounce > 0:
+            self.__schedule(self.debounce)
+
+    def end_of_batch(self) -> None:
+        """Notes that a sync batch has been handled.
+        """
+        if self.debounce <= 0 and self.newest:
+            self.__schedule(0)
+
+    async def flush(self) -> None:
+        """Sends the newest marker of every room with one pending.
+        """
+        newest, self.newest = self.newest, {}
+        await asyncio.gather(
+            *(
+                self.__send(room_id, event_id)
+                for room_id, (_, event_id) in newest.items()
+            )
+        )
+
+    async def close(self) -> None:
+        """Cancels any scheduled send and sends pending markers now.
+        """
+        if self.__pending is not None:
+            self.__pending.cancel()
+        await self.flush()
+
+    def __schedule(self, delay: float) -> None:
+        if self.__pending is None or self.__pending.done():
+            self.__pending = asyncio.ensure_future(self.__flush_later(delay))
+
+    async def __flush_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    async def __send(self, room_id: str, event_id: str) -> None:
+        try:
+            response = await self.client.room_read_markers(
+                room_id, event_id, event_id
+            )
+        except Exception as err:
+            READ_MARKERS_LOG.warning(f"Failed to mark {event_id} as read: {err}")
+            return
+
+        if isinstance(response, RoomReadMarkersError):
+            READ_MARKERS_LOG.warning(f"Failed to mark {event_id} as read: {response}")
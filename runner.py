@@ -0,0 +1,113 @@
+import asyncio
+from typing import Awaitable, Dict, Iterable, Optional, Set
+
+from nio import Event, MatrixRoom
+
+from log import plugin_logger
+from metrics import Metrics, NULL_METRICS
+
+
+class PluginRunner:
+    """Runs plugin work concurrently so one slow plugin can't stall the rest.
+
+    Each submitted call becomes its own task. At most `concurrency` plugin
+    calls run at once, and each is cancelled once it has run longer than its
+    timeout. Errors are reported per plugin and never reach the caller.
+    """
+
+    semaphore: asyncio.Semaphore = None
+    timeout: float = None
+    tasks: Dict[str, Set[asyncio.Task]] = None
+    metrics: Metrics = None
+
+    def __init__(self, concurrency: int, timeout: float, metrics: Metrics = None):
+        """
+        Arguments:
+            concurrency {int} -- the most plugin calls allowed to run at once
+            timeout {float} -- default seconds a plugin call may run for; 0
+                disables the timeout
+
+        Keyword Arguments:
+            metrics {Metrics} -- records each plugin's run time and failures
+                (default: {None})
+        """
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.timeout = timeout
+        self.tasks = {}
+        self.metrics = metrics or NULL_METRICS
+
+    def submit(
+        self,
+        name: str,
+        room: MatrixRoom,
+        event: Event,
+        call: Awaitable,
+        timeout: Optional[float] = None,
+    ) -> asyncio.Task:
+        """Schedules a plugin call and returns its task without waiting on it.
+
+        Arguments:
+            name {str} -- the name of the plugin being run
+            room {MatrixRoom} -- the room the event came from, for reporting
+            event {Event} -- the event being processed, for reporting
+            call {Awaitable} -- the plugin's `process_event` coroutine
+
+        Keyword Arguments:
+            timeout {float} -- overrides the runner's timeout (default: {None})
+        """
+        task = asyncio.ensure_future(
+            self.__run(
+                name, room, event, call, self.timeout if timeout is None else timeout
+            )
+        )
+        running = self.tasks.setdefault(name, set())
+        running.add(task)
+        task.add_done_callback(running.discard)
+        return task
+
+    def in_flight(self, names: Iterable[str] = None) -> Set[asyncio.Task]:
+        """Returns the unfinished tasks for the given plugins, or for all.
+        """
+        if names is None:
+            names = self.tasks.keys()
+        return {task for name in names for task in self.tasks.get(name, ())}
+
+    async def drain(self, names: Iterable[str] = None) -> None:
+        """Waits for in-flight calls of the given plugins, or all, to finish.
+        """
+        pending = self.in_flight(names)
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def __run(
+        self,
+        name: str,
+        room: MatrixRoom,
+        event: Event,
+        call: Awaitable,
+        timeout: float,
+    ) -> None:
+        async with self.semaphore:
+            try:
+                with self.metrics.histogram(
+                    "plugin_seconds", "Time plugins spend on an event", plugin=name
+                ).time():
+                    await asyncio.wait_for(call, timeout or None)
+            except asyncio.TimeoutError:
+                self.metrics.counter(
+                    "plugin_timeouts_total", "Plugin calls cancelled", plugin=name
+                ).inc()
+                plugin_logger(name).error(
+                    f"Plugin {name} timed out after {timeout}s while processing "
+                    + f"the event {event.event_id} in room {room.display_name}."
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.metrics.counter(
+                    "plugin_errors_total", "Plugin calls that raised", plugin=name
+                ).inc()
+                plugin_logger(name).exception(
+                    f"Plugin {name} encountered an error while processing "
+                    + f"the event {event.event_id} in room {room.display_name}."
+                )
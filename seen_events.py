@@ -0,0 +1,162 @@
+import os
+import asyncio
+from collections import OrderedDict
+from hashlib import blake2b
+from tempfile import NamedTemporaryFile
+from typing import List, Optional
+
+from logbook import Logger
+
+from executor import run_blocking
+from log import logger_group
+
+SEEN_LOG = Logger("olive.seen_events")
+logger_group.add_logger(SEEN_LOG)
+
+# Bytes kept per event: a hash of its ID, so every record is the same size
+RECORD_SIZE = 8
+
+
+def event_key(event_id: str) -> int:
+    """Returns the compact key an event is remembered by.
+    """
+    return int.from_bytes(
+        blake2b(event_id.encode(), digest_size=RECORD_SIZE).digest(), "little"
+    )
+
+
+class SeenEvents:
+    """Remembers the most recent events processed, to drop ones seen twice.
+
+    Up to `max_size` events are kept in memory, least recently seen first out,
+    so checking an event is a dictionary lookup. With a `path`, they survive
+    restarts: once an event has been `handled`, it's appended to the file as
+    a fixed-size hash of its ID, written off the event loop by `flush`, and
+    the file is rewritten with only the remembered events once it has grown
+    to twice as many. Events seen but not yet handled stay in memory only:
+    the session doesn't save its sync token past them either, so after a
+    crash the homeserver sends them again and they're processed then.
+    """
+
+    path: Optional[str] = None
+    max_size: int = None
+    # Whether each remembered event has been handled, so it may be saved
+    keys: "OrderedDict[int, bool]" = None
+    # Duplicates dropped so far
+    duplicates: int = 0
+
+    def __init__(self, path: Optional[str] = None, max_size: int = 10000):
+        """
+        Keyword Arguments:
+            path {str} -- the file to keep seen events in; None keeps them
+                in memory only (default: {None})
+            max_size {int} -- the most events remembered (default: {10000})
+        """
+        self.path = path or None
+        self.max_size = max(1, max_size)
+        self.keys = OrderedDict()
+        self.__pending: List[int] = []
+        self.__records = 0
+        self.__lock = asyncio.Lock()
+
+        if self.path is not None:
+            self.__load()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, event_id: str) -> bool:
+        """Records an event; returns False if it had already been seen.
+
+        The event is only saved once it's been `handled`.
+        """
+        key = event_key(event_id)
+        keys = self.keys
+        if key in keys:
+            keys.move_to_end(key)
+            self.duplicates += 1
+            return False
+
+        keys[key] = False
+        if len(keys) > self.max_size:
+            keys.popitem(last=False)
+        return True
+
+    def handled(self, event_id: str) -> None:
+        """Has the next flush save an event, now that it's been dealt with.
+
+        Arguments:
+            event_id {str} -- the event, processed or deliberately dropped
+        """
+        key = event_key(event_id)
+        if key in self.keys:
+            self.keys[key] = True
+        if self.path is not None:
+            self.__pending.append(key)
+
+    async def flush(self) -> None:
+        """Writes the events handled since the last flush to the file.
+        """
+        if not self.__pending:
+            return
+        async with self.__lock:
+            pending, self.__pending = self.__pending, []
+            try:
+                if self.__records + len(pending) > 2 * self.max_size:
+                    # Pending events are in memory too, unless already evicted
+                    keys = [key for key, handled in self.keys.items() if handled]
+                    await run_blocking(self.__rewrite, keys)
+                    self.__records = len(keys)
+                else:
+                    await run_blocking(self.__append, pending)
+                    self.__records += len(pending)
+            except OSError as err:
+                # Keep them for the next flush to retry
+                self.__pending[:0] = pending
+                SEEN_LOG.error(f"Failed to save {self.path}: {err}")
+
+    def __load(self) -> None:
+        try:
+            with open(self.path, "rb") as seen_file:
+                data = seen_file.read()
+        except FileNotFoundError:
+            return
+        except OSError as err:
+            SEEN_LOG.warning(f"Ignoring unreadable seen events file {self.path}: {err}")
+            return
+
+        records = self.__records = len(data) // RECORD_SIZE
+        if len(data) % RECORD_SIZE:
+            # Drop a record cut short by a crash, so appends stay aligned
+            try:
+                os.truncate(self.path, records * RECORD_SIZE)
+            except OSError as err:
+                SEEN_LOG.warning(f"Couldn't repair {self.path}: {err}")
+                # Have the next flush rewrite the file instead
+                self.__records = 2 * self.max_size
+        for index in range(max(0, records - self.max_size), records):
+            offset = index * RECORD_SIZE
+            key = int.from_bytes(data[offset : offset + RECORD_SIZE], "little")
+            self.keys[key] = True
+            self.keys.move_to_end(key)
+
+    def __append(self, keys: List[int]) -> None:
+        with open(self.path, "ab") as seen_file:
+            seen_file.write(self.__encode(keys))
+
+    def __rewrite(self, keys: List[int]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with NamedTemporaryFile(
+            "wb", dir=directory, prefix=".seen_events.", delete=False
+        ) as temp_file:
+            try:
+                temp_file.write(self.__encode(keys))
+            except OSError:
+                os.unlink(temp_file.name)
+                raise
+        os.replace(temp_file.name, self.path)
+
+    @staticmethod
+    def __encode(keys: List[int]) -> bytes:
+        return b"".join(key.to_bytes(RECORD_SIZE, "little") for key in keys)
@@ -0,0 +1,243 @@
+import asyncio
+import random
+from collections import deque
+from time import monotonic
+from typing import Deque, Dict, Optional
+from uuid import uuid4
+
+from aiohttp import ClientError
+from logbook import Logger
+from nio import (
+    AsyncClient,
+    ErrorResponse,
+    LocalProtocolError,
+    RoomSendError,
+    RoomSendResponse,
+    SendRetryError,
+)
+
+from log import logger_group
+from ratelimit import TokenBucket
+
+SEND_LOG = Logger("olive.send_queue")
+logger_group.add_logger(SEND_LOG)
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+
+class OutboundMessage:
+    room_id: str = None
+    message_type: str = None
+    content: dict = None
+    tx_id: str = None
+    queued_at: float = None
+    result: asyncio.Future = None
+
+    def __init__(self, room_id: str, message_type: str, content: dict):
+        self.room_id = room_id
+        self.message_type = message_type
+        self.content = content
+        self.tx_id = str(uuid4())
+        self.queued_at = monotonic()
+        self.result = asyncio.get_running_loop().create_future()
+
+    def resolve(self, event_id: Optional[str]) -> None:
+        if not self.result.done():
+            self.result.set_result(event_id)
+
+    def fail(self, error: Exception) -> None:
+        if not self.result.done():
+            self.result.set_exception(error)
+
+
+class SendQueue:
+    """Delivers outgoing events in order per room, within a global rate limit.
+
+    Each room has its own bounded FIFO, drained by a worker task that exists
+    only while the room has messages waiting. Every send spends a token from
+    one bucket shared by all rooms; when the homeserver rate limits us, the
+    bucket is paused for the `retry_after_ms` it asks for. Failed sends are
+    retried with jittered exponential backoff.
+
+    When a room's queue is full, the `overflow` policy decides what happens:
+    `block` waits for space, `drop_oldest` discards the oldest waiting message
+    and `drop_newest` discards the message being queued.
+    """
+
+    client: AsyncClient = None
+    bucket: TokenBucket = None
+    max_size: int = None
+    overflow: str = None
+    max_retries: int = None
+    rooms: Dict[str, Deque[OutboundMessage]] = None
+    # Totals since start, for monitoring
+    sent: int = 0
+    failed: int = 0
+    dropped: int = 0
+    latencies: Deque[float] = None
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        rate: float = 5,
+        burst: int = 10,
+        max_size: int = 100,
+        overflow: str = "block",
+        max_retries: int = 3,
+    ):
+        """
+        Arguments:
+            client {AsyncClient} -- the client to send with
+
+        Keyword Arguments:
+            rate {float} -- events sent per second, across all rooms
+                (default: {5})
+            burst {int} -- events that may be sent at once (default: {10})
+            max_size {int} -- the most events waiting per room (default: {100})
+            overflow {str} -- one of OVERFLOW_POLICIES (default: {"block"})
+            max_retries {int} -- retries before an event is given up on
+                (default: {3})
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow}")
+
+        self.client = client
+        self.bucket = TokenBucket(rate, burst)
+        self.max_size = max(1, max_size)
+        self.overflow = overflow
+        self.max_retries = max_retries
+        self.rooms = {}
+        self.latencies = deque(maxlen=1000)
+        self.__workers: Dict[str, asyncio.Task] = {}
+        self.__space = asyncio.Condition()
+
+        client.add_response_callback(self.__on_error_response, ErrorResponse)
+
+    @property
+    def depth(self) -> int:
+        """The number of events waiting to be sent, across all rooms.
+        """
+        return sum(len(queue) for queue in self.rooms.values())
+
+    def latency(self, percentile: float) -> float:
+        """Returns the given percentile, 0 to 100, of recent send latencies in
+        seconds, measured from queueing to the server's acknowledgement.
+        """
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+    async def put(
+        self, room_id: str, content: dict, message_type: str = "m.room.message"
+    ) -> asyncio.Future:
+        """Queues an event and returns a future for its event ID.
+
+        The future resolves to None if the event was dropped or couldn't be
+        sent, and raises the error if sending it raised an unexpected one.
+        """
+        message = OutboundMessage(room_id, message_type, content)
+        queue = self.rooms.setdefault(room_id, deque())
+
+        if len(queue) >= self.max_size:
+            if self.overflow == "drop_newest":
+                self.__drop(message)
+                return message.result
+            elif self.overflow == "drop_oldest":
+                self.__drop(queue.popleft())
+            else:
+                async with self.__space:
+                    await self.__space.wait_for(
+                        lambda: len(self.rooms.get(room_id, ())) < self.max_size
+                    )
+                # The room's worker may have finished while we waited.
+                queue = self.rooms.setdefault(room_id, deque())
+
+        queue.append(message)
+        worker = self.__workers.get(room_id)
+        if worker is None or worker.done():
+            self.__workers[room_id] = asyncio.ensure_future(self.__drain(room_id))
+        return message.result
+
+    async def close(self) -> None:
+        """Waits for every queued event to be sent or given up on.
+        """
+        workers = [task for task in self.__workers.values() if not task.done()]
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def __drop(self, message: OutboundMessage) -> None:
+        self.dropped += 1
+        SEND_LOG.warning(f"Send queue for {message.room_id} is full; dropped a message")
+        message.resolve(None)
+
+    async def __drain(self, room_id: str) -> None:
+        queue = self.rooms[room_id]
+        while queue:
+            message = queue.popleft()
+            async with self.__space:
+                self.__space.notify_all()
+
+            try:
+                event_id = await self.__deliver(message)
+            except Exception as err:
+                # Only this message is lost; the rest of the room's queue is
+                # still sent
+                self.failed += 1
+                SEND_LOG.exception(f"Failed to send to room {message.room_id}")
+                message.fail(err)
+            else:
+                message.resolve(event_id)
+
+        del self.rooms[room_id]
+
+    async def __deliver(self, message: OutboundMessage) -> Optional[str]:
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                response = await self.client.room_send(
+                    message.room_id,
+                    message_type=message.message_type,
+                    content=message.content,
+                    tx_id=message.tx_id,
+                )
+            except LocalProtocolError as err:
+                error = err
+                break
+            except (SendRetryError, ClientError, asyncio.TimeoutError) as err:
+                error = err
+            else:
+                if isinstance(response, RoomSendResponse):
+                    self.sent += 1
+                    self.latencies.append(monotonic() - message.queued_at)
+                    return response.event_id
+
+                error = response
+                if not self.__is_retryable(response):
+                    break
+
+            if attempt < self.max_retries:
+                backoff = (2 ** attempt) * random.uniform(0.5, 1.5)
+                SEND_LOG.warning(
+                    f"Failed to send to room {message.room_id} ({error}); "
+                    + f"retrying in {backoff:.1f}s"
+                )
+                await asyncio.sleep(backoff)
+
+        self.failed += 1
+        SEND_LOG.error(f"Gave up sending to room {message.room_id}: {error}")
+        return None
+
+    def __is_retryable(self, response: RoomSendError) -> bool:
+        if response.retry_after_ms or response.status_code == "M_LIMIT_EXCEEDED":
+            return True
+        # Server-side errors are worth another try; client errors are not.
+        return response.transport_response is not None and (
+            response.transport_response.status >= 500
+        )
+
+    async def __on_error_response(self, response: ErrorResponse) -> None:
+        # Any rate limited request, ours or nio's own, pauses every room.
+        if response.retry_after_ms:
+            self.bucket.pause(response.retry_after_ms / 1000)
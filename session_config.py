@@ -1,5 +1,6 @@
 import yaml
 import sys
+from typing import Dict
 
 
 class SessionConfig:
@@ -7,10 +8,63 @@ class SessionConfig:
     matrix_id: str = None
     password: str = None
     next_batch_file: str = None
+    next_batch_interval: float = None
+    state_store_file: str = None
+    session_file: str = None
+    seen_events_file: str = None
+    seen_events_size: int = None
+    cache_dir: str = None
+    read_marker_debounce: float = None
+    sync_filter: bool = None
+    lazy_load_members: bool = None
+    join_concurrency: int = None
+    send_rate: float = None
+    send_burst: int = None
+    send_queue_size: int = None
+    send_overflow: str = None
+    send_retries: int = None
+    coalesce_window: float = None
+    http_connections_per_host: int = None
+    http_timeout: float = None
+    lazy_plugins: bool = None
+    hot_reload: bool = None
+    hot_reload_interval: float = None
+    ingest_workers: int = None
+    ingest_queue_size: int = None
+    plugin_concurrency: int = None
+    plugin_timeout: float = None
+    user_command_rate: float = None
+    user_command_burst: int = None
+    room_command_rate: float = None
+    room_command_burst: int = None
+    plugin_command_rate: float = None
+    plugin_command_burst: int = None
+    duplicate_command_window: float = None
+    max_expensive_commands: int = None
+    catch_up_policy: str = None
+    catch_up_age: float = None
+    catch_up_rate: float = None
+    blocking_threads: int = None
+    blocking_processes: int = None
+    loop_stall_threshold: float = None
+    metrics: bool = None
+    metrics_port: int = None
+    metrics_log_interval: float = None
+    log_level: str = None
+    log_format: str = None
+    log_background: bool = None
+    log_queue_size: int = None
+    log_rate_limits: Dict[str, float] = None
+    log_sampling: Dict[str, float] = None
 
-    def __init__(self):
+    def __init__(self, path: str = "config.yml"):
+        """
+        Keyword Arguments:
+            path {str} -- the YAML file to read settings from
+                (default: {"config.yml"})
+        """
         try:
-            with open("config.yml", "r") as file:
+            with open(path, "r") as file:
                 config = yaml.safe_load(file)
                 required_settings = [
                     "username",
@@ -28,6 +82,116 @@ class SessionConfig:
 
                     self.__setattr__(name, config[name])
 
+                optional_settings = {
+                    # Fewest seconds between two writes of next_batch_file
+                    "next_batch_interval": 5,
+                    # Where the login is kept to resume it on the next start;
+                    # empty to log in with the password every time
+                    "session_file": "session.json",
+                    # Where room state is kept between runs
+                    "state_store_file": "state.db",
+                    # Where the IDs of handled messages are kept, so none is
+                    # handled twice; empty to only remember them in memory
+                    "seen_events_file": "seen_events",
+                    # Most message IDs remembered
+                    "seen_events_size": 10000,
+                    # Where plugins' persisted caches are saved
+                    "cache_dir": "cache",
+                    # Seconds to batch read markers for; 0 sends once per sync
+                    "read_marker_debounce": 2,
+                    # Only sync the events the session and its plugins use
+                    "sync_filter": True,
+                    # With sync_filter, only sync the room members who sent
+                    # the messages in each sync, unless a plugin needs all
+                    "lazy_load_members": True,
+                    # Rooms joined at once when invited to several together
+                    "join_concurrency": 4,
+                    # Messages sent per second, across all rooms
+                    "send_rate": 5,
+                    # Messages that may be sent at once before send_rate applies
+                    "send_burst": 10,
+                    # Most messages waiting to be sent to one room
+                    "send_queue_size": 100,
+                    # What to do when a room's queue is full: block,
+                    # drop_oldest or drop_newest
+                    "send_overflow": "block",
+                    # Times a failed message is retried before giving up
+                    "send_retries": 3,
+                    # Seconds during which text sent to one room is merged
+                    # into a single message; 0 to disable
+                    "coalesce_window": 0,
+                    # Most open connections from plugins to any one host
+                    "http_connections_per_host": 8,
+                    # Seconds a plugin's HTTP request may take
+                    "http_timeout": 10,
+                    # Import plugins only once one of their triggers fires
+                    "lazy_plugins": False,
+                    # Reload changed plugin files without restarting
+                    "hot_reload": False,
+                    # Seconds between checks of the plugin files
+                    "hot_reload_interval": 2,
+                    # Rooms whose messages are processed at the same time
+                    "ingest_workers": 8,
+                    # Messages waiting to be processed before syncing pauses
+                    "ingest_queue_size": 1000,
+                    # Most plugin calls allowed to run at the same time
+                    "plugin_concurrency": 8,
+                    # Seconds before a plugin call is cancelled; 0 to disable
+                    "plugin_timeout": 30,
+                    # Commands per second one sender may issue, with bursts of
+                    # up to user_command_burst; 0 for no limit
+                    "user_command_rate": 0.5,
+                    "user_command_burst": 5,
+                    # Commands per second from one room, across its members
+                    "room_command_rate": 2,
+                    "room_command_burst": 10,
+                    # Calls per second to any one plugin, across all rooms
+                    "plugin_command_rate": 10,
+                    "plugin_command_burst": 20,
+                    # Seconds during which the same command from a user in a
+                    # room runs only once; 0 to disable
+                    "duplicate_command_window": 5,
+                    # Most calls to expensive plugins running at once; 0 for
+                    # no limit
+                    "max_expensive_commands": 4,
+                    # What to do with commands sent while the bot was down:
+                    # all, skip, latest (per room) or throttle
+                    "catch_up_policy": "latest",
+                    # Seconds after which a command counts as sent while down
+                    "catch_up_age": 120,
+                    # Old commands run per second with the throttle policy
+                    "catch_up_rate": 1,
+                    # Threads for plugins' blocking I/O
+                    "blocking_threads": 8,
+                    # Worker processes for CPU-bound plugins; 0 uses threads
+                    "blocking_processes": 0,
+                    # Seconds the event loop may be held before it's logged;
+                    # 0 to disable
+                    "loop_stall_threshold": 0.25,
+                    # Record metrics about syncs, plugins and sending
+                    "metrics": False,
+                    # Port serving metrics at /metrics on localhost; 0 to
+                    # disable
+                    "metrics_port": 0,
+                    # Seconds between metric snapshots in the log; 0 to disable
+                    "metrics_log_interval": 60,
+                    # The lowest level of log records written
+                    "log_level": "INFO",
+                    # "text", or "json" for one JSON object per record
+                    "log_format": "text",
+                    # Write log records on a background thread
+                    "log_background": True,
+                    # Log records waiting to be written before new ones are
+                    # dropped
+                    "log_queue_size": 10000,
+                    # Log records kept per second, by logger name or prefix
+                    "log_rate_limits": {},
+                    # Fraction of log records kept, by logger name or prefix
+                    "log_sampling": {},
+                }
+                for name, default in optional_settings.items():
+                    self.__setattr__(name, config.get(name, default))
+
                 if "matrix_url" not in config:
                     matrix_url = "matrix." + config["base_url"]
                 else:
@@ -39,7 +203,7 @@ class SessionConfig:
                 self.next_batch_file = config["next_batch_file"]
         except FileNotFoundError:
             print(
-                "You must create a `config.yml` file. You can use the included template as a starting palce.",
+                f"You must create a `{path}` file. You can use the included template as a starting palce.",
                 file=sys.stderr,
             )
             sys.exit(1)
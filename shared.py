@@ -0,0 +1,64 @@
+from types import ModuleType
+from typing import Dict, Optional, Tuple
+
+import executor
+from cache import AsyncCache
+from http_client import HttpClient
+from session_config import SessionConfig
+
+
+class SharedResources:
+    """What the sessions running in one process share.
+
+    Plugin modules are imported once and reused by every session's loader,
+    plugins share one set of caches and one pooled HTTP client, and blocking
+    work runs on one set of pools. Each session keeps its own client, sync
+    state, plugin instances and metrics.
+    """
+
+    caches: Dict[str, AsyncCache] = None
+    http: HttpClient = None
+    modules: Dict[str, Tuple[Optional[Tuple[int, int]], ModuleType]] = None
+
+    def __init__(
+        self,
+        http_connections_per_host: int = 8,
+        http_timeout: float = 10,
+        blocking_threads: int = 8,
+        blocking_processes: int = 0,
+    ):
+        """
+        Keyword Arguments:
+            http_connections_per_host {int} -- the most open connections to
+                one host (default: {8})
+            http_timeout {float} -- seconds an HTTP request may take (default: {10})
+            blocking_threads {int} -- threads for blocking plugin work
+                (default: {8})
+            blocking_processes {int} -- processes for CPU-bound plugin work
+                (default: {0})
+        """
+        self.caches = {}
+        self.http = HttpClient(
+            limit_per_host=http_connections_per_host, timeout=http_timeout
+        )
+        self.modules = {}
+        executor.configure(blocking_threads, blocking_processes)
+
+    @classmethod
+    def from_config(cls, config: SessionConfig) -> "SharedResources":
+        """Returns resources sized by a session's settings.
+        """
+        return cls(
+            http_connections_per_host=config.http_connections_per_host,
+            http_timeout=config.http_timeout,
+            blocking_threads=config.blocking_threads,
+            blocking_processes=config.blocking_processes,
+        )
+
+    async def close(self) -> None:
+        """Saves persisted caches and stops the HTTP client and pools.
+        """
+        for cache in self.caches.values():
+            await cache.save()
+        await self.http.close()
+        executor.shutdown()
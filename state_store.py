@@ -0,0 +1,203 @@
+import sqlite3
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from logbook import Logger
+from nio import AsyncClient, MatrixRoom, Receipt
+
+from log import logger_group
+
+STATE_LOG = Logger("olive.state_store")
+logger_group.add_logger(STATE_LOG)
+
+# Bump whenever the tables change; older stores are then ignored and rebuilt.
+SCHEMA_VERSION = "1"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS rooms (
+    room_id TEXT PRIMARY KEY,
+    name TEXT,
+    canonical_alias TEXT,
+    topic TEXT,
+    encrypted INTEGER
+);
+CREATE TABLE IF NOT EXISTS members (
+    room_id TEXT,
+    user_id TEXT,
+    display_name TEXT,
+    avatar_url TEXT,
+    invited INTEGER,
+    PRIMARY KEY (room_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS receipts (
+    room_id TEXT,
+    user_id TEXT,
+    event_id TEXT,
+    timestamp INTEGER,
+    PRIMARY KEY (room_id, user_id)
+);
+"""
+TABLES = ("rooms", "members", "receipts")
+
+RoomRow = Tuple[str, Optional[str], Optional[str], Optional[str], int]
+MemberRow = Tuple[str, str, Optional[str], Optional[str], int]
+ReceiptRow = Tuple[str, str, str, int]
+
+
+class RoomStateStore:
+    """Keeps room state on disk so a session can resume without a full sync.
+
+    The store holds each joined room's name, members and read receipts, along
+    with the sync token they're current as of. Only rooms that changed since
+    the last save are rewritten. A store is only trusted when its token
+    matches the one the session resumes from; otherwise the session falls
+    back to a full state sync and the store is rebuilt from it.
+    """
+
+    path: str = None
+    # Rooms changed, or left, since the last save
+    dirty: Set[str] = None
+    left: Set[str] = None
+
+    def __init__(self, path: str):
+        """
+        Arguments:
+            path {str} -- the SQLite database to keep the state in
+        """
+        self.path = path
+        self.dirty = set()
+        self.left = set()
+        self.__rebuild = False
+        # Saves run on the blocking pool, one at a time, so the connection
+        # is shared across threads.
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript(SCHEMA)
+
+    def load(self, client: AsyncClient, next_batch: str) -> bool:
+        """Restores the client's rooms if the store is current as of
+        `next_batch`; returns whether it did.
+        """
+        try:
+            meta = dict(self.__db.execute("SELECT key, value FROM meta"))
+            if (
+                meta.get("schema_version") != SCHEMA_VERSION
+                or meta.get("user_id") != client.user_id
+                or meta.get("next_batch") != next_batch
+            ):
+                return False
+
+            rooms: Dict[str, MatrixRoom] = {}
+            for room_id, name, alias, topic, encrypted in self.__db.execute(
+                "SELECT * FROM rooms"
+            ):
+                room = MatrixRoom(room_id, client.user_id, bool(encrypted))
+                room.name, room.canonical_alias, room.topic = name, alias, topic
+                rooms[room_id] = room
+
+            for room_id, user_id, name, avatar_url, invited in self.__db.execute(
+                "SELECT * FROM members"
+            ):
+                rooms[room_id].add_member(user_id, name, avatar_url, bool(invited))
+
+            for room_id, user_id, event_id, timestamp in self.__db.execute(
+                "SELECT * FROM receipts"
+            ):
+                rooms[room_id].read_receipts[user_id] = Receipt(
+                    event_id, "m.read", user_id, timestamp
+                )
+        except (sqlite3.Error, KeyError, ValueError) as err:
+            STATE_LOG.warning(f"Ignoring unreadable state store {self.path}: {err}")
+            return False
+
+        client.rooms.update(rooms)
+        STATE_LOG.info(f"Restored {len(rooms)} room(s) from {self.path}")
+        return True
+
+    def rebuild(self, room_ids: Iterable[str]) -> None:
+        """Replaces everything in the store with the given rooms on next save.
+        """
+        self.__rebuild = True
+        self.dirty = set(room_ids)
+        self.left = set()
+
+    def mark_dirty(self, joined: Iterable[str], left: Iterable[str] = ()) -> None:
+        """Notes rooms whose state changed, or that were left, in a sync.
+        """
+        self.dirty.update(joined)
+        self.left.update(left)
+        self.dirty.difference_update(self.left)
+
+    def prepare(self, client: AsyncClient, next_batch: str) -> Callable[[], None]:
+        """Snapshots the changed rooms and returns a function saving them.
+
+        Call this on the event loop, so the rooms can't change while they're
+        copied; the returned function does the writing on any thread.
+        """
+        dirty, left, rebuild = self.dirty, self.left, self.__rebuild
+        self.dirty, self.left, self.__rebuild = set(), set(), False
+        if rebuild:
+            dirty = set(client.rooms)
+
+        room_rows: List[RoomRow] = []
+        member_rows: List[MemberRow] = []
+        receipt_rows: List[ReceiptRow] = []
+        for room_id in dirty:
+            room = client.rooms.get(room_id)
+            if room is None:
+                left.add(room_id)
+                continue
+
+            room_rows.append(
+                (room_id, room.name, room.canonical_alias, room.topic, room.encrypted)
+            )
+            member_rows.extend(
+                (room_id, user_id, user.display_name, user.avatar_url, user.invited)
+                for user_id, user in room.users.items()
+            )
+            receipt_rows.extend(
+                (room_id, user_id, receipt.event_id, receipt.timestamp)
+                for user_id, receipt in room.read_receipts.items()
+            )
+
+        meta_rows = [
+            ("schema_version", SCHEMA_VERSION),
+            ("user_id", client.user_id),
+            ("next_batch", next_batch),
+        ]
+        removed = [(room_id,) for room_id in dirty | left]
+
+        def save() -> None:
+            try:
+                write()
+            except Exception:
+                # The changes taken out of `dirty` weren't saved, and later
+                # saves would move the token on without them; start over
+                self.__rebuild = True
+                raise
+
+        def write() -> None:
+            with self.__db:
+                for table in TABLES:
+                    if rebuild:
+                        self.__db.execute(f"DELETE FROM {table}")
+                    else:
+                        self.__db.executemany(
+                            f"DELETE FROM {table} WHERE room_id = ?", removed
+                        )
+                self.__db.executemany(
+                    "INSERT INTO rooms VALUES (?, ?, ?, ?, ?)", room_rows
+                )
+                self.__db.executemany(
+                    "INSERT INTO members VALUES (?, ?, ?, ?, ?)", member_rows
+                )
+                self.__db.executemany(
+                    "INSERT INTO receipts VALUES (?, ?, ?, ?)", receipt_rows
+                )
+                self.__db.executemany(
+                    "INSERT OR REPLACE INTO meta VALUES (?, ?)", meta_rows
+                )
+
+        return save
+
+    def close(self) -> None:
+        self.__db.close()
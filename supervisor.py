@@ -0,0 +1,139 @@
+"""Runs several bot accounts, each from its own config file, in one process.
+
+    python supervisor.py alice.yml bob.yml carol.yml
+    python supervisor.py *.yml --processes 2
+
+With `--processes`, the accounts are split evenly across that many worker
+processes, each running its share of sessions on one event loop.
+"""
+import sys
+import asyncio
+import argparse
+from multiprocessing import Process
+from typing import List
+
+from logbook import Logger
+
+from chat import Session, configure_logging
+from log import logger_group
+from session_config import SessionConfig
+from shared import SharedResources
+
+SUPERVISOR_LOG = Logger("olive.supervisor")
+logger_group.add_logger(SUPERVISOR_LOG)
+
+# Settings naming files a session writes to; no two sessions may share one
+PER_SESSION_FILES = (
+    "next_batch_file",
+    "state_store_file",
+    "session_file",
+    "seen_events_file",
+)
+
+
+class Supervisor:
+    """Runs a Session for each of several configs on one event loop.
+
+    The sessions share plugin modules, caches, the HTTP client and the
+    blocking pools, sized by the first config. Each keeps its own login, sync
+    token, room state and metrics, so every config must name its own files.
+    """
+
+    configs: List[SessionConfig] = None
+    shared: SharedResources = None
+    sessions: List[Session] = None
+
+    def __init__(self, configs: List[SessionConfig]):
+        """
+        Arguments:
+            configs {List[SessionConfig]} -- the settings of each account
+
+        Raises:
+            ValueError -- if two configs name the same file for their state
+        """
+        if not configs:
+            raise ValueError("No configs to run")
+        for setting in PER_SESSION_FILES:
+            paths = [getattr(config, setting) for config in configs]
+            paths = [path for path in paths if path]
+            if len(paths) != len(set(paths)):
+                raise ValueError(f"Each config needs its own {setting}")
+
+        self.configs = configs
+        self.shared = SharedResources.from_config(configs[0])
+        self.sessions = [Session(config, shared=self.shared) for config in configs]
+
+    async def start(self) -> None:
+        """Starts every session, and runs until they've all stopped.
+
+        A session that fails doesn't stop the others.
+        """
+        results = await asyncio.gather(
+            *(session.start() for session in self.sessions), return_exceptions=True
+        )
+        for session, result in zip(self.sessions, results):
+            if isinstance(result, BaseException):
+                SUPERVISOR_LOG.error(
+                    f"Session {session.config.matrix_id} stopped: {result!r}"
+                )
+
+    async def close(self) -> None:
+        """Closes every session, then the resources they share.
+        """
+        await asyncio.gather(*(session.close() for session in self.sessions))
+        await self.shared.close()
+
+
+def run(config_paths: List[str]) -> None:
+    """Runs the accounts configured in `config_paths` until interrupted.
+    """
+    configs = [SessionConfig(path) for path in config_paths]
+    configure_logging(configs[0])
+
+    try:
+        supervisor = Supervisor(configs)
+    except ValueError as err:
+        SUPERVISOR_LOG.error(str(err))
+        sys.exit(1)
+
+    loop = asyncio.get_event_loop()
+    try:
+        SUPERVISOR_LOG.info(f"Starting {len(configs)} session(s)")
+        loop.run_until_complete(supervisor.start())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(supervisor.close())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("configs", nargs="+", help="a config file per account")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="worker processes to split the accounts across (default: 1)",
+    )
+    options = parser.parse_args()
+
+    processes = max(1, min(options.processes, len(options.configs)))
+    if processes == 1:
+        run(options.configs)
+        return
+
+    shards = [options.configs[index::processes] for index in range(processes)]
+    workers = [Process(target=run, args=(shard,)) for shard in shards]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # The workers got the interrupt too and are closing their sessions.
+        for worker in workers:
+            worker.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+from typing import Any, Dict, Iterable, Optional, Set
+
+from nio import (
+    AsyncClient,
+    InviteEvent,
+    MegolmEvent,
+    PowerLevelsEvent,
+    ReactionEvent,
+    ReceiptEvent,
+    RedactionEvent,
+    RoomAliasEvent,
+    RoomCreateEvent,
+    RoomEncryptionEvent,
+    RoomMemberEvent,
+    RoomMessage,
+    RoomNameEvent,
+    RoomTopicEvent,
+    StickerEvent,
+    TypingNoticeEvent,
+)
+
+from plugin import BasePlugin
+
+# The Matrix event types behind nio's event classes. A callback registered for
+# a class not listed here, or for one of its bases like Event, is taken to
+# want everything.
+TIMELINE_TYPES = {
+    RoomMessage: "m.room.message",
+    MegolmEvent: "m.room.encrypted",
+    RedactionEvent: "m.room.redaction",
+    ReactionEvent: "m.reaction",
+    StickerEvent: "m.sticker",
+}
+STATE_TYPES = {
+    RoomCreateEvent: "m.room.create",
+    RoomNameEvent: "m.room.name",
+    RoomAliasEvent: "m.room.canonical_alias",
+    RoomTopicEvent: "m.room.topic",
+    RoomEncryptionEvent: "m.room.encryption",
+    RoomMemberEvent: "m.room.member",
+    PowerLevelsEvent: "m.room.power_levels",
+}
+EPHEMERAL_TYPES = {ReceiptEvent: "m.receipt", TypingNoticeEvent: "m.typing"}
+
+# The room state the session keeps for itself: what a MatrixRoom tracks for
+# names and members, and what the state store saves
+CORE_STATE_TYPES = list(STATE_TYPES.values())
+# Read receipts update MatrixRoom.read_receipts, which the state store saves
+CORE_EPHEMERAL_TYPES = ["m.receipt"]
+
+NOTHING = {"not_types": ["*"]}
+
+
+def event_types(
+    callbacks: Iterable[Any], types: Dict[type, str]
+) -> Optional[Set[str]]:
+    """Returns the event types, out of `types`, that any of the callbacks want.
+
+    Returns None if some callback wants events that `types` can't name, so
+    nothing should be filtered out.
+    """
+    wanted: Set[str] = set()
+    for callback in callbacks:
+        classes = callback.filter
+        if classes is None:
+            return None
+        for cls in classes if isinstance(classes, tuple) else (classes,):
+            if issubclass(cls, InviteEvent):
+                # Invites arrive with the invited room, whatever the filter
+                continue
+            for known in cls.__mro__:
+                if known in types:
+                    wanted.add(types[known])
+                    break
+            else:
+                return None
+    return wanted
+
+
+def build_sync_filter(
+    client: AsyncClient,
+    plugins: Iterable[BasePlugin] = (),
+    lazy_load_members: bool = True,
+) -> Dict[str, Any]:
+    """Returns a sync filter asking only for the events the session uses.
+
+    Timeline events are limited to those the client has callbacks for, plus
+    state changes to the room state the session and its plugins keep. Presence,
+    account data and ephemeral events other than read receipts are dropped
+    unless a callback wants them. With `lazy_load_members`, member events are only sent for the
+    senders of the timeline events in each sync, unless a plugin needs every
+    member of a room.
+
+    Arguments:
+        client {AsyncClient} -- the client whose callbacks decide what's kept
+
+    Keyword Arguments:
+        plugins {Iterable[BasePlugin]} -- plugins whose `state_types` and
+            `needs_all_members` are also honoured (default: {()})
+        lazy_load_members {bool} -- only send the members that are needed
+            (default: {True})
+    """
+    plugins = list(plugins)
+    state = set(CORE_STATE_TYPES)
+    for plugin in plugins:
+        state.update(plugin.state_types)
+    lazy_load_members = lazy_load_members and not any(
+        plugin.needs_all_members for plugin in plugins
+    )
+
+    room: Dict[str, Any] = {
+        "state": {"types": sorted(state), "lazy_load_members": lazy_load_members},
+        "timeline": {},
+        "ephemeral": {},
+        "account_data": {} if client.room_account_data_callbacks else NOTHING,
+    }
+    timeline = event_types(client.event_callbacks, {**TIMELINE_TYPES, **STATE_TYPES})
+    if timeline is not None:
+        # State changes show up in the timeline; keep them to keep state current
+        room["timeline"] = {"types": sorted(timeline | state)}
+    ephemeral = event_types(client.ephemeral_callbacks, EPHEMERAL_TYPES)
+    if ephemeral is not None:
+        room["ephemeral"] = {"types": sorted(ephemeral.union(CORE_EPHEMERAL_TYPES))}
+
+    return {
+        "room": room,
+        "presence": {} if client.presence_callbacks else NOTHING,
+        "account_data": {} if client.global_account_data_callbacks else NOTHING,
+    }
@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+
+from admission import Admission
+from parsing import ParsedCommand
+from plugin import BasePlugin
+
+
+class Cheap(BasePlugin):
+    async def process_event(self, room, event, messenger) -> None:
+        pass
+
+
+class Costly(Cheap):
+    expensive = True
+
+
+class TestAdmission(unittest.IsolatedAsyncioTestCase):
+    def admit(self, admission, body="ping example.com", room="!a", sender="@u"):
+        calls = [("Cheap", Cheap()), ("Costly", Costly())]
+        admitted = admission.admit(room, sender, ParsedCommand(body), calls)
+        return [name for name, _ in admitted]
+
+    def test_limits_senders_and_rooms(self):
+        admission = Admission(
+            user_rate=0.01, user_burst=2, room_rate=0.01, room_burst=3
+        )
+        self.assertEqual(self.admit(admission, "a"), ["Cheap", "Costly"])
+        self.assertEqual(self.admit(admission, "b"), ["Cheap", "Costly"])
+        # The sender is out of tokens, but others in the room aren't
+        self.assertEqual(self.admit(admission, "c"), [])
+        self.assertEqual(self.admit(admission, "c", sender="@v"), ["Cheap", "Costly"])
+        # Now the room is out of tokens too
+        self.assertEqual(self.admit(admission, "d", sender="@w"), [])
+        self.assertEqual(
+            self.admit(admission, "d", room="!b", sender="@w"), ["Cheap", "Costly"]
+        )
+
+    def test_limits_plugins(self):
+        admission = Admission(plugin_rate=0.01, plugin_burst=1)
+        self.assertEqual(self.admit(admission, "a"), ["Cheap", "Costly"])
+        self.assertEqual(self.admit(admission, "b", room="!b"), [])
+
+    def test_collapses_duplicates(self):
+        admission = Admission(duplicate_window=60)
+        self.assertEqual(self.admit(admission), ["Cheap", "Costly"])
+        self.assertEqual(self.admit(admission), [])
+        self.assertEqual(self.admit(admission, room="!b"), ["Cheap", "Costly"])
+        self.assertEqual(self.admit(admission, "ping other.org"), ["Cheap", "Costly"])
+
+    def test_runs_the_same_command_from_each_sender(self):
+        admission = Admission(duplicate_window=60)
+        self.assertEqual(self.admit(admission, sender="@u"), ["Cheap", "Costly"])
+        # Another user asking the same thing gets their own answer
+        self.assertEqual(self.admit(admission, sender="@v"), ["Cheap", "Costly"])
+        self.assertEqual(self.admit(admission, sender="@v"), [])
+
+    async def test_caps_expensive_calls(self):
+        admission = Admission(max_expensive=1)
+        self.assertEqual(self.admit(admission), ["Cheap", "Costly"])
+        self.assertEqual(self.admit(admission), ["Cheap"])
+
+        task = asyncio.ensure_future(asyncio.sleep(0))
+        admission.track(task)
+        await task
+        await asyncio.sleep(0)
+        self.assertEqual(admission.expensive_in_flight, 0)
+        self.assertEqual(self.admit(admission), ["Cheap", "Costly"])
+
+
+if __name__ == "__main__":
+    unittest.main()
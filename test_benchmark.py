@@ -0,0 +1,58 @@
+import os
+import unittest
+from argparse import Namespace
+from tempfile import TemporaryDirectory
+
+from logbook import NullHandler
+
+import benchmark
+
+
+class TestBenchmark(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.working_directory = os.getcwd()
+        os.chdir(self.directory.name)
+        self.handler = NullHandler()
+        self.handler.push_application()
+
+    def tearDown(self):
+        self.handler.pop_application()
+        os.chdir(self.working_directory)
+        self.directory.cleanup()
+
+    async def test_replies_to_every_command(self):
+        options = Namespace(
+            replay=None,
+            messages=200,
+            rooms=4,
+            batch=20,
+            rate=0,
+            mix=benchmark.parse_mix("echo=1,roll=1,chatter=2"),
+            commands=5,
+            lazy_plugins=False,
+            load_repeats=1,
+            seed=1,
+        )
+        results = await benchmark.run(options)
+
+        self.assertEqual(results["messages"], 200)
+        # Every echo and roll is answered; chatter never is
+        self.assertGreater(results["replies"], 50)
+        self.assertLess(results["replies"], 150)
+        self.assertGreater(results["messages_per_second"], 0)
+        self.assertGreaterEqual(results["reply_p99_ms"], results["reply_p50_ms"])
+
+    def test_compare_flags_regressions(self):
+        previous = {
+            "date": "2020-01-01T00:00:00",
+            "results": {"messages_per_second": 1000, "reply_p99_ms": 10},
+        }
+        regressions = benchmark.compare(
+            {"messages_per_second": 800, "reply_p99_ms": 10.5}, previous, 10
+        )
+        self.assertEqual([name for name, _ in regressions], ["messages_per_second"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import asyncio
+import unittest
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from cache import AsyncCache
+
+
+class TestAsyncCache(unittest.IsolatedAsyncioTestCase):
+    def test_evicts_least_recently_used(self):
+        cache = AsyncCache(ttl=60, max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(list(cache.entries), ["a", "c"])
+
+    def test_expires_entries(self):
+        cache = AsyncCache(ttl=60, max_size=2)
+        with mock.patch("cache.time", return_value=0):
+            cache.set("a", 1)
+        with mock.patch("cache.time", return_value=61):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    async def test_single_flight(self):
+        cache = AsyncCache(ttl=60, max_size=2)
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "value"
+
+        results = await asyncio.gather(
+            *(cache.get_or_fetch("key", fetch) for _ in range(5))
+        )
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(await cache.get_or_fetch("key", fetch), "value")
+        self.assertEqual(calls, 1)
+        self.assertEqual((cache.misses, cache.shared, cache.hits), (1, 4, 1))
+
+    async def test_failed_fetch_is_not_cached(self):
+        cache = AsyncCache(ttl=60, max_size=2)
+
+        async def fetch():
+            raise ValueError("down")
+
+        with self.assertRaises(ValueError):
+            await cache.get_or_fetch("key", fetch)
+        self.assertEqual(len(cache), 0)
+
+    async def test_persists(self):
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, "test.json")
+            cache = AsyncCache(ttl=60, max_size=2, path=path)
+            cache.set("a", [1, 2])
+            await cache.save()
+
+            self.assertEqual(AsyncCache(ttl=60, max_size=2, path=path).get("a"), [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import asyncio
+import unittest
+from time import time
+
+from nio import MatrixRoom, RoomMessageText
+
+from catch_up import CatchUp
+
+
+def message(room_id: str, age: float, body: str = "ping example.com"):
+    event = RoomMessageText.from_dict(
+        {
+            "event_id": f"${body}{age}",
+            "sender": "@user:example.org",
+            "origin_server_ts": int((time() - age) * 1000),
+            "type": "m.room.message",
+            "content": {"msgtype": "m.text", "body": body},
+        }
+    )
+    return MatrixRoom(room_id, "@olive:example.org"), event
+
+
+class TestCatchUp(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.ran = []
+        self.dropped = []
+
+    def defer(self, catch_up: CatchUp, room_id: str, age: float) -> bool:
+        room, event = message(room_id, age)
+        return catch_up.defer(
+            room,
+            event,
+            lambda: self.ran.append((room_id, age)),
+            lambda: self.dropped.append((room_id, age)),
+        )
+
+    def test_runs_new_commands(self):
+        catch_up = CatchUp("skip", max_age=60)
+        self.assertFalse(self.defer(catch_up, "!a", 1))
+        self.assertTrue(self.defer(catch_up, "!a", 3600))
+        catch_up.end_of_batch()
+        self.assertEqual(self.ran, [])
+
+    def test_all_runs_everything(self):
+        self.assertFalse(self.defer(CatchUp("all", max_age=60), "!a", 3600))
+
+    def test_latest_per_room(self):
+        catch_up = CatchUp("latest", max_age=60)
+        for room_id, age in (("!a", 300), ("!a", 200), ("!b", 400), ("!c", 100)):
+            self.assertTrue(self.defer(catch_up, room_id, age))
+        # A new command in !c makes its backlog moot
+        self.assertFalse(self.defer(catch_up, "!c", 1))
+
+        catch_up.end_of_batch()
+        self.assertEqual(sorted(self.ran), [("!a", 200), ("!b", 400)])
+
+    async def test_throttle(self):
+        catch_up = CatchUp("throttle", max_age=60, rate=1000, max_queued=3)
+        for age in (500, 400, 300, 200):
+            self.assertTrue(self.defer(catch_up, "!a", age))
+
+        for _ in range(20):
+            await asyncio.sleep(0.001)
+        await catch_up.close()
+        # The oldest was dropped to keep to three waiting
+        self.assertEqual(self.ran, [("!a", 400), ("!a", 300), ("!a", 200)])
+
+    def test_reports_dropped_commands(self):
+        catch_up = CatchUp("latest", max_age=60)
+        for room_id, age in (("!a", 300), ("!a", 200), ("!b", 100)):
+            self.defer(catch_up, room_id, age)
+        self.defer(catch_up, "!b", 1)
+        # The older command in !a, and !b's backlog once a new command came
+        self.assertEqual(self.dropped, [("!a", 300), ("!b", 100)])
+
+    def test_rejects_unknown_policies(self):
+        with self.assertRaises(ValueError):
+            CatchUp("newest")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,373 @@
+import os
+import sys
+import json
+import asyncio
+import unittest
+from time import time
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import yaml
+from logbook import Logger, NullHandler
+from nio import (
+    AsyncClient,
+    DevicesResponse,
+    LoginResponse,
+    MatrixRoom,
+    RoomMessageText,
+    RoomReadMarkersResponse,
+    SyncError,
+    SyncResponse,
+    UploadFilterResponse,
+)
+from nio.responses import Device
+
+from chat import Session
+from checkpoint import Checkpointer
+from dispatch import PluginDispatcher
+from parsing import ParsedCommand
+from plugin import PluginConfig, TextCommand
+from plugin_loader import PluginLoader
+from session_config import SessionConfig
+from test_support import load_no_plugins
+
+GREET_SOURCE = """
+from plugin import BasePlugin
+
+
+class Greet(BasePlugin):
+    trigger = ["hello"]
+    version = VERSION
+
+    async def process_event(self, room, event, messenger) -> None:
+        pass
+"""
+
+HOMESERVER = "https://matrix.example.org"
+BOT_ID = "@olive:example.org"
+EMPTY_SYNC = {"next_batch": "s1", "rooms": {"join": {}, "invite": {}, "leave": {}}}
+
+
+class FakeClient(AsyncClient):
+    """Answers logins, syncs and device requests without a homeserver.
+
+    Syncs are answered from `syncs` in turn, and the sync loop stops once
+    they run out.
+    """
+
+    def __init__(self, syncs=()):
+        super().__init__(HOMESERVER, BOT_ID)
+        self.syncs = list(syncs) or [EMPTY_SYNC]
+        self.logins = 0
+        self.deleted = None
+
+    async def login(self, password=None, device_name="", token=None):
+        self.logins += 1
+        self.restore_login(BOT_ID, "NEW", "new-token")
+        return LoginResponse(BOT_ID, "NEW", "new-token")
+
+    async def sync(self, *args, **kwargs):
+        response = self.syncs.pop(0)
+        if not self.syncs:
+            self.syncs.append(EMPTY_SYNC)
+            self.stop_sync_forever()
+        if isinstance(response, SyncError):
+            return response
+        response = SyncResponse.from_dict(response)
+        await self.receive_response(response)
+        return response
+
+    async def upload_filter(self, **kwargs):
+        return UploadFilterResponse("filter")
+
+    async def devices(self):
+        return DevicesResponse(
+            [
+                Device(device_id, "olive", "127.0.0.1", None)
+                for device_id in ("OLD", self.device_id)
+            ]
+        )
+
+    async def delete_devices(self, devices, auth=None):
+        self.deleted = devices
+
+    async def room_read_markers(self, room_id, *args, **kwargs):
+        return RoomReadMarkersResponse(room_id)
+
+
+class ReplayingClient(FakeClient):
+    """Answers each sync with the one after the client's sync token, as a
+    homeserver would, so a restarted session is sent what it hadn't saved.
+    """
+
+    async def sync(self, *args, **kwargs):
+        tokens = [sync["next_batch"] for sync in self.syncs]
+        position = tokens.index(self.next_batch) + 1 if self.next_batch else 0
+        if position >= len(tokens) - 1:
+            self.stop_sync_forever()
+        response = SyncResponse.from_dict(self.syncs[min(position, len(tokens) - 1)])
+        await self.receive_response(response)
+        return response
+
+
+def sync(token: str, *events: dict) -> dict:
+    return {
+        "next_batch": token,
+        "rooms": {
+            "join": {"!room:example.org": {"timeline": {"events": list(events)}}},
+            "invite": {},
+            "leave": {},
+        },
+    }
+
+
+def event(event_type: str, content: dict, **extra) -> dict:
+    return {
+        "event_id": f"${event_type}{len(extra)}",
+        "sender": "@phil:example.org",
+        "origin_server_ts": int(time() * 1000),
+        "type": event_type,
+        "content": content,
+        **extra,
+    }
+
+
+class Remember(TextCommand):
+    trigger = ["remember"]
+
+    def __init__(self, release: asyncio.Event = None):
+        super().__init__()
+        self.release = release
+        self.started = asyncio.Event()
+        self.handled = []
+
+    async def process_event(self, room, event, messenger, tokens):
+        self.started.set()
+        if self.release is not None:
+            await self.release.wait()
+        self.handled.append(event.event_id)
+
+
+class TestSession(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.handler = NullHandler()
+        self.handler.push_application()
+        self.load_plugins = patch.object(Session, "load_plugins", load_no_plugins)
+        self.load_plugins.start()
+        self.session_file = os.path.join(self.directory.name, "session.json")
+
+    def tearDown(self):
+        self.load_plugins.stop()
+        self.handler.pop_application()
+        self.directory.cleanup()
+
+    def config(self, **settings) -> SessionConfig:
+        directory = self.directory.name
+        settings = {
+            "username": "olive",
+            "password": "secret",
+            "base_url": "example.org",
+            "next_batch_file": os.path.join(directory, "next_batch"),
+            "state_store_file": os.path.join(directory, "state"),
+            "session_file": self.session_file,
+            "seen_events_file": os.path.join(directory, "seen"),
+            "loop_stall_threshold": 0,
+            **settings,
+        }
+        path = os.path.join(directory, "config.yml")
+        with open(path, "w") as config_file:
+            yaml.safe_dump(settings, config_file)
+        return SessionConfig(path)
+
+    def save_login(self, **saved) -> None:
+        saved = {
+            "homeserver": HOMESERVER,
+            "user_id": BOT_ID,
+            "device_id": "SAVED",
+            "access_token": "saved-token",
+            **saved,
+        }
+        # Keys given as None are left out
+        saved = {key: value for key, value in saved.items() if value is not None}
+        with open(self.session_file, "w") as session_file:
+            json.dump(saved, session_file)
+
+    async def start(self, client: FakeClient, **options) -> None:
+        session = Session(self.config(), client=client)
+        await session.start(**options)
+        await session.close()
+
+    async def test_resumes_the_saved_login(self):
+        self.save_login()
+        client = FakeClient()
+        await self.start(client)
+
+        self.assertEqual(client.logins, 0)
+        self.assertEqual(client.device_id, "SAVED")
+        self.assertEqual(client.access_token, "saved-token")
+        # Devices are only pruned when asked
+        self.assertIsNone(client.deleted)
+
+    async def test_logs_in_again_when_the_token_is_revoked(self):
+        self.save_login()
+        client = FakeClient([SyncError("Unknown token", "M_UNKNOWN_TOKEN"), EMPTY_SYNC])
+        await self.start(client)
+
+        self.assertEqual(client.logins, 1)
+        with open(self.session_file) as session_file:
+            self.assertEqual(json.load(session_file)["access_token"], "new-token")
+
+    async def test_logs_in_with_an_incomplete_session_file(self):
+        self.save_login(access_token=None)
+        client = FakeClient()
+        await self.start(client)
+
+        self.assertEqual(client.logins, 1)
+        self.assertEqual(client.device_id, "NEW")
+
+    async def test_prunes_devices_on_request(self):
+        client = FakeClient()
+        await self.start(client, prune_devices=True)
+
+        self.assertEqual(client.logins, 1)
+        self.assertEqual(client.deleted, ["OLD"])
+
+    async def test_redelivers_queued_commands_after_a_crash(self):
+        syncs = [
+            sync(
+                "s1",
+                event("m.room.create", {"creator": BOT_ID}, state_key=""),
+                event("m.room.member", {"membership": "join"}, state_key=BOT_ID),
+            ),
+            sync("s2"),
+            sync(
+                "s3",
+                event("m.room.message", {"msgtype": "m.text", "body": "remember"}),
+            ),
+            sync("s4"),
+        ]
+        config = self.config(next_batch_interval=0)
+        session = Session(config, client=ReplayingClient(syncs))
+        stuck = Remember(release=asyncio.Event())
+        session.plugins = {"Remember": stuck}
+        session.dispatcher = PluginDispatcher(session.plugins)
+        await session.start()
+        await asyncio.wait_for(stuck.started.wait(), 1)
+        await asyncio.sleep(0.05)
+
+        # The command from s3 is still running, so only s2 may be saved
+        self.assertEqual(Checkpointer(config.next_batch_file, 0).load(), "s2")
+
+        # Crash: start again without closing the first session
+        restarted = Session(config, client=ReplayingClient(syncs))
+        plugin = Remember()
+        restarted.plugins = {"Remember": plugin}
+        restarted.dispatcher = PluginDispatcher(restarted.plugins)
+        await restarted.start()
+        await restarted.close()
+
+        self.assertEqual(plugin.handled, ["$m.room.message0"])
+        self.assertEqual(Checkpointer(config.next_batch_file, 0).load(), "s4")
+
+    def reloading_session(self, **settings) -> Session:
+        """Returns a session whose plugins come from a package in the test's
+        directory, with Greet, at version 1, in its greet module.
+        """
+        package_dir = self.package_dir = os.path.join(
+            self.directory.name, "reload_test_plugins"
+        )
+        os.mkdir(package_dir)
+        with open(os.path.join(package_dir, "__init__.py"), "w"):
+            pass
+        self.write_plugin("greet", GREET_SOURCE.replace("VERSION", "1"))
+        sys.path.insert(0, self.directory.name)
+        self.addCleanup(self.forget_plugin_package)
+
+        session = Session(self.config(**settings), client=FakeClient())
+        session.loader = PluginLoader(
+            package_dir,
+            lambda name: PluginConfig(Logger(name)),
+            package="reload_test_plugins",
+        )
+        session.plugins = session.loader.load_all()
+        session.dispatcher = PluginDispatcher(session.plugins)
+        return session
+
+    def write_plugin(self, name: str, source: str) -> None:
+        with open(os.path.join(self.package_dir, f"{name}.py"), "w") as plugin_file:
+            plugin_file.write(source)
+
+    def forget_plugin_package(self) -> None:
+        sys.path.remove(self.directory.name)
+        for name in list(sys.modules):
+            if name.startswith("reload_test_plugins"):
+                del sys.modules[name]
+
+    def greeter(self, session: Session):
+        matched = session.dispatcher.match(ParsedCommand("hello"))
+        return matched[0][1] if matched else None
+
+    async def test_reloads_modified_plugins(self):
+        session = self.reloading_session()
+        self.write_plugin("greet", GREET_SOURCE.replace("VERSION", "2"))
+        await session.reload_plugins({"reload_test_plugins.greet"})
+
+        self.assertEqual(session.plugins["Greet"].version, 2)
+        self.assertIs(self.greeter(session), session.plugins["Greet"])
+        await session.close()
+
+    async def test_reloads_deleted_and_added_plugins(self):
+        session = self.reloading_session()
+        os.remove(os.path.join(self.package_dir, "greet.py"))
+        await session.reload_plugins({"reload_test_plugins.greet"})
+        self.assertNotIn("Greet", session.plugins)
+        self.assertIsNone(self.greeter(session))
+
+        self.write_plugin("welcome", GREET_SOURCE.replace("VERSION", "3"))
+        await session.reload_plugins({"reload_test_plugins.welcome"})
+        self.assertEqual(session.plugins["Greet"].version, 3)
+        self.assertIs(self.greeter(session), session.plugins["Greet"])
+        await session.close()
+
+    async def test_reloads_while_a_plugin_call_is_in_flight(self):
+        session = self.reloading_session(plugin_timeout=0.2)
+        room = MatrixRoom("!room:example.org", BOT_ID)
+        message = RoomMessageText.from_dict(
+            event("m.room.message", {"msgtype": "m.text", "body": "hello"})
+        )
+        old = session.plugins["Greet"]
+        gate = asyncio.Event()
+        session.runner.submit("Greet", room, message, gate.wait())
+
+        self.write_plugin("greet", GREET_SOURCE.replace("VERSION", "2"))
+        reloading = asyncio.ensure_future(
+            session.reload_plugins({"reload_test_plugins.greet"})
+        )
+        await asyncio.sleep(0.01)
+        # New messages reach the new version while the old call finishes
+        self.assertIsNot(self.greeter(session), old)
+        self.assertEqual(self.greeter(session).version, 2)
+        self.assertFalse(reloading.done())
+
+        gate.set()
+        await asyncio.wait_for(reloading, 1)
+        await session.close()
+
+    async def test_reload_waits_no_longer_than_the_plugin_timeout(self):
+        session = self.reloading_session(plugin_timeout=0.05)
+        # Stands in for a call that outlives its timeout by ignoring cancellation
+        stuck = asyncio.ensure_future(asyncio.Event().wait())
+        session.runner.tasks["Greet"] = {stuck}
+
+        await asyncio.wait_for(
+            session.reload_plugins({"reload_test_plugins.greet"}), 1
+        )
+        self.assertFalse(stuck.done())
+        self.assertEqual(self.greeter(session).version, 1)
+        stuck.cancel()
+        await session.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
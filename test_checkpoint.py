@@ -0,0 +1,69 @@
+import os
+import asyncio
+import threading
+import unittest
+from time import sleep
+from tempfile import TemporaryDirectory
+
+from checkpoint import Checkpointer
+
+
+class TestCheckpointer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, "next_batch")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self) -> str:
+        with open(self.file_path) as token_file:
+            return token_file.read()
+
+    def test_load_missing(self):
+        self.assertIsNone(Checkpointer(self.file_path, 60).load())
+
+    async def test_coalesces_updates(self):
+        checkpointer = Checkpointer(self.file_path, 60)
+        for token in ("s1", "s2", "s3"):
+            checkpointer.update(token)
+        self.assertFalse(os.path.exists(self.file_path))
+
+        await checkpointer.close()
+        self.assertEqual(self.read(), "s3")
+        self.assertEqual(os.listdir(self.directory.name), ["next_batch"])
+
+    async def test_writes_after_interval(self):
+        checkpointer = Checkpointer(self.file_path, 0.01)
+        checkpointer.update("s1")
+        await asyncio.sleep(0.2)
+        self.assertEqual(Checkpointer(self.file_path, 0).load(), "s1")
+        await checkpointer.close()
+
+    async def test_close_waits_for_the_write_under_way(self):
+        lock = threading.Lock()
+        writing = []
+        overlapped = []
+
+        def save_state():
+            if not lock.acquire(blocking=False):
+                overlapped.append(True)
+                return
+            writing.append(True)
+            sleep(0.1)
+            lock.release()
+
+        checkpointer = Checkpointer(self.file_path, 0, snapshot=lambda _: save_state)
+        checkpointer.update("s1")
+        while not writing:
+            await asyncio.sleep(0.01)
+        checkpointer.update("s2")
+        await checkpointer.close()
+
+        self.assertEqual(overlapped, [])
+        self.assertEqual(len(writing), 2)
+        self.assertEqual(self.read(), "s2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+from typing import List
+
+from dispatch import PluginDispatcher
+from parsing import ParsedCommand
+from plugin import BasePlugin, TextCommand
+
+
+class Echo(BasePlugin):
+    trigger = ["echo", "Say"]
+
+    async def process_event(self, room, event, messenger) -> None:
+        pass
+
+
+class Strict(BasePlugin):
+    trigger = ["echo"]
+
+    async def process_event(self, room, event, messenger) -> None:
+        pass
+
+    def is_triggered(self, tokens: List[str]) -> bool:
+        return len(tokens) == 2
+
+
+class Question(BasePlugin):
+    async def process_event(self, room, event, messenger) -> None:
+        pass
+
+    def is_triggered(self, tokens: List[str]) -> bool:
+        return bool(tokens) and tokens[-1].endswith("?")
+
+
+class Broken(BasePlugin):
+    trigger = ["echo"]
+
+    async def process_event(self, room, event, messenger) -> None:
+        pass
+
+    def is_triggered(self, tokens: List[str]) -> bool:
+        raise ValueError("oops")
+
+
+class Ping(TextCommand):
+    trigger = ["ping"]
+    arity = 1
+
+    async def process_event(self, room, event, messenger, tokens) -> None:
+        pass
+
+
+class Pick(TextCommand):
+    trigger = ["pick", "echo"]
+    arity = (1, None)
+    arg_patterns = r"\d+"
+
+    async def process_event(self, room, event, messenger, tokens) -> None:
+        pass
+
+    def is_triggered(self, tokens: List[str]) -> bool:
+        return "0" not in tokens
+
+
+class TestPluginDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.plugins = {
+            "Echo": Echo(),
+            "Strict": Strict(),
+            "Question": Question(),
+            "Broken": Broken(),
+            "Ping": Ping(),
+            "Pick": Pick(),
+        }
+        self.dispatcher = PluginDispatcher(self.plugins)
+
+    def matched(self, body: str) -> List[str]:
+        return [name for name, _ in self.dispatcher.match(ParsedCommand(body))]
+
+    def test_indexes_triggers_case_insensitively(self):
+        self.assertEqual(self.matched("SAY hi"), ["Echo"])
+
+    def test_confirms_with_is_triggered(self):
+        self.assertEqual(self.matched("echo"), ["Echo"])
+        self.assertEqual(self.matched("echo  hello"), ["Echo", "Strict"])
+
+    def test_untriggered_plugins_use_predicate(self):
+        self.assertEqual(self.matched("what time is it?"), ["Question"])
+        self.assertEqual(self.matched("echo me?"), ["Echo", "Strict", "Question"])
+
+    def test_commands_match_declared_arguments(self):
+        self.assertEqual(self.matched("Ping example.org"), ["Ping"])
+        self.assertEqual(self.matched("ping"), [])
+        self.assertEqual(self.matched("pick 1 2 3"), ["Pick"])
+        self.assertEqual(self.matched("pick one"), [])
+
+    def test_commands_share_triggers(self):
+        self.assertEqual(self.matched("echo 42"), ["Pick", "Echo", "Strict"])
+        # Pick's own is_triggered still applies after its pattern matches
+        self.assertEqual(self.matched("echo 0"), ["Echo", "Strict"])
+
+    def test_commands_are_only_matched_under_their_trigger(self):
+        self.assertEqual(sorted(self.dispatcher.commands), ["echo", "pick", "ping"])
+        self.assertEqual(
+            [name for name, _ in self.dispatcher.commands["ping"].commands], ["Ping"]
+        )
+
+    def test_no_match(self):
+        self.assertEqual(self.matched("hello there"), [])
+        self.assertEqual(self.matched(""), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import asyncio
+import threading
+import unittest
+from importlib.util import module_from_spec, spec_from_file_location
+from tempfile import TemporaryDirectory
+
+from logbook import WARNING, TestHandler as LogCapture
+
+import executor
+from executor import LoopStallDetector, blocking, run_blocking
+from log import logger_group
+
+STALLING_PLUGIN = """
+import time
+
+
+def hog(seconds):
+    time.sleep(seconds)
+"""
+
+
+@blocking
+def thread_name() -> str:
+    return threading.current_thread().name
+
+
+class TestExecutor(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        executor.configure(threads=2)
+        self.level = logger_group.level
+        logger_group.level = WARNING
+
+    def tearDown(self):
+        logger_group.level = self.level
+        executor.shutdown()
+
+    async def test_runs_blocking_work_off_the_loop(self):
+        loop_thread = threading.get_ident()
+        self.assertNotEqual(await run_blocking(threading.get_ident), loop_thread)
+        self.assertTrue((await thread_name()).startswith("olive-blocking"))
+
+    async def test_reports_the_plugin_stalling_the_loop(self):
+        with TemporaryDirectory() as plugins_dir:
+            path = os.path.join(plugins_dir, "stalling.py")
+            with open(path, "w") as plugin_file:
+                plugin_file.write(STALLING_PLUGIN)
+            spec = spec_from_file_location("stalling", path)
+            plugin = module_from_spec(spec)
+            spec.loader.exec_module(plugin)
+
+            detector = LoopStallDetector(0.1, plugins_dir)
+            handler = LogCapture()
+            # The watchdog logs from its own thread
+            with handler.applicationbound():
+                detector.start()
+                await asyncio.sleep(0.05)
+                # Under the threshold
+                plugin.hog(0.05)
+                await asyncio.sleep(0.05)
+                # Only just over it
+                plugin.hog(0.13)
+                await asyncio.sleep(0.05)
+                detector.stop()
+
+        warnings = [
+            record.message for record in handler.records if "blocked" in record.message
+        ]
+        self.assertEqual(len(warnings), 1)
+        self.assertIn("plugin stalling (hog, line 6)", warnings[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
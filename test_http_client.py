@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from http_client import HttpClient
+
+
+class TestHttpClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.peers = []
+        app = web.Application()
+        app.router.add_get("/json", self.json)
+        app.router.add_get("/slow", self.slow)
+        self.server = TestServer(app)
+        await self.server.start_server()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def json(self, request: web.Request) -> web.Response:
+        self.peers.append(request.transport.get_extra_info("peername"))
+        # Served as text, as some APIs do
+        return web.Response(text='{"answer": 42}')
+
+    async def slow(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(1)
+        return web.Response(text="late")
+
+    async def test_reuses_the_session_and_connection(self):
+        http = HttpClient()
+        url = str(self.server.make_url("/json"))
+        self.assertEqual(await http.get_json(url), {"answer": 42})
+        session = http.session
+        self.assertEqual(await http.get_bytes(url), b'{"answer": 42}')
+
+        self.assertIs(http.session, session)
+        self.assertEqual(len(self.peers), 2)
+        self.assertEqual(self.peers[0], self.peers[1])
+        await http.close()
+
+    async def test_times_out(self):
+        http = HttpClient(timeout=0.05)
+        with self.assertRaises(asyncio.TimeoutError):
+            await http.get_bytes(str(self.server.make_url("/slow")))
+        await http.close()
+
+    async def test_close(self):
+        http = HttpClient()
+        # Closing before any request has nothing to close
+        await http.close()
+
+        url = str(self.server.make_url("/json"))
+        await http.get_json(url)
+        session = http.session
+        await http.close()
+        self.assertTrue(session.closed)
+        await http.close()
+
+        # A closed client opens a new session if it's used again
+        self.assertEqual(await http.get_json(url), {"answer": 42})
+        self.assertIsNot(http.session, session)
+        await http.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
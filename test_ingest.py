@@ -0,0 +1,120 @@
+import asyncio
+import unittest
+
+from nio import MatrixRoom, RoomMessageText
+
+from ingest import IngestQueue
+from metrics import Metrics
+
+
+def message(room_id: str, body: str):
+    event = RoomMessageText.from_dict(
+        {
+            "event_id": f"${room_id}{body}",
+            "sender": "@user:example.org",
+            "origin_server_ts": 0,
+            "type": "m.room.message",
+            "content": {"msgtype": "m.text", "body": body},
+        }
+    )
+    return MatrixRoom(room_id, "@olive:example.org"), event
+
+
+class TestIngestQueue(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.log = []
+
+    def put(self, queue: IngestQueue, room_id: str, body: str, delay: float = 0):
+        async def work():
+            self.log.append(("start", room_id, body))
+            await asyncio.sleep(delay)
+            self.log.append(("end", room_id, body))
+
+        queue.put(*message(room_id, body), work)
+
+    async def test_keeps_room_order(self):
+        queue = IngestQueue(workers=4)
+        self.put(queue, "!a", "1", delay=0.02)
+        self.put(queue, "!a", "2")
+        self.put(queue, "!b", "1")
+        await queue.join()
+
+        room_a = [entry for entry in self.log if entry[1] == "!a"]
+        self.assertEqual(
+            room_a,
+            [
+                ("start", "!a", "1"),
+                ("end", "!a", "1"),
+                ("start", "!a", "2"),
+                ("end", "!a", "2"),
+            ],
+        )
+        # !b didn't wait for !a's slow message
+        self.assertLess(
+            self.log.index(("end", "!b", "1")), self.log.index(("end", "!a", "1"))
+        )
+
+    async def test_backpressure(self):
+        metrics = Metrics()
+        queue = IngestQueue(workers=1, max_size=2, metrics=metrics)
+        for body in "123":
+            self.put(queue, "!a", body, delay=0.01)
+        self.assertEqual(queue.depth, 3)
+
+        waiting = asyncio.ensure_future(queue.wait_for_space())
+        await asyncio.sleep(0)
+        self.assertFalse(waiting.done())
+        await asyncio.wait_for(waiting, 1)
+        self.assertLess(queue.depth, 2)
+        self.assertIn("olive_ingest_queue_depth", metrics.render())
+
+        await queue.join()
+        self.assertEqual(queue.depth, 0)
+
+    async def test_starts_a_worker_as_the_last_one_finishes(self):
+        queue = IngestQueue(workers=1)
+
+        async def work():
+            # Runs once the worker has returned, before its task is cleaned up
+            asyncio.get_running_loop().call_soon(self.put, queue, "!b", "1")
+
+        queue.put(*message("!a", "1"), work)
+        for _ in range(5):
+            await asyncio.sleep(0)
+        await asyncio.wait_for(queue.join(), 1)
+        self.assertEqual(queue.depth, 0)
+        self.assertIn(("end", "!b", "1"), self.log)
+
+    async def test_releases_sync_tokens_once_handled(self):
+        tokens = []
+        queue = IngestQueue(workers=4, handled=tokens.append)
+        self.put(queue, "!a", "1", delay=0.02)
+        queue.end_of_batch("s1")
+        self.put(queue, "!b", "1")
+        held = queue.claim()
+        queue.end_of_batch("s2")
+        queue.end_of_batch("s3")
+
+        await asyncio.sleep(0.01)
+        # !b is done, but s1's slow message is still running
+        self.assertEqual(tokens, [])
+        await queue.join()
+        self.assertEqual(tokens, ["s1"])
+        # s2's claimed message holds back the syncs after it too
+        held()
+        self.assertEqual(tokens, ["s1", "s3"])
+
+    async def test_failures_dont_stop_the_room(self):
+        queue = IngestQueue()
+
+        async def fail():
+            raise ValueError("oops")
+
+        queue.put(*message("!a", "1"), fail)
+        self.put(queue, "!a", "2")
+        await queue.join()
+        self.assertIn(("end", "!a", "2"), self.log)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+
+from nio import JoinError, JoinResponse, MatrixInvitedRoom
+
+from invites import InviteJoiner
+
+
+class FakeClient:
+    def __init__(self, fail=()):
+        self.rooms = {}
+        self.fail = set(fail)
+        self.joins = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    async def join(self, room_id):
+        self.joins.append(room_id)
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if room_id in self.fail:
+            return JoinError("forbidden")
+        return JoinResponse(room_id)
+
+
+class TestInviteJoiner(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.greeted = []
+
+    async def greet(self, room):
+        self.greeted.append(room.room_id)
+
+    def room(self, room_id):
+        return MatrixInvitedRoom(room_id, "@olive:example.org")
+
+    async def test_deduplicates_invites(self):
+        client = FakeClient()
+        joiner = InviteJoiner(client, 4, self.greet)
+        for _ in range(3):
+            joiner.invite(self.room("!a:example.org"))
+        joiner.end_of_batch()
+        # A later batch repeating the invite before the join shows up
+        joiner.invite(self.room("!a:example.org"))
+        joiner.end_of_batch()
+        await joiner.close()
+
+        self.assertEqual(client.joins, ["!a:example.org"])
+        self.assertEqual(self.greeted, ["!a:example.org"])
+
+    async def test_bounds_concurrency(self):
+        client = FakeClient()
+        joiner = InviteJoiner(client, 2, self.greet)
+        for index in range(6):
+            joiner.invite(self.room(f"!{index}:example.org"))
+        joiner.end_of_batch()
+        await joiner.close()
+
+        self.assertEqual(len(client.joins), 6)
+        self.assertEqual(client.most_in_flight, 2)
+        self.assertEqual(len(self.greeted), 6)
+
+    async def test_retries_failed_join_on_next_invite(self):
+        client = FakeClient(fail={"!a:example.org"})
+        joiner = InviteJoiner(client, 4, self.greet)
+        joiner.invite(self.room("!a:example.org"))
+        joiner.end_of_batch()
+        await joiner.close()
+        self.assertEqual(self.greeted, [])
+
+        client.fail.clear()
+        joiner.invite(self.room("!a:example.org"))
+        joiner.end_of_batch()
+        await joiner.close()
+        self.assertEqual(client.joins, ["!a:example.org"] * 2)
+        self.assertEqual(self.greeted, ["!a:example.org"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import json
+import unittest
+from unittest import mock
+
+import logbook
+from logbook import Logger, TestHandler as LogCapture
+
+from log import (
+    BackgroundHandler,
+    LogLimiter,
+    json_formatter,
+    logger_group,
+    plugin_logger,
+)
+
+
+class TestLogLimiter(unittest.TestCase):
+    def setUp(self):
+        self.handler = LogCapture()
+
+    def record(self, channel: str, level: int = logbook.INFO) -> logbook.LogRecord:
+        return logbook.LogRecord(channel, level, "message")
+
+    def test_rate_limits_by_prefix(self):
+        limiter = LogLimiter(rates={"olive.plugin": 1})
+        kept = [
+            limiter(self.record("olive.plugin.Define"), self.handler)
+            for _ in range(5)
+        ]
+        # A rate of one per second allows a burst of two
+        self.assertEqual(kept, [True, True, False, False, False])
+        self.assertEqual(limiter.dropped, {"olive.plugin.Define": 3})
+        self.assertTrue(limiter(self.record("olive.core"), self.handler))
+
+    def test_samples(self):
+        limiter = LogLimiter(samples={"olive.read_markers": 0.5})
+        with mock.patch("log.random.random", side_effect=[0.2, 0.7]):
+            self.assertTrue(limiter(self.record("olive.read_markers"), self.handler))
+            self.assertFalse(limiter(self.record("olive.read_markers"), self.handler))
+
+    def test_keeps_errors(self):
+        limiter = LogLimiter(rates={"olive": 0.001}, samples={"olive": 0})
+        for _ in range(5):
+            record = self.record("olive.core", logbook.ERROR)
+            self.assertTrue(limiter(record, self.handler))
+
+
+class TestLogging(unittest.TestCase):
+    def test_json_output(self):
+        handler = LogCapture()
+        handler.formatter = json_formatter
+        with handler.applicationbound():
+            Logger("olive.core").warning("Careful")
+            try:
+                raise ValueError("oops")
+            except ValueError:
+                Logger("olive.core").exception("Failed")
+
+        warning, error = map(json.loads, handler.formatted_records)
+        self.assertEqual(warning["level"], "WARNING")
+        self.assertEqual(warning["channel"], "olive.core")
+        self.assertEqual(warning["message"], "Careful")
+        self.assertNotIn("exception", warning)
+        self.assertIn("ValueError: oops", error["exception"])
+
+    def test_background_writer_keeps_tracebacks(self):
+        target = LogCapture()
+        handler = BackgroundHandler(target)
+        with handler.applicationbound():
+            try:
+                raise ValueError("oops")
+            except ValueError:
+                Logger("olive.core").exception("Failed")
+        handler.close()
+
+        self.assertEqual(len(target.records), 1)
+        self.assertIn("ValueError: oops", target.formatted_records[0])
+
+    def test_plugin_loggers_are_shared(self):
+        logger = plugin_logger("Define")
+        self.assertIsInstance(logger, Logger)
+        self.assertIs(plugin_logger("Define"), logger)
+        self.assertIn(logger, logger_group.loggers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import asyncio
+import unittest
+
+from nio import RoomSendResponse
+
+from messaging import Messenger
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+
+    def add_response_callback(self, func, cb_filter) -> None:
+        pass
+
+    async def room_send(self, room_id, message_type, content, tx_id=None):
+        self.sent.append((room_id, content))
+        return RoomSendResponse(f"$event{len(self.sent)}", room_id)
+
+
+class TestMessenger(unittest.IsolatedAsyncioTestCase):
+    async def test_coalesces_text_per_room(self):
+        client = FakeClient()
+        messenger = Messenger(client, coalesce_window=0.01)
+        event_ids = await asyncio.gather(
+            messenger.send_text("!a", "one"),
+            messenger.send_text("!a", "<two>", formatted_body="<b>two</b>"),
+            messenger.send_text("!b", "three"),
+        )
+
+        self.assertEqual(event_ids[0], event_ids[1])
+        self.assertNotEqual(event_ids[0], event_ids[2])
+        room_a = dict(client.sent)["!a"]
+        self.assertEqual(room_a["body"], "one\n<two>")
+        self.assertEqual(room_a["formatted_body"], "one<br><b>two</b>")
+
+    async def test_sends_immediately_without_window(self):
+        client = FakeClient()
+        messenger = Messenger(client)
+        await messenger.send_text("!a", "one")
+        await messenger.send_text("!a", "two")
+        self.assertEqual([content["body"] for _, content in client.sent], ["one", "two"])
+
+    async def test_edit_text(self):
+        client = FakeClient()
+        messenger = Messenger(client)
+        await messenger.edit_text("!a", "$placeholder", "done")
+
+        _, content = client.sent[0]
+        self.assertEqual(content["m.new_content"]["body"], "done")
+        self.assertEqual(
+            content["m.relates_to"], {"rel_type": "m.replace", "event_id": "$placeholder"}
+        )
+
+    async def test_placeholders_are_not_coalesced(self):
+        client = FakeClient()
+        messenger = Messenger(client, coalesce_window=0.01)
+        reply, placeholder = await asyncio.gather(
+            messenger.send_text("!a", "reply"),
+            messenger.send_text("!a", "Working...", coalesce=False),
+        )
+        await messenger.edit_text("!a", placeholder, "done")
+
+        self.assertNotEqual(reply, placeholder)
+        bodies = [content["body"] for _, content in client.sent]
+        self.assertEqual(bodies, ["Working...", "reply", "* done"])
+
+
+if __name__ == "__main__":
+    unittest.main()
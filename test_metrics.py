@@ -0,0 +1,95 @@
+import asyncio
+import unittest
+
+from aiohttp import ClientSession
+
+from metrics import Metrics, MetricsExporter, NULL_METRIC, NULL_METRICS
+from runner import PluginRunner
+
+
+class TestMetrics(unittest.TestCase):
+    def test_same_metric_for_same_labels(self):
+        metrics = Metrics()
+        first = metrics.counter("errors_total", plugin="define")
+        self.assertIs(metrics.counter("errors_total", plugin="define"), first)
+        self.assertIsNot(metrics.counter("errors_total", plugin="ping"), first)
+
+    def test_histogram_percentiles(self):
+        histogram = Metrics().histogram("seconds", buckets=(0.1, 1, 10))
+        self.assertIsNone(histogram.percentile(50))
+        for value in (0.05, 0.05, 0.5, 20):
+            histogram.observe(value)
+        self.assertEqual(histogram.percentile(50), 0.1)
+        self.assertEqual(histogram.percentile(75), 1)
+        self.assertEqual(histogram.percentile(99), float("inf"))
+
+    def test_render_prometheus_text(self):
+        metrics = Metrics()
+        metrics.counter("errors_total", "Errors", plugin='say "hi"').inc(2)
+        metrics.gauge("depth", read=lambda: 7)
+        histogram = metrics.histogram("seconds", buckets=(0.1, 1))
+        histogram.observe(0.5)
+
+        self.assertEqual(
+            metrics.render().splitlines(),
+            [
+                "# HELP olive_errors_total Errors",
+                "# TYPE olive_errors_total counter",
+                'olive_errors_total{plugin="say \\"hi\\""} 2',
+                "# TYPE olive_depth gauge",
+                "olive_depth 7",
+                "# TYPE olive_seconds histogram",
+                'olive_seconds_bucket{le="0.1"} 0',
+                'olive_seconds_bucket{le="1"} 1',
+                'olive_seconds_bucket{le="+Inf"} 1',
+                "olive_seconds_sum 0.5",
+                "olive_seconds_count 1",
+            ],
+        )
+
+    def test_disabled_metrics_record_nothing(self):
+        histogram = NULL_METRICS.histogram("seconds")
+        self.assertIs(histogram, NULL_METRIC)
+        with histogram.time():
+            pass
+        self.assertEqual(NULL_METRICS.families, {})
+
+
+class TestInstrumentation(unittest.IsolatedAsyncioTestCase):
+    async def test_runner_records_plugins(self):
+        metrics = Metrics()
+        runner = PluginRunner(2, 0.05, metrics=metrics)
+        room = type("Room", (), {"display_name": "room"})()
+        event = type("Event", (), {"event_id": "$event"})()
+
+        async def fail():
+            raise ValueError("oops")
+
+        runner.submit("Slow", room, event, asyncio.sleep(1))
+        runner.submit("Broken", room, event, fail())
+        runner.submit("Quick", room, event, asyncio.sleep(0))
+        await runner.drain()
+
+        timeouts = metrics.counter("plugin_timeouts_total", plugin="Slow")
+        self.assertEqual(timeouts.get(), 1)
+        errors = metrics.counter("plugin_errors_total", plugin="Broken")
+        self.assertEqual(errors.get(), 1)
+        self.assertEqual(metrics.histogram("plugin_seconds", plugin="Quick").count, 1)
+
+    async def test_serves_metrics(self):
+        metrics = Metrics()
+        metrics.counter("messages_total").inc()
+        exporter = MetricsExporter(metrics, port=18931)
+        await exporter.start()
+        try:
+            async with ClientSession() as session:
+                async with session.get("http://127.0.0.1:18931/metrics") as response:
+                    text = await response.text()
+        finally:
+            await exporter.stop()
+
+        self.assertIn("olive_messages_total 1", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
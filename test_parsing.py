@@ -0,0 +1,47 @@
+import unittest
+
+from parsing import ParsedCommand
+from plugin import BasePlugin
+
+
+class WithTokens(BasePlugin):
+    async def process_event(self, room, event, messenger, tokens) -> None:
+        pass
+
+
+class WithoutTokens(BasePlugin):
+    async def process_event(self, room, event, messenger) -> None:
+        pass
+
+
+class TestParsedCommand(unittest.TestCase):
+    def test_normalizes_whitespace(self):
+        command = ParsedCommand("  Define\tcoffee \n now ")
+        self.assertEqual(list(command), ["Define", "coffee", "now"])
+        self.assertEqual(len(command), 3)
+        self.assertEqual(command[1], "coffee")
+        self.assertEqual(command.command, "define")
+        self.assertEqual(command.args, ("coffee", "now"))
+
+    def test_blank_body(self):
+        for body in ("", "   ", None):
+            command = ParsedCommand(body)
+            self.assertEqual(len(command), 0)
+            self.assertEqual(command.command, "")
+            self.assertEqual(command.args, ())
+
+    def test_mentions(self):
+        body = "tag @alice:example.org and @bob:matrix.org:8448!"
+        command = ParsedCommand(body)
+        self.assertEqual(
+            [body[start:end] for start, end in command.mentions],
+            ["@alice:example.org", "@bob:matrix.org:8448"],
+        )
+
+    def test_detects_tokens_parameter(self):
+        self.assertTrue(WithTokens().takes_tokens())
+        self.assertFalse(WithoutTokens().takes_tokens())
+
+
+if __name__ == "__main__":
+    unittest.main()
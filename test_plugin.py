@@ -11,6 +11,36 @@ class TestCommand(unittest.TestCase):
             Command()
 
 
+class Roll(TextCommand):
+    trigger = ["roll", "r"]
+    arity = (1, 2)
+    arg_patterns = [r"\d+d\d+", r"[+-]\d+"]
+
+    async def process_event(self, room, event, messenger, tokens) -> None:
+        pass
+
+
+class Say(TextCommand):
+    trigger = "say"
+    arg_patterns = r"[a-z]+"
+
+    async def process_event(self, room, event, messenger, tokens) -> None:
+        pass
+
+
+class TestCommandPattern(unittest.TestCase):
+    def test_arity_and_positional_patterns(self):
+        for body in ("roll 2d6", "R 1d20 +3"):
+            self.assertTrue(Roll.matches(body.split()), body)
+        for body in ("roll", "roll six", "roll 2d6 3", "roll 2d6 +3 +1", "rolls 2d6"):
+            self.assertFalse(Roll.matches(body.split()), body)
+
+    def test_pattern_for_every_argument(self):
+        self.assertTrue(Say.matches(["say"]))
+        self.assertTrue(Say.matches(["say", "hello", "there"]))
+        self.assertFalse(Say.matches(["say", "hello", "there!"]))
+
+
 class TestTextCommand(unittest.TestCase):
     def test_cannot_instatiate(self):
         """You should not be able to instatiate the abstract class.
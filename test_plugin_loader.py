@@ -0,0 +1,170 @@
+import os
+import sys
+import asyncio
+import unittest
+from tempfile import TemporaryDirectory
+
+from logbook import Logger
+
+from plugin import PluginConfig
+from plugin_loader import LazyPlugin, PluginLoader, PluginWatcher
+
+PLUGIN_SOURCE = """
+from plugin import BasePlugin
+
+LOADED = True
+
+
+class Echo(BasePlugin):
+    trigger = ["echo", "say"]
+
+    async def process_event(self, room, event, messenger) -> None:
+        pass
+
+
+class LoudEcho(Echo):
+    trigger: list = ["shout"]
+
+
+class Helper:
+    pass
+"""
+
+DYNAMIC_SOURCE = """
+from plugin import BasePlugin
+
+
+class Anything(BasePlugin):
+    trigger = ["any" + "thing"]
+
+    async def process_event(self, room, event, messenger) -> None:
+        pass
+"""
+
+
+class TestPluginLoader(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        package_dir = self.package_dir = os.path.join(
+            self.directory.name, "loader_test_plugins"
+        )
+        os.mkdir(package_dir)
+        for file_name, source in (
+            ("__init__.py", ""),
+            ("echo.py", PLUGIN_SOURCE),
+            ("dynamic.py", DYNAMIC_SOURCE),
+        ):
+            with open(os.path.join(package_dir, file_name), "w") as plugin_file:
+                plugin_file.write(source)
+
+        sys.path.insert(0, self.directory.name)
+        self.loader = PluginLoader(
+            package_dir,
+            lambda name: PluginConfig(Logger(name)),
+            package="loader_test_plugins",
+        )
+
+    def tearDown(self):
+        sys.path.remove(self.directory.name)
+        for name in list(sys.modules):
+            if name.startswith("loader_test_plugins"):
+                del sys.modules[name]
+        self.directory.cleanup()
+
+    def test_scan_reads_literal_triggers(self):
+        specs = self.loader.scan("loader_test_plugins.echo")
+        self.assertEqual(
+            [(spec.class_name, spec.trigger) for spec in specs],
+            [("Echo", ["echo", "say"]), ("LoudEcho", ["shout"])],
+        )
+        self.assertNotIn("loader_test_plugins.echo", sys.modules)
+
+    def test_scan_rejects_computed_triggers(self):
+        self.assertIsNone(self.loader.scan("loader_test_plugins.dynamic"))
+
+    def test_lazy_load(self):
+        plugins = self.loader.load_all(lazy=True)
+
+        self.assertIsInstance(plugins["Echo"], LazyPlugin)
+        self.assertNotIsInstance(plugins["Anything"], LazyPlugin)
+        self.assertNotIn("loader_test_plugins.echo", sys.modules)
+
+        self.assertTrue(plugins["Echo"].is_triggered(["echo"]))
+        self.assertIn("loader_test_plugins.echo", sys.modules)
+        self.assertIn("Echo", self.loader.init_times)
+
+    def test_eager_load_imports_once(self):
+        plugins = self.loader.load_all()
+        self.assertEqual(sorted(plugins), ["Anything", "Echo", "LoudEcho"])
+        self.assertEqual(
+            sorted(self.loader.import_times),
+            ["loader_test_plugins.dynamic", "loader_test_plugins.echo"],
+        )
+
+    def test_loaders_share_modules(self):
+        first = self.loader.load_all()
+        other = PluginLoader(
+            self.package_dir,
+            lambda name: PluginConfig(Logger(name)),
+            package="loader_test_plugins",
+            modules=self.loader.modules,
+        )
+        second = other.load_all()
+
+        # Each loader gets its own instances of the one imported class
+        self.assertIsNot(second["Echo"], first["Echo"])
+        self.assertIs(type(second["Echo"]), type(first["Echo"]))
+
+    def test_load_module_picks_up_changes(self):
+        self.loader.load_all()
+        with open(os.path.join(self.package_dir, "echo.py"), "w") as plugin_file:
+            plugin_file.write(DYNAMIC_SOURCE.replace("Anything", "Replacement"))
+
+        plugins = self.loader.load_module("loader_test_plugins.echo")
+        self.assertEqual(list(plugins), ["Replacement"])
+
+        os.remove(os.path.join(self.package_dir, "echo.py"))
+        self.assertEqual(self.loader.load_module("loader_test_plugins.echo"), {})
+
+    def test_watcher_snapshot(self):
+        watcher = PluginWatcher(self.loader, 1, None)
+        self.assertEqual(
+            sorted(watcher.snapshot()),
+            ["loader_test_plugins.dynamic", "loader_test_plugins.echo"],
+        )
+
+    async def test_watcher_reports_changed_modules(self):
+        reports = []
+        changed = asyncio.Event()
+
+        async def on_change(module_names):
+            reports.append(module_names)
+            changed.set()
+
+        watcher = PluginWatcher(self.loader, 0.01, on_change)
+        watcher.start()
+        await asyncio.sleep(0.05)
+        self.assertEqual(reports, [])
+
+        echo_path = os.path.join(self.package_dir, "echo.py")
+        # Move the time on, as a rewrite within the same tick keeps it
+        os.utime(echo_path, (0, os.stat(echo_path).st_mtime + 10))
+        os.remove(os.path.join(self.package_dir, "dynamic.py"))
+        with open(os.path.join(self.package_dir, "new.py"), "w") as plugin_file:
+            plugin_file.write(DYNAMIC_SOURCE)
+        await asyncio.wait_for(changed.wait(), 1)
+        await asyncio.sleep(0.05)
+        watcher.stop()
+
+        self.assertEqual(
+            set().union(*reports),
+            {
+                "loader_test_plugins.dynamic",
+                "loader_test_plugins.echo",
+                "loader_test_plugins.new",
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
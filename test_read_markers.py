@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+
+from nio import RoomMessageText, RoomReadMarkersResponse
+
+from read_markers import ReadMarkerAggregator
+
+
+def message(event_id: str, timestamp: int) -> RoomMessageText:
+    return RoomMessageText.from_dict(
+        {
+            "event_id": event_id,
+            "sender": "@user:example.org",
+            "origin_server_ts": timestamp,
+            "type": "m.room.message",
+            "content": {"msgtype": "m.text", "body": "hello"},
+        }
+    )
+
+
+class FakeClient:
+    def __init__(self):
+        self.markers = []
+
+    async def room_read_markers(self, room_id, fully_read_event, read_event=None):
+        self.markers.append((room_id, read_event))
+        return RoomReadMarkersResponse(room_id)
+
+
+class TestReadMarkerAggregator(unittest.IsolatedAsyncioTestCase):
+    async def test_sends_one_marker_per_burst(self):
+        client = FakeClient()
+        markers = ReadMarkerAggregator(client, debounce=0.01)
+        for index in range(50):
+            markers.mark("!a", message(f"${index}", 1000 + index))
+        markers.mark("!b", message("$b", 1000))
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(sorted(client.markers), [("!a", "$49"), ("!b", "$b")])
+
+    async def test_newest_event_wins(self):
+        client = FakeClient()
+        markers = ReadMarkerAggregator(client, debounce=0.01)
+        markers.mark("!a", message("$new", 2000))
+        # Events can arrive out of order, as with a backfilled timeline
+        markers.mark("!a", message("$old", 1000))
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(client.markers, [("!a", "$new")])
+
+    async def test_flushes_each_batch_without_debounce(self):
+        client = FakeClient()
+        markers = ReadMarkerAggregator(client, debounce=0)
+        markers.mark("!a", message("$a", 1000))
+        await asyncio.sleep(0.01)
+        self.assertEqual(client.markers, [])
+
+        markers.end_of_batch()
+        await asyncio.sleep(0.01)
+        self.assertEqual(client.markers, [("!a", "$a")])
+
+    async def test_close_flushes_pending_markers(self):
+        client = FakeClient()
+        markers = ReadMarkerAggregator(client, debounce=60)
+        markers.mark("!a", message("$a", 1000))
+        await markers.close()
+
+        self.assertEqual(client.markers, [("!a", "$a")])
+
+
+if __name__ == "__main__":
+    unittest.main()
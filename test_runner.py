@@ -0,0 +1,108 @@
+import asyncio
+import unittest
+
+from logbook import ERROR, TestHandler as LogCapture
+from nio import MatrixRoom, RoomMessageText
+
+from log import logger_group
+from runner import PluginRunner
+
+ROOM = MatrixRoom("!room:example.org", "@olive:example.org")
+EVENT = RoomMessageText.from_dict(
+    {
+        "event_id": "$event",
+        "sender": "@user:example.org",
+        "origin_server_ts": 0,
+        "type": "m.room.message",
+        "content": {"msgtype": "m.text", "body": "hello"},
+    }
+)
+
+
+class TestPluginRunner(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.level = logger_group.level
+        logger_group.level = ERROR
+        self.handler = LogCapture()
+        self.handler.push_application()
+
+    def tearDown(self):
+        self.handler.pop_application()
+        logger_group.level = self.level
+
+    async def test_limits_calls_running_at_once(self):
+        runner = PluginRunner(2, 0)
+        running = peak = 0
+
+        async def call():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        for index in range(6):
+            runner.submit(f"Plugin{index}", ROOM, EVENT, call())
+        await runner.drain()
+
+        self.assertEqual(peak, 2)
+        self.assertEqual(runner.in_flight(), set())
+
+    async def test_times_out_slow_calls(self):
+        runner = PluginRunner(4, 0.05)
+        slow = runner.submit("Slow", ROOM, EVENT, asyncio.sleep(10))
+        # A plugin's own timeout overrides the runner's
+        patient = runner.submit("Patient", ROOM, EVENT, asyncio.sleep(0.1), timeout=1)
+        await asyncio.wait_for(runner.drain(), 1)
+
+        self.assertIsNone(slow.result())
+        self.assertIsNone(patient.result())
+        self.assertEqual(
+            [record.message.split(" timed out")[0] for record in self.handler.records],
+            ["Plugin Slow"],
+        )
+
+    async def test_cancels_calls(self):
+        runner = PluginRunner(1, 0)
+        started = asyncio.Event()
+
+        async def call():
+            started.set()
+            await asyncio.sleep(10)
+
+        running = runner.submit("Running", ROOM, EVENT, call())
+        waiting = runner.submit("Waiting", ROOM, EVENT, asyncio.sleep(0))
+        await started.wait()
+        running.cancel()
+        await runner.drain()
+
+        self.assertTrue(running.cancelled())
+        # The slot is given back for the next call
+        self.assertTrue(waiting.done() and not waiting.cancelled())
+        self.assertEqual(self.handler.records, [])
+
+    async def test_isolates_errors(self):
+        runner = PluginRunner(1, 0)
+        handled = []
+
+        async def fail():
+            raise ValueError("oops")
+
+        async def succeed():
+            handled.append("Good")
+
+        broken = runner.submit("Broken", ROOM, EVENT, fail())
+        good = runner.submit("Good", ROOM, EVENT, succeed())
+        await runner.drain()
+
+        self.assertIsNone(broken.result())
+        self.assertIsNone(good.result())
+        self.assertEqual(handled, ["Good"])
+        self.assertEqual(len(self.handler.records), 1)
+        self.assertIn(
+            "Plugin Broken encountered an error", self.handler.records[0].message
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from seen_events import RECORD_SIZE, SeenEvents
+
+
+class TestSeenEvents(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "seen_events")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_drops_duplicates(self):
+        seen = SeenEvents(max_size=2)
+        self.assertTrue(seen.add("$a"))
+        self.assertFalse(seen.add("$a"))
+        self.assertTrue(seen.add("$b"))
+        # Seeing $a again kept it fresh, so $b is the one forgotten
+        self.assertFalse(seen.add("$a"))
+        self.assertTrue(seen.add("$c"))
+        self.assertTrue(seen.add("$b"))
+        self.assertEqual(seen.duplicates, 2)
+
+    async def test_survives_restarts(self):
+        seen = SeenEvents(self.path)
+        for event_id in ("$a", "$b", "$c"):
+            seen.add(event_id)
+            seen.handled(event_id)
+        await seen.flush()
+        self.assertEqual(os.path.getsize(self.path), 3 * RECORD_SIZE)
+
+        restarted = SeenEvents(self.path)
+        self.assertFalse(restarted.add("$b"))
+        self.assertTrue(restarted.add("$d"))
+
+    async def test_saves_only_handled_events(self):
+        seen = SeenEvents(self.path, max_size=2)
+        seen.add("$a")
+        seen.add("$b")
+        seen.handled("$a")
+        await seen.flush()
+        # Still in flight, but not processed again in this run
+        self.assertFalse(seen.add("$b"))
+
+        restarted = SeenEvents(self.path)
+        self.assertFalse(restarted.add("$a"))
+        self.assertTrue(restarted.add("$b"))
+
+        # Compacting the file leaves out unhandled events too
+        for event_id in ("$c", "$d", "$e", "$f"):
+            seen.add(event_id)
+            seen.handled(event_id)
+        seen.add("$g")
+        await seen.flush()
+        restarted = SeenEvents(self.path)
+        self.assertEqual(len(restarted), 1)
+        self.assertFalse(restarted.add("$f"))
+        self.assertTrue(restarted.add("$g"))
+
+    async def test_compacts_the_file(self):
+        seen = SeenEvents(self.path, max_size=3)
+        for index in range(10):
+            seen.add(f"${index}")
+            seen.handled(f"${index}")
+            await seen.flush()
+        self.assertLessEqual(os.path.getsize(self.path), 6 * RECORD_SIZE)
+
+        restarted = SeenEvents(self.path, max_size=3)
+        self.assertEqual(len(restarted), 3)
+        self.assertFalse(restarted.add("$9"))
+        self.assertTrue(restarted.add("$0"))
+
+    async def test_ignores_torn_records(self):
+        seen = SeenEvents(self.path)
+        seen.add("$a")
+        seen.handled("$a")
+        await seen.flush()
+        with open(self.path, "ab") as seen_file:
+            seen_file.write(b"\x01\x02")
+
+        restarted = SeenEvents(self.path)
+        self.assertFalse(restarted.add("$a"))
+        restarted.add("$b")
+        restarted.handled("$b")
+        await restarted.flush()
+        self.assertEqual(os.path.getsize(self.path), 2 * RECORD_SIZE)
+        self.assertFalse(SeenEvents(self.path).add("$a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
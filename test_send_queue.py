@@ -0,0 +1,111 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from nio import RoomSendError, RoomSendResponse
+
+from send_queue import SendQueue
+
+
+class FakeClient:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.sent = []
+
+    def add_response_callback(self, func, cb_filter) -> None:
+        pass
+
+    async def room_send(self, room_id, message_type, content, tx_id=None):
+        await asyncio.sleep(0)
+        if self.failures:
+            self.failures -= 1
+            return RoomSendError("slow down", "M_LIMIT_EXCEEDED", retry_after_ms=10)
+        self.sent.append((room_id, content["body"]))
+        return RoomSendResponse(f"$event{len(self.sent)}", room_id)
+
+
+def text(body: str) -> dict:
+    return {"msgtype": "m.text", "body": body}
+
+
+class TestSendQueue(unittest.IsolatedAsyncioTestCase):
+    async def test_orders_per_room(self):
+        client = FakeClient()
+        queue = SendQueue(client, rate=1000, burst=1000)
+        futures = [
+            await queue.put(room, text(f"{room}{index}"))
+            for index in range(5)
+            for room in ("!a", "!b")
+        ]
+        await asyncio.gather(*futures)
+
+        for room in ("!a", "!b"):
+            self.assertEqual(
+                [body for room_id, body in client.sent if room_id == room],
+                [f"{room}{index}" for index in range(5)],
+            )
+        self.assertEqual(queue.sent, 10)
+        self.assertEqual(queue.depth, 0)
+
+    async def test_drop_newest(self):
+        client = FakeClient()
+        queue = SendQueue(client, rate=1000, burst=1000, max_size=1, overflow="drop_newest")
+        first = await queue.put("!a", text("first"))
+        second = await queue.put("!a", text("second"))
+
+        self.assertIsNone(await second)
+        self.assertIsNotNone(await first)
+        self.assertEqual(client.sent, [("!a", "first")])
+        self.assertEqual(queue.dropped, 1)
+
+    async def test_drop_oldest(self):
+        client = FakeClient()
+        queue = SendQueue(client, rate=1000, burst=1000, max_size=1, overflow="drop_oldest")
+        first = await queue.put("!a", text("first"))
+        second = await queue.put("!a", text("second"))
+
+        self.assertIsNone(await first)
+        self.assertIsNotNone(await second)
+        self.assertEqual(client.sent, [("!a", "second")])
+
+    async def test_retries_rate_limited_sends(self):
+        client = FakeClient(failures=2)
+        queue = SendQueue(client, rate=1000, burst=1000, max_retries=2)
+
+        # Skip the backoff between attempts
+        with mock.patch("send_queue.random.uniform", return_value=0):
+            event_id = await (await queue.put("!a", text("hello")))
+
+        self.assertEqual(event_id, "$event1")
+        self.assertEqual(client.sent, [("!a", "hello")])
+
+    async def test_gives_up_after_retries(self):
+        client = FakeClient(failures=5)
+        queue = SendQueue(client, rate=1000, burst=1000, max_retries=0)
+        self.assertIsNone(await (await queue.put("!a", text("hello"))))
+        self.assertEqual(queue.failed, 1)
+
+    async def test_keeps_sending_after_an_unexpected_error(self):
+        client = FakeClient()
+        send = client.room_send
+
+        async def room_send(room_id, message_type, content, tx_id=None):
+            if content["body"] == "broken":
+                raise RuntimeError("unexpected")
+            return await send(room_id, message_type, content, tx_id)
+
+        client.room_send = room_send
+        queue = SendQueue(client, rate=1000, burst=1000)
+        broken = await queue.put("!a", text("broken"))
+        after = await queue.put("!a", text("after"))
+
+        # assertRaises would clear the frames of the worker still running
+        (error,) = await asyncio.gather(broken, return_exceptions=True)
+        self.assertIsInstance(error, RuntimeError)
+        self.assertEqual(await asyncio.wait_for(after, 1), "$event1")
+        self.assertEqual(client.sent, [("!a", "after")])
+        self.assertEqual(queue.failed, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
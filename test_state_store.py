@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import unittest
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+
+from nio import MatrixRoom, Receipt
+
+from state_store import RoomStateStore
+
+
+def client_with_rooms(*room_ids: str) -> SimpleNamespace:
+    rooms = {}
+    for room_id in room_ids:
+        room = MatrixRoom(room_id, "@bot:example.org")
+        room.name = f"Room {room_id}"
+        room.add_member("@bot:example.org", "Bot", None)
+        room.add_member("@phil:example.org", "Phil", "mxc://avatar")
+        room.read_receipts["@phil:example.org"] = Receipt(
+            "$event", "m.read", "@phil:example.org", 1234
+        )
+        rooms[room_id] = room
+    return SimpleNamespace(user_id="@bot:example.org", rooms=rooms)
+
+
+class TestRoomStateStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "state.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        store = RoomStateStore(self.path)
+        store.rebuild(["!a", "!b"])
+        store.prepare(client_with_rooms("!a", "!b"), "s1")()
+        store.close()
+
+        restored = SimpleNamespace(user_id="@bot:example.org", rooms={})
+        self.assertTrue(RoomStateStore(self.path).load(restored, "s1"))
+        self.assertEqual(sorted(restored.rooms), ["!a", "!b"])
+
+        room = restored.rooms["!a"]
+        self.assertEqual(room.name, "Room !a")
+        self.assertEqual(room.user_name("@phil:example.org"), "Phil")
+        self.assertEqual(room.read_receipts["@phil:example.org"].event_id, "$event")
+
+    def test_rejects_other_tokens(self):
+        store = RoomStateStore(self.path)
+        store.rebuild(["!a"])
+        store.prepare(client_with_rooms("!a"), "s1")()
+
+        restored = SimpleNamespace(user_id="@bot:example.org", rooms={})
+        self.assertFalse(store.load(restored, "s2"))
+        self.assertEqual(restored.rooms, {})
+
+    def test_only_rewrites_dirty_rooms(self):
+        store = RoomStateStore(self.path)
+        store.rebuild(["!a", "!b"])
+        store.prepare(client_with_rooms("!a", "!b"), "s1")()
+
+        client = client_with_rooms("!a")
+        client.rooms["!a"].name = "Renamed"
+        store.mark_dirty(["!a"], ["!b"])
+        store.prepare(client, "s2")()
+
+        restored = SimpleNamespace(user_id="@bot:example.org", rooms={})
+        self.assertTrue(store.load(restored, "s2"))
+        self.assertEqual(list(restored.rooms), ["!a"])
+        self.assertEqual(restored.rooms["!a"].name, "Renamed")
+
+    def test_rebuilds_after_a_failed_save(self):
+        store = RoomStateStore(self.path)
+        store.rebuild(["!a", "!b"])
+        store.prepare(client_with_rooms("!a", "!b"), "s1")()
+
+        client = client_with_rooms("!a", "!b")
+        client.rooms["!a"].name = "Renamed"
+        store.mark_dirty(["!a"])
+        other = sqlite3.connect(self.path)
+        other.execute(
+            "CREATE TRIGGER fail BEFORE INSERT ON rooms "
+            "BEGIN SELECT RAISE(ABORT, 'disk full'); END"
+        )
+        with self.assertRaises(sqlite3.Error):
+            store.prepare(client, "s2")()
+        other.execute("DROP TRIGGER fail")
+        other.close()
+
+        # The next save only sees !b change, but !a's rename isn't lost
+        store.mark_dirty(["!b"])
+        store.prepare(client, "s3")()
+        restored = SimpleNamespace(user_id="@bot:example.org", rooms={})
+        self.assertTrue(store.load(restored, "s3"))
+        self.assertEqual(sorted(restored.rooms), ["!a", "!b"])
+        self.assertEqual(restored.rooms["!a"].name, "Renamed")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import yaml
+from logbook import NullHandler
+
+from chat import Session
+from session_config import SessionConfig
+from supervisor import Supervisor
+from test_support import load_no_plugins
+
+
+class TestSupervisor(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.handler = NullHandler()
+        self.handler.push_application()
+        self.load_plugins = patch.object(Session, "load_plugins", load_no_plugins)
+        self.load_plugins.start()
+
+    def tearDown(self):
+        self.load_plugins.stop()
+        self.handler.pop_application()
+        self.directory.cleanup()
+
+    def config(self, name: str, **settings) -> SessionConfig:
+        directory = self.directory.name
+        settings = {
+            "username": name,
+            "password": "unused",
+            "base_url": "http://localhost:8008",
+            "next_batch_file": os.path.join(directory, f"{name}.next_batch"),
+            "state_store_file": os.path.join(directory, f"{name}.state"),
+            "session_file": os.path.join(directory, f"{name}.session.json"),
+            "seen_events_file": os.path.join(directory, f"{name}.seen"),
+            **settings,
+        }
+        path = os.path.join(directory, f"{name}.yml")
+        with open(path, "w") as config_file:
+            yaml.safe_dump(settings, config_file)
+        return SessionConfig(path)
+
+    async def test_sessions_share_resources(self):
+        supervisor = Supervisor(
+            [self.config("alice", metrics=True), self.config("bob", metrics=True)]
+        )
+        alice, bob = supervisor.sessions
+
+        self.assertIs(alice.shared, bob.shared)
+        self.assertIs(alice.http, bob.http)
+        self.assertIsNot(alice.client, bob.client)
+        self.assertIsNot(alice.metrics, bob.metrics)
+        await supervisor.close()
+
+    def test_rejects_shared_state_files(self):
+        alice = self.config("alice")
+        configs = [alice, self.config("bob", next_batch_file=alice.next_batch_file)]
+        with self.assertRaises(ValueError):
+            Supervisor(configs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,11 @@
+"""Helpers shared by the tests."""
+from chat import Session
+from dispatch import PluginDispatcher
+
+
+def load_no_plugins(session: Session) -> None:
+    """Stands in for `Session.load_plugins` in tests that don't need plugins.
+    """
+    # Loading the real plugins would have some write their config into the tree
+    session.plugins = {}
+    session.dispatcher = PluginDispatcher({})
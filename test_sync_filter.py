@@ -0,0 +1,67 @@
+import unittest
+
+from nio import (
+    AsyncClient,
+    Event,
+    InviteEvent,
+    RoomMessageText,
+    TypingNoticeEvent,
+)
+
+from plugin import BasePlugin
+from sync_filter import NOTHING, build_sync_filter
+
+
+class Topical(BasePlugin):
+    state_types = ["m.room.topic", "org.example.game"]
+
+    async def process_event(self, room, event, messenger) -> None:
+        pass
+
+
+class Roster(Topical):
+    state_types = ()
+    needs_all_members = True
+
+
+async def callback(*args) -> None:
+    pass
+
+
+class TestSyncFilter(unittest.TestCase):
+    def setUp(self):
+        self.client = AsyncClient("https://example.org", "@olive:example.org")
+        self.client.add_event_callback(callback, RoomMessageText)
+        self.client.add_event_callback(callback, InviteEvent)
+
+    def test_keeps_only_what_callbacks_use(self):
+        sync_filter = build_sync_filter(self.client, [Topical()])
+        room = sync_filter["room"]
+
+        self.assertIn("m.room.message", room["timeline"]["types"])
+        self.assertIn("org.example.game", room["timeline"]["types"])
+        self.assertNotIn("m.reaction", room["timeline"]["types"])
+        self.assertIn("org.example.game", room["state"]["types"])
+        self.assertTrue(room["state"]["lazy_load_members"])
+        # The state store keeps read receipts
+        self.assertEqual(room["ephemeral"], {"types": ["m.receipt"]})
+        self.assertEqual(room["account_data"], NOTHING)
+        self.assertEqual(sync_filter["presence"], NOTHING)
+        self.assertEqual(sync_filter["account_data"], NOTHING)
+
+    def test_follows_callbacks_and_plugins(self):
+        self.client.add_ephemeral_callback(callback, TypingNoticeEvent)
+        sync_filter = build_sync_filter(self.client, [Roster()])
+        room = sync_filter["room"]
+
+        self.assertEqual(room["ephemeral"], {"types": ["m.receipt", "m.typing"]})
+        self.assertFalse(room["state"]["lazy_load_members"])
+
+    def test_general_callbacks_keep_everything(self):
+        self.client.add_event_callback(callback, Event)
+        room = build_sync_filter(self.client)["room"]
+        self.assertEqual(room["timeline"], {})
+
+
+if __name__ == "__main__":
+    unittest.main()